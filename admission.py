@@ -0,0 +1,201 @@
+import logging
+import math
+import re
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, Mapping, Optional
+
+from starlette.exceptions import HTTPException
+from starlette.responses import JSONResponse
+
+logger = logging.getLogger(__name__)
+
+# Sizes such as "100MB", "512k" or "1048576"
+SIZE_PATTERN = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([KMG]?)B?\s*$", re.IGNORECASE)
+SIZE_UNITS = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+
+# WebSocket close code asking the client to try again later
+WS_TRY_AGAIN_LATER = 1013
+
+
+def parse_size(value: str) -> int:
+    """Parse a size like ``100MB`` into bytes"""
+    match = SIZE_PATTERN.match(str(value))
+    if not match:
+        raise ValueError(f"Invalid size {value!r}, expected e.g. 100MB")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()])
+
+
+class LoadShedder:
+    """Estimates the transcription backlog so new work can be turned away early
+
+    Every transcription holds its estimated audio duration while it waits for
+    or runs in a worker. With a moving average of the real-time factor, that
+    gives the expected time until a new request would finish queueing. New
+    work is shed while more than ``max_queue_depth`` jobs wait for a worker
+    or the expected wait is over ``max_wait`` seconds (0 disables a check).
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        max_queue_depth: int = 0,
+        max_wait: float = 0.0,
+        queue_depth: Optional[Callable[[], int]] = None,
+        real_time_factor: float = 0.5,
+    ):
+        self.workers = max(1, workers)
+        self.max_queue_depth = max_queue_depth
+        self.max_wait = max_wait
+        self.queue_depth = queue_depth or (lambda: 0)
+        self.real_time_factor = real_time_factor
+        self.audio_seconds = 0.0
+
+    @contextmanager
+    def track(self, audio_seconds: float) -> Iterator[None]:
+        """Count ``audio_seconds`` as in flight for the duration of the block"""
+        self.audio_seconds += audio_seconds
+        try:
+            yield
+        finally:
+            self.audio_seconds = max(0.0, self.audio_seconds - audio_seconds)
+
+    def observe(self, real_time_factor: float) -> None:
+        """Fold a measured real-time factor into the moving average"""
+        self.real_time_factor += 0.1 * (real_time_factor - self.real_time_factor)
+
+    @property
+    def expected_wait(self) -> float:
+        """Seconds the workers need for the audio already in flight"""
+        return self.audio_seconds * self.real_time_factor / self.workers
+
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.expected_wait))
+
+    def shed_reason(self) -> Optional[str]:
+        """Why new work should be rejected right now, or None to accept it"""
+        if self.max_queue_depth and self.queue_depth() >= self.max_queue_depth:
+            return "queue_depth"
+        if self.max_wait and self.expected_wait > self.max_wait:
+            return "backlog"
+        return None
+
+    def stats(self) -> dict:
+        return {
+            "audio_seconds_in_flight": round(self.audio_seconds, 3),
+            "real_time_factor": round(self.real_time_factor, 4),
+            "expected_wait": round(self.expected_wait, 3),
+            "max_queue_depth": self.max_queue_depth,
+            "max_wait": self.max_wait,
+        }
+
+
+class AdmissionMiddleware:
+    """ASGI middleware that rejects requests before their body is read
+
+    ``endpoints`` maps the paths of upload endpoints to the endpoint names
+    used by ``limits``, the maximum number of requests each one handles at a
+    time (0 for no limit); WebSocket connections count as ``websocket``.
+    Endpoints in ``shed`` also get a 503 while ``shedder`` reports overload.
+    Request bodies over ``max_upload_size`` bytes get a 413, checked against
+    Content-Length up front and against the bytes received while the body
+    streams in. ``on_reject`` is called with the endpoint and reason of every
+    rejected request.
+    """
+
+    def __init__(
+        self,
+        app,
+        endpoints: Mapping[str, str],
+        limits: Mapping[str, int],
+        max_upload_size: int = 0,
+        shedder: Optional[LoadShedder] = None,
+        shed: Iterable[str] = (),
+        on_reject: Optional[Callable[[str, str], None]] = None,
+    ):
+        self.app = app
+        self.endpoints = dict(endpoints)
+        self.limits = {endpoint: limit for endpoint, limit in limits.items() if limit > 0}
+        self.max_upload_size = max(0, max_upload_size)
+        self.shedder = shedder
+        self.shed = set(shed)
+        self.on_reject = on_reject
+        self.active: Dict[str, int] = {}
+
+    def _endpoint(self, scope) -> Optional[str]:
+        if scope["type"] == "websocket":
+            return "websocket"
+        if scope["method"] == "POST":
+            return self.endpoints.get(scope["path"])
+        return None
+
+    def _reject_reason(self, endpoint: str) -> Optional[str]:
+        limit = self.limits.get(endpoint)
+        if limit is not None and self.active.get(endpoint, 0) >= limit:
+            return "concurrency"
+        if self.shedder is not None and endpoint in self.shed:
+            return self.shedder.shed_reason()
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+
+        endpoint = self._endpoint(scope)
+        if scope["type"] == "http" and self.max_upload_size:
+            content_length = dict(scope["headers"]).get(b"content-length")
+            if content_length is not None and content_length.isdigit() and int(content_length) > self.max_upload_size:
+                self._rejected(endpoint or "other", "too_large")
+                response = JSONResponse(
+                    {"detail": f"Upload is larger than the limit of {self.max_upload_size} bytes"}, status_code=413
+                )
+                await response(scope, receive, send)
+                return
+            receive = self._limit_body(receive, endpoint or "other")
+
+        reason = self._reject_reason(endpoint) if endpoint is not None else None
+        if reason is not None:
+            self._rejected(endpoint, reason)
+            if scope["type"] == "websocket":
+                await send({"type": "websocket.close", "code": WS_TRY_AGAIN_LATER})
+                return
+            retry_after = self.shedder.retry_after() if self.shedder is not None else 1
+            response = JSONResponse(
+                {"detail": f"Server is overloaded ({reason}), retry later"},
+                status_code=503,
+                headers={"Retry-After": str(retry_after)},
+            )
+            await response(scope, receive, send)
+            return
+
+        if endpoint is None:
+            await self.app(scope, receive, send)
+            return
+        self.active[endpoint] = self.active.get(endpoint, 0) + 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.active[endpoint] -= 1
+
+    def _limit_body(self, receive, endpoint: str):
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_upload_size:
+                    self._rejected(endpoint, "too_large")
+                    # Stops the form parser; FastAPI turns it into the response
+                    raise HTTPException(
+                        status_code=413, detail=f"Upload is larger than the limit of {self.max_upload_size} bytes"
+                    )
+            return message
+
+        return limited_receive
+
+    def _rejected(self, endpoint: str, reason: str) -> None:
+        logger.warning(f"Rejected {endpoint} request: {reason}")
+        if self.on_reject is not None:
+            self.on_reject(endpoint, reason)
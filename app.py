@@ -1,142 +1,878 @@
 import os
 import json
 import asyncio
-import wave
 import logging
-from typing import Optional
-from fastapi import FastAPI, File, UploadFile, WebSocket, WebSocketDisconnect, HTTPException, Form
-from fastapi.responses import JSONResponse, HTMLResponse
-from fastapi.staticfiles import StaticFiles
-import vosk
+import functools
+import time
+import io
+import multiprocessing
+import tarfile
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Callable, Dict, Iterable, List, Optional, Tuple
+from fastapi import FastAPI, File, UploadFile, WebSocket, HTTPException, Form, Depends, Header
+from fastapi.responses import JSONResponse, HTMLResponse, Response, StreamingResponse
 import uvicorn
-from pydub import AudioSegment
-import tempfile
 import aiofiles
+from audio import PCM_CHUNK_SIZE, SAMPLE_RATE, SAMPLE_WIDTH, STREAM_CONTAINERS, decode_pcm, estimate_duration, iter_pcm_chunks, pcm_duration, split_on_silence, synthetic_speech
+from worker_pool import TranscriptionPool, PoolBusyError
+from recognizer_pool import RecognizerPool, grammar_key, parse_grammar
+from model_registry import PIN_ALL, STATE_READY, ModelRegistry, parse_pinned
+from streaming import CompressedAudioDecoder, SessionStore, SessionTimeout, StreamingSession
+from admission import AdmissionMiddleware, LoadShedder, parse_size
+from encoding import FastJSONResponse, FrameEncoder, dumps, dumps_text, loads, parse_fields, select_fields
+from vad import TimeMap, VoiceActivityDetector
+from result_cache import ResultCache
+from jobs import JobScheduler, JobStore
+from profiling import LoopLagMonitor, StackSampler, TracingMiddleware, token_matches, trace_stage
+from metrics import (
+    REGISTRY, STAGE_SECONDS, REAL_TIME_FACTOR, AUDIO_SECONDS, AUDIO_BYTES, REQUESTS, ERRORS,
+    WEBSOCKET_SESSIONS, QUEUE_DEPTH, VAD_SKIPPED_SECONDS, REJECTED, EVENT_LOOP_LAG, WORKER_RECOGNIZERS,
+)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="VOSK Speech-to-Text API", version="1.0.0")
+app = FastAPI(title="VOSK Speech-to-Text API", version="1.0.0", default_response_class=FastJSONResponse)
 
-# Model paths
-MODELS_DIR = "/app/models"
-VIETNAMESE_MODEL_PATH = os.path.join(MODELS_DIR, "vi")
-ENGLISH_MODEL_PATH = os.path.join(MODELS_DIR, "en")
+# Model paths; every directory under MODELS_DIR is a language
+MODELS_DIR = os.getenv("MODELS_DIR", "/app/models")
+VIETNAMESE_MODEL_PATH = os.getenv("VIETNAMESE_MODEL_PATH")
+ENGLISH_MODEL_PATH = os.getenv("ENGLISH_MODEL_PATH")
 
-# Global models
-models = {}
+# Bytes of models kept loaded (estimated from their size on disk); 0 means no limit
+MODEL_MEMORY_BUDGET = int(os.getenv("MODEL_MEMORY_BUDGET", 0))
+# Languages loaded at startup and never unloaded: "all" available models (the
+# default), a comma-separated list, or "none" to load every model on first use
+PINNED_MODELS = parse_pinned(os.getenv("PINNED_MODELS", PIN_ALL))
+# Models loaded at the same time on startup
+MODEL_LOAD_THREADS = int(os.getenv("MODEL_LOAD_THREADS", os.cpu_count() or 1))
+# Seconds of synthetic audio decoded by every newly loaded model (0 = no warm-up)
+MODEL_WARMUP_SECONDS = float(os.getenv("MODEL_WARMUP_SECONDS", 2))
+
+# language=auto: probe the start of the audio with each candidate model
+AUTO_LANGUAGE = "auto"
+LANGUAGE_ID_SECONDS = float(os.getenv("LANGUAGE_ID_SECONDS", 5))
+# Comma-separated languages to try; all available models when empty
+LANGUAGE_ID_CANDIDATES = [
+    language.strip() for language in os.getenv("LANGUAGE_ID_CANDIDATES", "").split(",") if language.strip()
+]
+# A candidate this sure of enough words wins immediately and the others are cancelled
+LANGUAGE_ID_CONFIDENCE = float(os.getenv("LANGUAGE_ID_CONFIDENCE", 0.85))
+LANGUAGE_ID_MIN_WORDS = int(os.getenv("LANGUAGE_ID_MIN_WORDS", 3))
+
+# Display names for /languages
+LANGUAGE_NAMES = {
+    "en": "English (US)",
+    "vi": "Vietnamese"
+}
+
+# Worker pool settings
+TRANSCRIBE_WORKERS = int(os.getenv("TRANSCRIBE_WORKERS", os.cpu_count() or 1))
+TRANSCRIBE_QUEUE_SIZE = int(os.getenv("TRANSCRIBE_QUEUE_SIZE", 32))
+
+# Target segment length when long recordings are split for parallel decoding
+LONG_AUDIO_SEGMENT_SECONDS = float(os.getenv("LONG_AUDIO_SEGMENT_SECONDS", 60))
+
+# Idle recognizers kept per language for reuse
+RECOGNIZER_POOL_SIZE = int(os.getenv("RECOGNIZER_POOL_SIZE", 8))
+# Grammars (phrase lists) whose compiled recognizers are kept, least recently used dropped first
+GRAMMAR_CACHE_SIZE = int(os.getenv("GRAMMAR_CACHE_SIZE", 32))
+
+# WebSocket streaming settings
+STREAM_DECODE_THREADS = int(os.getenv("STREAM_DECODE_THREADS", os.cpu_count() or 1))
+WS_QUEUE_SIZE = int(os.getenv("WS_QUEUE_SIZE", 64))
+WS_OVERFLOW_POLICY = os.getenv("WS_OVERFLOW_POLICY", "block")
+WS_PARTIAL_INTERVAL = float(os.getenv("WS_PARTIAL_INTERVAL", 0.2))
+# Seconds a session may last, and may go without receiving anything (0 = no limit)
+WEBSOCKET_TIMEOUT = float(os.getenv("WEBSOCKET_TIMEOUT", 300))
+WS_IDLE_TIMEOUT = float(os.getenv("WS_IDLE_TIMEOUT", 30))
+# Seconds a dropped resumable session waits for its client, and how many may wait (0 = no resuming)
+WS_RESUME_TTL = float(os.getenv("WS_RESUME_TTL", 30))
+WS_RESUME_MAX_SESSIONS = int(os.getenv("WS_RESUME_MAX_SESSIONS", 50))
+
+# Admission control: requests beyond these limits get a 413 or 503 before their upload is read
+MAX_UPLOAD_SIZE = parse_size(os.getenv("MAX_UPLOAD_SIZE", "100MB"))
+# Requests handled at a time per endpoint (0 = no limit)
+TRANSCRIBE_MAX_CONCURRENT = int(os.getenv("TRANSCRIBE_MAX_CONCURRENT", TRANSCRIBE_WORKERS + TRANSCRIBE_QUEUE_SIZE))
+BATCH_MAX_CONCURRENT = int(os.getenv("BATCH_MAX_CONCURRENT", 4))
+# Files of all /transcribe/batch requests handed to the workers at a time
+BATCH_ITEM_CONCURRENCY = int(os.getenv("BATCH_ITEM_CONCURRENCY", TRANSCRIBE_WORKERS))
+JOBS_MAX_CONCURRENT = int(os.getenv("JOBS_MAX_CONCURRENT", 16))
+WS_MAX_SESSIONS = int(os.getenv("WS_MAX_SESSIONS", 100))
+# Shed new transcriptions while this many wait for a worker, or while the
+# audio in flight would take longer than SHED_MAX_WAIT seconds to get through (0 = off)
+SHED_QUEUE_DEPTH = int(os.getenv("SHED_QUEUE_DEPTH", TRANSCRIBE_QUEUE_SIZE))
+SHED_MAX_WAIT = float(os.getenv("SHED_MAX_WAIT", 60))
+
+# Voice activity detection: skip long silences before they reach the recognizer
+VAD_ENABLED = os.getenv("VAD_ENABLED", "false").lower() == "true"
+VAD_ENERGY_THRESHOLD = float(os.getenv("VAD_ENERGY_THRESHOLD", -45))
+VAD_ZCR_THRESHOLD = float(os.getenv("VAD_ZCR_THRESHOLD", 0.25))
+VAD_HANGOVER_MS = int(os.getenv("VAD_HANGOVER_MS", 300))
+VAD_MAX_SILENCE_MS = int(os.getenv("VAD_MAX_SILENCE_MS", 1000))
+
+# Result cache settings
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", 1024))
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR") or None
+# Size the on-disk results are pruned to, least recently used first (0 = no limit)
+RESULT_CACHE_DISK_MAX_BYTES = parse_size(os.getenv("RESULT_CACHE_DISK_MAX_BYTES", "1GB"))
+
+# Asynchronous job settings
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", "jobs.db")
+JOB_CONCURRENCY = int(os.getenv("JOB_CONCURRENCY", TRANSCRIBE_WORKERS))
+JOB_MAX_WAIT = 60
+
+# Diagnostics: the /admin endpoints and request tracing need this token (unset = disabled)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+PROFILE_MAX_SECONDS = 60
+# Log the blocking code when the event loop stalls for longer than this (seconds, 0 = off)
+LOOP_LAG_THRESHOLD = float(os.getenv("LOOP_LAG_THRESHOLD", 0.5))
+
+# Response formats for /transcribe with stream=...
+STREAM_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "sse": "text/event-stream"
+}
+
+# Files accepted by one batch request, including archive members
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", 10000))
+# Uncompressed bytes the archives of one batch may extract to
+BATCH_MAX_EXTRACTED_BYTES = parse_size(os.getenv("BATCH_MAX_EXTRACTED_BYTES", str(MAX_UPLOAD_SIZE)))
+
+# Global models, loaded on first use
+models = ModelRegistry(
+    MODELS_DIR,
+    paths={language: path for language, path in (("vi", VIETNAMESE_MODEL_PATH), ("en", ENGLISH_MODEL_PATH)) if path},
+    memory_budget=MODEL_MEMORY_BUDGET,
+    pinned=PINNED_MODELS,
+)
+
+# Reusable recognizers; each worker process gets its own copy
+recognizer_pool = RecognizerPool(models, RECOGNIZER_POOL_SIZE, GRAMMAR_CACHE_SIZE)
+models.on_evict = recognizer_pool.clear
+
+# Recognizer pool counters reported by the transcription workers, which each
+# have their own pool; recognizer_pool here only serves WebSocket sessions
+worker_recognizer_counters = {"hits": 0, "misses": 0, "discarded": 0}
+
+# Transcription results keyed by audio content and options
+result_cache = ResultCache(RESULT_CACHE_SIZE, RESULT_CACHE_MAX_BYTES, RESULT_CACHE_DIR, RESULT_CACHE_DISK_MAX_BYTES)
+
+# Threads that run WebSocket decoding off the event loop
+stream_executor = ThreadPoolExecutor(max_workers=STREAM_DECODE_THREADS, thread_name_prefix="stream-decode")
+
+# Process pool for file transcription, created on startup
+transcription_pool: Optional[TranscriptionPool] = None
+
+# Limits the batch files in the transcription pool, created on startup
+batch_slots: Optional[asyncio.Semaphore] = None
+
+# Background job queue, created on startup
+job_scheduler: Optional[JobScheduler] = None
+
+# Whether startup requeues jobs left running by a previous run; server.py
+# does that once in its master process instead
+recover_interrupted_jobs = True
+
+# Whether startup finishes before the server accepts connections. server.py
+# sets it: its workers share one socket with workers that are ready, and the
+# models are already loaded in the master, so starting up is quick
+wait_for_startup = False
+
+# Loads the models and starts the workers in the background, so the server
+# answers liveness probes meanwhile; service_ready is set once it is done
+startup_task: Optional[asyncio.Task] = None
+service_ready = False
+
+# Open WebSocket sessions
+active_sessions = set()
+# Resumable WebSocket sessions, while connected and after a drop
+session_store = SessionStore(WS_RESUME_TTL, WS_RESUME_MAX_SESSIONS)
+
+# Audio waiting for or being transcribed, used to turn away work early
+load_shedder = LoadShedder(
+    TRANSCRIBE_WORKERS,
+    max_queue_depth=SHED_QUEUE_DEPTH,
+    max_wait=SHED_MAX_WAIT,
+    # Background work (batch files) never gets interactive requests shed
+    queue_depth=lambda: max(0, transcription_pool.queue_depth - transcription_pool.background) if transcription_pool else 0,
+)
+
+app.add_middleware(
+    AdmissionMiddleware,
+    endpoints={"/transcribe": "transcribe", "/transcribe/batch": "batch", "/jobs": "jobs"},
+    limits={
+        "transcribe": TRANSCRIBE_MAX_CONCURRENT,
+        "batch": BATCH_MAX_CONCURRENT,
+        "jobs": JOBS_MAX_CONCURRENT,
+        "websocket": WS_MAX_SESSIONS,
+    },
+    max_upload_size=MAX_UPLOAD_SIZE,
+    shedder=load_shedder,
+    # Jobs are queued in the database, so they are never shed
+    shed=("transcribe", "batch"),
+    on_reject=lambda endpoint, reason: REJECTED.inc(endpoint=endpoint, reason=reason),
+)
+app.add_middleware(TracingMiddleware, admin_token=ADMIN_TOKEN)
+
+loop_monitor = LoopLagMonitor(LOOP_LAG_THRESHOLD, on_lag=EVENT_LOOP_LAG.observe)
+# Only one sampling profile runs at a time
+profile_running = False
 
 def load_models():
-    """Load VOSK models for supported languages"""
-    global models
-    
+    """Discover available models and load the pinned ones in parallel"""
     try:
-        if os.path.exists(VIETNAMESE_MODEL_PATH):
-            logger.info("Loading Vietnamese model...")
-            models["vi"] = vosk.Model(VIETNAMESE_MODEL_PATH)
-            logger.info("Vietnamese model loaded successfully")
-        else:
-            logger.warning(f"Vietnamese model not found at {VIETNAMESE_MODEL_PATH}")
-            
-        if os.path.exists(ENGLISH_MODEL_PATH):
-            logger.info("Loading English model...")
-            models["en"] = vosk.Model(ENGLISH_MODEL_PATH)
-            logger.info("English model loaded successfully")
-        else:
-            logger.warning(f"English model not found at {ENGLISH_MODEL_PATH}")
-            
+        available = models.refresh()
+        if not available:
+            logger.warning(f"No models found in {MODELS_DIR}")
+        models.load_pinned(MODEL_LOAD_THREADS)
     except Exception as e:
         logger.error(f"Error loading models: {e}")
         raise
 
-def convert_to_wav(audio_file_path: str, output_path: str) -> str:
-    """Convert audio file to WAV format with correct parameters for VOSK"""
-    try:
-        audio = AudioSegment.from_file(audio_file_path)
-        # Convert to mono, 16kHz, 16-bit
-        audio = audio.set_channels(1).set_frame_rate(16000).set_sample_width(2)
-        audio.export(output_path, format="wav")
-        return output_path
-    except Exception as e:
-        logger.error(f"Error converting audio: {e}")
-        raise
+def warm_up_model(language: str) -> None:
+    """Decode synthetic audio with a new model, so the first request doesn't pay for cold caches
+    
+    The recognizer goes back to the pool, so the first request also finds one ready.
+    """
+    if MODEL_WARMUP_SECONDS <= 0:
+        return
+    pcm = synthetic_speech(MODEL_WARMUP_SECONDS)
+    with recognizer_pool.checkout(language, SAMPLE_RATE) as rec:
+        for offset in range(0, len(pcm), PCM_CHUNK_SIZE):
+            rec.AcceptWaveform(pcm[offset:offset + PCM_CHUNK_SIZE])
+        rec.FinalResult()
 
-def transcribe_audio(audio_file_path: str, language: str = "en") -> dict:
-    """Transcribe audio file using VOSK"""
-    if language not in models:
-        raise ValueError(f"Language {language} not supported. Available: {list(models.keys())}")
+models.on_load = warm_up_model
+
+def init_worker():
+    """Load models in a transcription worker process"""
+    # Workers forked after startup already share the parent's pinned models
+    if not models.loaded:
+        load_models()
+
+def create_vad() -> Optional[VoiceActivityDetector]:
+    """A voice activity detector with the configured settings, or None when VAD is off"""
+    if not VAD_ENABLED:
+        return None
+    return VoiceActivityDetector(
+        SAMPLE_RATE,
+        energy_threshold=VAD_ENERGY_THRESHOLD,
+        zcr_threshold=VAD_ZCR_THRESHOLD,
+        hangover_ms=VAD_HANGOVER_MS,
+        max_silence_ms=VAD_MAX_SILENCE_MS,
+    )
+
+def shift_word_times(result: dict, offset: float, time_map: Optional[TimeMap] = None) -> dict:
+    """Move word timestamps of a recognizer result by ``offset`` seconds
     
-    try:
-        # Convert to WAV if necessary
-        if not audio_file_path.endswith('.wav'):
-            with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as temp_wav:
-                wav_path = temp_wav.name
-            convert_to_wav(audio_file_path, wav_path)
-        else:
-            wav_path = audio_file_path
-        
-        # Open WAV file
-        wf = wave.open(wav_path, 'rb')
-        
-        # Check audio format
-        if wf.getnchannels() != 1 or wf.getsampwidth() != 2 or wf.getframerate() != 16000:
-            wf.close()
-            # Convert to correct format
-            with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as temp_wav:
-                correct_wav_path = temp_wav.name
-            convert_to_wav(wav_path, correct_wav_path)
-            wf = wave.open(correct_wav_path, 'rb')
-        
-        # Create recognizer
-        rec = vosk.KaldiRecognizer(models[language], wf.getframerate())
-        rec.SetWords(True)
-        
-        results = []
-        final_result = ""
-        
-        # Process audio in chunks
+    ``time_map`` first maps them from silence-compressed audio back to the original.
+    """
+    if time_map is not None:
+        time_map.remap_result(result)
+    for word in result.get("result", []):
+        word["start"] = round(word["start"] + offset, 6)
+        word["end"] = round(word["end"] + offset, 6)
+    return result
+
+def recognize_pcm(chunks: Iterable[bytes], language: str, time_offset: float = 0.0,
+                  timings: Optional[Dict[str, float]] = None,
+                  on_result: Optional[Callable[[dict], None]] = None,
+                  grammar: Optional[str] = None) -> Tuple[List[dict], dict]:
+    """Run PCM chunks through a recognizer, restricted to ``grammar`` if given
+
+    Returns the finalized utterance results that contain text, and the final result.
+    With ``on_result``, each utterance is passed to it as soon as the
+    recognizer finalizes it instead of being collected.
+    When ``timings`` is given, it receives the seconds spent producing PCM
+    ("convert"), in the recognizer ("decode"), and the audio duration.
+    """
+    results = []
+    convert_seconds = decode_seconds = 0.0
+    audio_bytes = 0
+    vad = create_vad()
+    time_map = vad.time_map if vad is not None else None
+    chunks = iter(chunks if vad is None else vad.filter(chunks))
+    with recognizer_pool.checkout(language, SAMPLE_RATE, grammar) as rec:
         while True:
-            data = wf.readframes(4000)
-            if len(data) == 0:
+            started = time.perf_counter()
+            data = next(chunks, None)
+            decoded = time.perf_counter()
+            convert_seconds += decoded - started
+            if data is None:
                 break
+            audio_bytes += len(data)
             if rec.AcceptWaveform(data):
-                result = json.loads(rec.Result())
+                result = loads(rec.Result())
                 if result.get("text"):
-                    results.append(result)
-                    final_result += result["text"] + " "
+                    (on_result or results.append)(shift_word_times(result, time_offset, time_map))
+            decode_seconds += time.perf_counter() - decoded
         
-        # Get final result
-        final_result_json = json.loads(rec.FinalResult())
-        if final_result_json.get("text"):
-            final_result += final_result_json["text"]
+        started = time.perf_counter()
+        final_result_json = shift_word_times(loads(rec.FinalResult()), time_offset, time_map)
+        decode_seconds += time.perf_counter() - started
+    
+    if timings is not None:
+        timings.update(convert=convert_seconds, decode=decode_seconds, audio_seconds=pcm_duration(audio_bytes))
+        if vad is not None:
+            timings.update(audio_seconds=pcm_duration(vad.input_bytes), vad_skipped=vad.dropped_seconds)
+    return results, final_result_json
+
+def transcribe_audio(audio: bytes, language: str = "en", timings: Optional[Dict[str, float]] = None,
+                     on_result: Optional[Callable[[dict], None]] = None, grammar: Optional[str] = None) -> dict:
+    """Transcribe in-memory audio using VOSK
+    
+    With ``on_result``, utterances (including the final one) are passed to it
+    as they are recognized and left out of ``detailed_results``. With a
+    ``grammar``, only its phrases are recognized.
+    """
+    if language not in models:
+        raise ValueError(f"Language {language} not supported. Available: {list(models.keys())}")
+    
+    try:
+        texts = []
         
-        wf.close()
+        def emit(result: dict) -> None:
+            texts.append(result["text"])
+            on_result(result)
         
-        # Clean up temporary files
-        if wav_path != audio_file_path:
-            os.unlink(wav_path)
+        # Feed PCM to the recognizer as soon as it is decoded
+        results, final_result_json = recognize_pcm(
+            iter_pcm_chunks(audio), language, timings=timings, on_result=emit if on_result else None,
+            grammar=grammar
+        )
+        
+        texts.extend(result["text"] for result in results)
+        if final_result_json.get("text"):
+            if on_result:
+                emit(final_result_json)
+            else:
+                texts.append(final_result_json["text"])
         
         return {
             "success": True,
             "language": language,
-            "text": final_result.strip(),
+            "text": " ".join(texts),
             "detailed_results": results,
             "confidence": final_result_json.get("confidence", 0)
         }
         
     except Exception as e:
         logger.error(f"Error transcribing audio: {e}")
+        if timings is not None:
+            timings["error"] = type(e).__name__
+        return {
+            "success": False,
+            "error": str(e)
+        }
+
+def recognizer_counters_since(before: Dict[str, int]) -> Dict[str, float]:
+    """The recognizer pool counters of this process since ``before``, as timings keys for the parent"""
+    return {f"recognizer_{name}": count - before[name] for name, count in recognizer_pool.counters().items()}
+
+def run_transcription(audio: bytes, language: str, grammar: Optional[str] = None) -> Tuple[dict, Dict[str, float]]:
+    """Worker entry point returning the transcription and its stage timings"""
+    before = recognizer_pool.counters()
+    timings = {}
+    result = transcribe_audio(audio, language, timings, grammar=grammar)
+    timings.update(recognizer_counters_since(before))
+    return result, timings
+
+def stream_transcription(audio: bytes, language: str, conn, grammar: Optional[str] = None) -> Tuple[dict, Dict[str, float]]:
+    """Worker entry point sending each utterance through the pipe ``conn`` as soon as it is final"""
+    before = recognizer_pool.counters()
+    timings = {}
+    try:
+        result = transcribe_audio(audio, language, timings, on_result=conn.send, grammar=grammar)
+    finally:
+        conn.close()
+    timings.update(recognizer_counters_since(before))
+    return result, timings
+
+def language_score(words: List[dict]) -> float:
+    """Mean word confidence, shrunk towards zero when there are few words"""
+    return sum(word.get("conf", 0) for word in words) / (len(words) + 1)
+
+def identify_language(audio: bytes, candidates: List[str]) -> Tuple[str, Dict[str, Optional[float]], Dict[str, float]]:
+    """Worker entry point picking the language whose model recognizes the start of ``audio`` best
+    
+    Every candidate decodes the first ``LANGUAGE_ID_SECONDS`` in its own
+    thread. Once one finalizes ``LANGUAGE_ID_MIN_WORDS`` words with a mean
+    confidence of ``LANGUAGE_ID_CONFIDENCE``, it wins and the others stop;
+    otherwise the best score after the probe wins. Cancelled candidates
+    have no score.
+    """
+    if not candidates:
+        raise ValueError("No models available for language identification")
+    
+    started = time.perf_counter()
+    before = recognizer_pool.counters()
+    probe_bytes = int(LANGUAGE_ID_SECONDS * SAMPLE_RATE) * SAMPLE_WIDTH
+    probe = []
+    size = 0
+    pcm_chunks = iter_pcm_chunks(audio)
+    try:
+        for chunk in pcm_chunks:
+            probe.append(chunk)
+            size += len(chunk)
+            if size >= probe_bytes:
+                break
+    finally:
+        # Stops the decoder without reading the rest of the file
+        pcm_chunks.close()
+    convert_seconds = time.perf_counter() - started
+    
+    decided = threading.Event()
+    winner = []
+    lock = threading.Lock()
+    
+    def probe_language(language: str) -> Optional[float]:
+        words = []
+        with recognizer_pool.checkout(language, SAMPLE_RATE) as rec:
+            for chunk in probe:
+                if decided.is_set():
+                    return None
+                if rec.AcceptWaveform(chunk):
+                    words.extend(loads(rec.Result()).get("result", []))
+                    mean = sum(word.get("conf", 0) for word in words) / len(words) if words else 0
+                    if len(words) >= LANGUAGE_ID_MIN_WORDS and mean >= LANGUAGE_ID_CONFIDENCE:
+                        with lock:
+                            if decided.is_set():
+                                return None
+                            winner.append(language)
+                            decided.set()
+                        return language_score(words)
+            if decided.is_set():
+                return None
+            words.extend(loads(rec.FinalResult()).get("result", []))
+        return language_score(words)
+    
+    with ThreadPoolExecutor(max_workers=len(candidates)) as executor:
+        scores = dict(zip(candidates, executor.map(probe_language, candidates)))
+    
+    if winner:
+        language = winner[0]
+    else:
+        # Ties go to the first candidate
+        language = max(candidates, key=lambda candidate: scores[candidate] or 0.0)
+    scores = {candidate: round(score, 4) if score is not None else None for candidate, score in scores.items()}
+    timings = {
+        "convert": convert_seconds,
+        "language_id": time.perf_counter() - started,
+        **recognizer_counters_since(before),
+    }
+    return language, scores, timings
+
+def timed_decode_pcm(audio: bytes) -> Tuple[bytes, float]:
+    """Worker entry point decoding a whole file, with the time it took"""
+    started = time.perf_counter()
+    pcm = decode_pcm(audio)
+    return pcm, time.perf_counter() - started
+
+def transcribe_segment(pcm: bytes, language: str, time_offset: float,
+                       grammar: Optional[str] = None) -> Tuple[List[dict], dict, Dict[str, float]]:
+    """Transcribe one segment of a long recording in a worker process"""
+    before = recognizer_pool.counters()
+    timings = {}
+    results, final_result_json = recognize_pcm(
+        (pcm[start:start + PCM_CHUNK_SIZE] for start in range(0, len(pcm), PCM_CHUNK_SIZE)),
+        language,
+        time_offset,
+        timings,
+        grammar=grammar,
+    )
+    timings.update(recognizer_counters_since(before))
+    return results, final_result_json, timings
+
+def observe_stage(stage: str, seconds: float) -> None:
+    """Export the time spent in a pipeline stage, and add it to the trace of a traced request"""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    trace_stage(stage, seconds)
+
+def record_recognizer_counters(timings: Dict[str, float]) -> None:
+    """Add the recognizer pool counters reported by a worker to the totals"""
+    for name in worker_recognizer_counters:
+        count = timings.get(f"recognizer_{name}", 0)
+        if count:
+            worker_recognizer_counters[name] += count
+            WORKER_RECOGNIZERS.inc(count, event=name)
+
+def worker_recognizer_stats() -> dict:
+    lookups = worker_recognizer_counters["hits"] + worker_recognizer_counters["misses"]
+    return {
+        **worker_recognizer_counters,
+        "hit_rate": round(worker_recognizer_counters["hits"] / lookups, 4) if lookups else 0.0,
+    }
+
+def record_transcription(endpoint: str, language: str, timings: Dict[str, float]) -> None:
+    """Export the stage timings reported by a worker"""
+    record_recognizer_counters(timings)
+    if "error" in timings:
+        ERRORS.inc(endpoint=endpoint, type=timings["error"])
+    if "convert" in timings:
+        observe_stage("convert", timings["convert"])
+    if "decode" in timings:
+        observe_stage("decode", timings["decode"])
+    if timings.get("vad_skipped"):
+        VAD_SKIPPED_SECONDS.inc(timings["vad_skipped"], language=language, endpoint=endpoint)
+    audio_seconds = timings.get("audio_seconds", 0)
+    if audio_seconds > 0:
+        AUDIO_SECONDS.inc(audio_seconds, language=language, endpoint=endpoint)
+        processing = timings.get("convert", 0) + timings.get("decode", 0)
+        REAL_TIME_FACTOR.observe(processing / audio_seconds, language=language, endpoint=endpoint)
+        if endpoint != "websocket":
+            load_shedder.observe(processing / audio_seconds)
+
+async def transcribe_in_pool(audio: bytes, language: str, endpoint: str, wait: bool = False,
+                             grammar: Optional[str] = None, background: bool = False) -> dict:
+    """Transcribe in a worker process and record its metrics"""
+    started = time.perf_counter()
+    result, timings = await transcription_pool.run(
+        run_transcription, audio, language, grammar, wait=wait, background=background
+    )
+    # Whatever the worker didn't spend converting or decoding went to waiting for it
+    trace_stage("queue", max(0.0, time.perf_counter() - started - timings.get("convert", 0) - timings.get("decode", 0)))
+    record_transcription(endpoint, language, timings)
+    return result
+
+def language_candidates() -> List[str]:
+    return [language for language in LANGUAGE_ID_CANDIDATES if language in models] or list(models)
+
+async def resolve_language(audio: bytes, language: str, wait: bool = False,
+                           background: bool = False) -> Tuple[str, Optional[dict]]:
+    """Replace ``auto`` by the language identified from the audio, with the candidates' scores"""
+    if language != AUTO_LANGUAGE:
+        return language, None
+    detected, scores, timings = await transcription_pool.run(
+        identify_language, audio, language_candidates(), wait=wait, background=background
+    )
+    observe_stage("language_id", timings["language_id"])
+    record_recognizer_counters(timings)
+    logger.info(f"Identified language {detected} in {timings['language_id']:.2f}s (scores: {scores})")
+    return detected, scores
+
+def check_grammar(value: Optional[str]) -> Optional[str]:
+    """Parse a request's phrase list, rejecting a malformed one"""
+    try:
+        return parse_grammar(value)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def check_language(language: str) -> None:
+    """Reject a request for a language without a model"""
+    if language != AUTO_LANGUAGE and language not in models:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Language {language} not supported. Available: {list(models.keys())}"
+        )
+
+async def read_upload(file: UploadFile, endpoint: str) -> bytes:
+    """Read an uploaded file, recording how long it took"""
+    started = time.perf_counter()
+    content = await file.read()
+    observe_stage("upload_read", time.perf_counter() - started)
+    AUDIO_BYTES.inc(len(content), endpoint=endpoint)
+    return content
+
+async def start_long_audio(audio: bytes, language: str, wait: bool = False,
+                           grammar: Optional[str] = None) -> Tuple[float, float, List[asyncio.Task]]:
+    """Decode a long recording and start transcribing its silence-separated segments in parallel
+    
+    Returns the decode time, the audio duration and one task per segment, in order.
+    """
+    pcm, convert_seconds = await transcription_pool.run(timed_decode_pcm, audio, wait=wait)
+    segments = await asyncio.get_running_loop().run_in_executor(
+        None, split_on_silence, pcm, LONG_AUDIO_SEGMENT_SECONDS
+    )
+    logger.info(f"Transcribing {pcm_duration(len(pcm)):.1f}s of audio in {len(segments)} segments")
+    
+    view = memoryview(pcm)
+    # Only as many segments as there are workers are copied out of the recording at a time
+    submitting = asyncio.Semaphore(transcription_pool.workers)
+    
+    async def run_segment(start: int, end: int) -> Tuple[List[dict], dict, Dict[str, float]]:
+        async with submitting:
+            # Segments wait for a free worker rather than failing the request halfway through
+            return await transcription_pool.run(
+                transcribe_segment, bytes(view[start:end]), language, pcm_duration(start), grammar, wait=True
+            )
+    
+    tasks = [asyncio.ensure_future(run_segment(start, end)) for start, end in segments]
+    return convert_seconds, pcm_duration(len(pcm)), tasks
+
+async def transcribe_long_audio(audio: bytes, language: str, endpoint: str = "transcribe",
+                                grammar: Optional[str] = None) -> dict:
+    """Transcribe a long recording by decoding silence-separated segments in parallel"""
+    if language not in models:
+        raise ValueError(f"Language {language} not supported. Available: {list(models.keys())}")
+    
+    tasks = []
+    try:
+        convert_seconds, audio_seconds, tasks = await start_long_audio(audio, language, grammar=grammar)
+        segment_results = await asyncio.gather(*tasks)
+    except PoolBusyError:
+        raise
+    except Exception as e:
+        logger.error(f"Error transcribing audio: {e}")
+        ERRORS.inc(endpoint=endpoint, type=type(e).__name__)
         return {
             "success": False,
             "error": str(e)
         }
+    finally:
+        # One failed segment fails the whole recording, so stop the others
+        for task in tasks:
+            task.cancel()
+    
+    # Each segment's final result is a complete utterance of its own
+    results = []
+    timings = {"convert": convert_seconds, "decode": 0.0, "audio_seconds": audio_seconds, "vad_skipped": 0.0}
+    for segment_utterances, segment_final, segment_timings in segment_results:
+        results.extend(segment_utterances)
+        if segment_final.get("text"):
+            results.append(segment_final)
+        timings["decode"] += segment_timings["decode"]
+        timings["vad_skipped"] += segment_timings.get("vad_skipped", 0.0)
+        record_recognizer_counters(segment_timings)
+    final_result_json = segment_results[-1][1]
+    record_transcription(endpoint, language, timings)
+    
+    return {
+        "success": True,
+        "language": language,
+        "text": " ".join(result["text"] for result in results),
+        "detailed_results": results,
+        "confidence": final_result_json.get("confidence", 0)
+    }
+
+async def transcribe_upload(audio: bytes, language: str, endpoint: str, long_audio: bool = False,
+                            wait: bool = False, grammar: Optional[str] = None, background: bool = False) -> dict:
+    """Transcribe a file, first identifying its language when ``language`` is ``auto``
+    
+    Language identification always uses the full vocabulary; ``grammar``
+    only restricts the transcription. ``background`` work takes no queue
+    slot in the pool and is left out of the load shedder's backlog, so the
+    caller has to limit it.
+    """
+    with load_shedder.track(0.0 if background else estimate_duration(audio)):
+        try:
+            language, language_scores = await resolve_language(audio, language, wait=wait, background=background)
+        except PoolBusyError:
+            raise
+        except Exception as e:
+            logger.error(f"Error identifying language: {e}")
+            ERRORS.inc(endpoint=endpoint, type=type(e).__name__)
+            return {
+                "success": False,
+                "error": str(e)
+            }
+        
+        if long_audio:
+            result = await transcribe_long_audio(audio, language, endpoint, grammar)
+        else:
+            result = await transcribe_in_pool(
+                audio, language, endpoint, wait=wait, grammar=grammar, background=background
+            )
+    if language_scores is not None:
+        result["language_scores"] = language_scores
+    return result
+
+def summary_record(result: dict) -> dict:
+    """The last record of a streamed transcription"""
+    if not result.get("success"):
+        return {"type": "error", **result}
+    return {"type": "final", **{key: value for key, value in result.items() if key != "detailed_results"}}
+
+async def stream_in_pool(audio: bytes, language: str, endpoint: str,
+                         grammar: Optional[str] = None) -> AsyncIterator[dict]:
+    """Transcribe in a worker process, yielding each utterance as soon as it is final and then a summary"""
+    loop = asyncio.get_running_loop()
+    reader, writer = multiprocessing.Pipe(duplex=False)
+    readable = asyncio.Event()
+    loop.add_reader(reader.fileno(), readable.set)
+    task = asyncio.ensure_future(
+        transcription_pool.run(stream_transcription, audio, language, writer, grammar, wait=True)
+    )
+    try:
+        while True:
+            # The worker sends every utterance before it returns
+            done = task.done()
+            while reader.poll():
+                yield {"type": "result", **reader.recv()}
+            if done:
+                break
+            readable.clear()
+            waiter = asyncio.ensure_future(readable.wait())
+            await asyncio.wait({task, waiter}, return_when=asyncio.FIRST_COMPLETED)
+            waiter.cancel()
+        result, timings = task.result()
+    finally:
+        # A worker still decoding fails on its next send and stops
+        loop.remove_reader(reader.fileno())
+        reader.close()
+        writer.close()
+        task.cancel()
+    
+    record_transcription(endpoint, language, timings)
+    yield summary_record(result)
+
+async def stream_long_audio(audio: bytes, language: str, endpoint: str,
+                            grammar: Optional[str] = None) -> AsyncIterator[dict]:
+    """Transcribe a long recording in parallel segments, yielding utterances in order and then a summary"""
+    convert_seconds, audio_seconds, tasks = await start_long_audio(audio, language, wait=True, grammar=grammar)
+    texts = []
+    final_result_json = {}
+    timings = {"convert": convert_seconds, "decode": 0.0, "audio_seconds": audio_seconds, "vad_skipped": 0.0}
+    try:
+        for task in tasks:
+            segment_utterances, final_result_json, segment_timings = await task
+            timings["decode"] += segment_timings["decode"]
+            timings["vad_skipped"] += segment_timings.get("vad_skipped", 0.0)
+            record_recognizer_counters(segment_timings)
+            if final_result_json.get("text"):
+                segment_utterances.append(final_result_json)
+            for result in segment_utterances:
+                texts.append(result["text"])
+                yield {"type": "result", **result}
+    finally:
+        for task in tasks:
+            task.cancel()
+    
+    record_transcription(endpoint, language, timings)
+    yield summary_record({
+        "success": True,
+        "language": language,
+        "text": " ".join(texts),
+        "confidence": final_result_json.get("confidence", 0)
+    })
+
+def format_stream_record(record: dict, stream_format: str, fields: Optional[frozenset] = None) -> str:
+    if record["type"] in ("result", "final"):
+        record = select_fields(record, fields)
+    if stream_format == "sse":
+        return f"event: {record['type']}\ndata: {dumps_text(record)}\n\n"
+    return dumps_text(record) + "\n"
+
+def check_fields(value: Optional[str]) -> Optional[frozenset]:
+    try:
+        return parse_fields(value)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def check_archive_size(filename: str, sizes: List[int], max_files: int, max_bytes: int) -> None:
+    """Reject an archive by its member count and uncompressed size, before anything is extracted"""
+    if len(sizes) > max_files:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Archive {filename} has {len(sizes)} files, only {max_files} more fit in the batch"
+        )
+    if sum(sizes) > max_bytes:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Archive {filename} extracts to {sum(sizes)} bytes, only {max_bytes} more fit in the batch"
+        )
+
+def extract_archive(filename: str, content: bytes, max_files: int, max_bytes: int) -> List[Tuple[str, bytes]]:
+    """Return ``(name, bytes)`` for each file in a zip or tar archive
+    
+    Archives with more than ``max_files`` files or ``max_bytes`` of
+    uncompressed data are rejected with a 413 from their headers, so an
+    archive bomb is never expanded. Both formats stop reading a member at
+    its declared size.
+    """
+    if zipfile.is_zipfile(io.BytesIO(content)):
+        with zipfile.ZipFile(io.BytesIO(content)) as archive:
+            infos = [
+                info for info in archive.infolist()
+                if not info.is_dir() and not info.filename.startswith("__MACOSX/")
+            ]
+            check_archive_size(filename, [info.file_size for info in infos], max_files, max_bytes)
+            return [(info.filename, archive.read(info)) for info in infos]
+    with tarfile.open(fileobj=io.BytesIO(content)) as archive:
+        infos = [info for info in archive.getmembers() if info.isfile()]
+        check_archive_size(filename, [info.size for info in infos], max_files, max_bytes)
+        return [(info.name, archive.extractfile(info).read()) for info in infos]
+
+def is_archive(filename: str) -> bool:
+    return filename.lower().endswith((".zip", ".tar", ".tar.gz", ".tgz"))
+
+async def run_job(audio: bytes, language: str, options: dict) -> dict:
+    """Transcribe the audio of a queued job"""
+    # Jobs were already accepted, so wait for a worker instead of failing
+    return await transcribe_upload(
+        audio, language, "jobs", options.get("long_audio", False), wait=True, grammar=options.get("grammar")
+    )
+
+async def start_service():
+    """Load the models, then start the workers, which inherit them"""
+    global service_ready
+    started = time.perf_counter()
+    try:
+        await asyncio.get_running_loop().run_in_executor(None, load_models)
+    except Exception:
+        # Not ready; /ready reports the failed models
+        return
+    logger.info(f"Available languages: {list(models.keys())}, loaded: {models.loaded}")
+    transcription_pool.start()
+    await job_scheduler.start()
+    service_ready = True
+    logger.info(f"Service ready in {time.perf_counter() - started:.1f}s")
+
+def readiness() -> Tuple[bool, str]:
+    """Whether the service should get traffic, and a short status"""
+    if not service_ready:
+        if startup_task is not None and startup_task.done():
+            return False, "failed"
+        return False, "starting"
+    if not len(models):
+        return False, "no models"
+    # Every model loaded at startup must be loaded and warm, not just the first to finish
+    if any(models.state(language) != STATE_READY for language in models.pinned if language in models):
+        return False, "models not ready"
+    return True, "ready"
+
+def check_ready() -> None:
+    """Reject requests that need the transcription workers before they are up"""
+    if not service_ready:
+        raise HTTPException(status_code=503, detail="Service is starting", headers={"Retry-After": "5"})
 
 @app.on_event("startup")
 async def startup_event():
-    """Load models on startup"""
-    load_models()
-    logger.info(f"Available languages: {list(models.keys())}")
+    """Start loading models; the server accepts connections meanwhile"""
+    global transcription_pool, batch_slots, job_scheduler, startup_task
+    transcription_pool = TranscriptionPool(TRANSCRIBE_WORKERS, TRANSCRIBE_QUEUE_SIZE, initializer=init_worker)
+    batch_slots = asyncio.Semaphore(max(1, BATCH_ITEM_CONCURRENCY))
+    # Jobs submitted during startup wait in the queue
+    job_scheduler = JobScheduler(
+        JobStore(JOBS_DB_PATH), run_job, JOB_CONCURRENCY, recover_interrupted=recover_interrupted_jobs
+    )
+    startup_task = asyncio.create_task(start_service())
+    
+    QUEUE_DEPTH.set_function(lambda: transcription_pool.queue_depth, queue="transcription")
+    QUEUE_DEPTH.set_function(lambda: job_scheduler.queue_depth, queue="jobs")
+    QUEUE_DEPTH.set_function(lambda: sum(session.queue.qsize() for session in active_sessions), queue="websocket_frames")
+    if LOOP_LAG_THRESHOLD > 0:
+        loop_monitor.start()
+    if wait_for_startup:
+        await startup_task
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop background jobs and transcription workers"""
+    loop_monitor.stop()
+    if startup_task is not None and not startup_task.done():
+        startup_task.cancel()
+    if job_scheduler is not None:
+        await job_scheduler.stop()
+        job_scheduler.store.close()
+    session_store.close()
+    if transcription_pool is not None:
+        transcription_pool.shutdown()
+    stream_executor.shutdown(wait=False, cancel_futures=True)
 
 @app.get("/", response_class=HTMLResponse)
 async def get_index():
@@ -247,81 +983,434 @@ async def get_simple_interface():
 @app.post("/transcribe")
 async def transcribe_file(
     file: UploadFile = File(...),
-    language: str = Form(default="en")
+    language: str = Form(default="en"),
+    long_audio: bool = Form(default=False),
+    no_cache: bool = Form(default=False),
+    stream: Optional[str] = Form(default=None),
+    fields: Optional[str] = Form(default=None),
+    grammar: Optional[str] = Form(default=None)
 ):
-    """Transcribe uploaded audio file"""
+    """Transcribe uploaded audio file
     
-    if language not in models:
+    With `stream=ndjson` or `stream=sse`, each utterance is sent as soon as it
+    is recognized, followed by a summary record. `fields` (e.g. `text` or
+    `text,words`) limits the response to the listed fields. `grammar`, a JSON
+    array or comma-separated list of phrases such as `["yes", "no", "[unk]"]`,
+    restricts recognition to those phrases.
+    """
+    
+    check_language(language)
+    check_ready()
+    selected = check_fields(fields)
+    phrases = check_grammar(grammar)
+    if stream and stream not in STREAM_MEDIA_TYPES:
         raise HTTPException(
             status_code=400,
-            detail=f"Language {language} not supported. Available: {list(models.keys())}"
+            detail=f"Unknown stream format {stream}. Available: {list(STREAM_MEDIA_TYPES)}"
         )
     
-    # Save uploaded file temporarily
-    with tempfile.NamedTemporaryFile(delete=False, suffix=f".{file.filename.split('.')[-1]}") as temp_file:
-        content = await file.read()
-        temp_file.write(content)
-        temp_file_path = temp_file.name
+    REQUESTS.inc(endpoint="transcribe")
+    content = await read_upload(file, "transcribe")
+    loop = asyncio.get_running_loop()
+    
+    if stream:
+        return stream_transcription_response(content, language, long_audio, stream, selected, phrases)
+    
+    # Identical audio with identical options gives an identical result
+    cache_key = await loop.run_in_executor(
+        None, functools.partial(
+            ResultCache.make_key, content, language, long_audio=long_audio, vad=VAD_ENABLED, grammar=grammar_key(phrases)
+        )
+    )
+    if not no_cache:
+        cached = await loop.run_in_executor(None, result_cache.get, cache_key)
+        if cached is not None:
+            if selected is not None:
+                cached = dumps(select_fields(loads(cached), selected))
+            return Response(content=cached, media_type="application/json", headers={"X-Cache": "HIT"})
     
     try:
-        # Transcribe the audio
-        result = transcribe_audio(temp_file_path, language)
-        return JSONResponse(content=result)
+        # Decode and transcribe in worker processes so the event loop stays free
+        result = await transcribe_upload(content, language, "transcribe", long_audio, grammar=phrases)
     
-    finally:
-        # Clean up temporary file
-        os.unlink(temp_file_path)
+    except PoolBusyError as e:
+        ERRORS.inc(endpoint="transcribe", type="pool_busy")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(load_shedder.retry_after())})
+    
+    started = time.perf_counter()
+    # The cache keeps the full result so any field selection can be served from it
+    full = dumps(result)
+    body = full if selected is None else dumps(select_fields(result, selected))
+    observe_stage("serialize", time.perf_counter() - started)
+    if result.get("success"):
+        await loop.run_in_executor(None, result_cache.put, cache_key, full)
+    return Response(content=body, media_type="application/json", headers={"X-Cache": "MISS"})
+
+def stream_transcription_response(content: bytes, language: str, long_audio: bool, stream_format: str,
+                                  fields: Optional[frozenset] = None, grammar: Optional[str] = None) -> StreamingResponse:
+    """Stream the utterances of an upload as NDJSON or server-sent events"""
+    # Checked up front: once streaming starts, the status code can't change
+    if transcription_pool.busy:
+        ERRORS.inc(endpoint="transcribe", type="pool_busy")
+        raise HTTPException(
+            status_code=503, detail="Transcription queue is full", headers={"Retry-After": str(load_shedder.retry_after())}
+        )
+    
+    async def stream_records():
+        records = None
+        try:
+            with load_shedder.track(estimate_duration(content)):
+                detected, language_scores = await resolve_language(content, language, wait=True)
+                if language_scores is not None:
+                    yield format_stream_record(
+                        {"type": "language", "language": detected, "scores": language_scores}, stream_format
+                    )
+                if long_audio:
+                    records = stream_long_audio(content, detected, "transcribe", grammar)
+                else:
+                    records = stream_in_pool(content, detected, "transcribe", grammar)
+                async for record in records:
+                    yield format_stream_record(record, stream_format, fields)
+        except Exception as e:
+            logger.error(f"Error transcribing audio: {e}")
+            ERRORS.inc(endpoint="transcribe", type=type(e).__name__)
+            yield format_stream_record({"type": "error", "success": False, "error": str(e)}, stream_format)
+        finally:
+            if records is not None:
+                await records.aclose()
+    
+    return StreamingResponse(
+        stream_records(),
+        media_type=STREAM_MEDIA_TYPES[stream_format],
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/transcribe/batch")
+async def transcribe_batch(
+    files: List[UploadFile] = File(...),
+    language: str = Form(default="en"),
+    fields: Optional[str] = Form(default=None),
+    grammar: Optional[str] = Form(default=None)
+):
+    """Transcribe many audio files, or zip/tar archives of them, in one request
+    
+    Results are streamed back as newline-delimited JSON, one line per file in
+    the order they finish. A file that fails gets its own error line.
+    """
+    
+    check_language(language)
+    check_ready()
+    selected = check_fields(fields)
+    phrases = check_grammar(grammar)
+    
+    REQUESTS.inc(endpoint="batch")
+    loop = asyncio.get_running_loop()
+    items = []
+    errors = []
+    extracted_bytes = 0
+    for file in files:
+        content = await read_upload(file, "batch")
+        if is_archive(file.filename):
+            try:
+                members = await loop.run_in_executor(
+                    None, extract_archive, file.filename, content,
+                    BATCH_MAX_FILES - len(items), BATCH_MAX_EXTRACTED_BYTES - extracted_bytes
+                )
+                items.extend(members)
+                extracted_bytes += sum(len(member) for _, member in members)
+            except (zipfile.BadZipFile, tarfile.TarError) as e:
+                errors.append({"filename": file.filename, "success": False, "error": f"Invalid archive: {e}"})
+        else:
+            items.append((file.filename, content))
+    
+    if len(items) > BATCH_MAX_FILES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch contains {len(items)} files, the limit is {BATCH_MAX_FILES}"
+        )
+    
+    async def run_item(index: int, filename: str, content: bytes) -> dict:
+        # Files wait here rather than in the pool, which keeps its queue for /transcribe
+        async with batch_slots:
+            try:
+                result = await transcribe_upload(content, language, "batch", grammar=phrases, background=True)
+            except Exception as e:
+                ERRORS.inc(endpoint="batch", type=type(e).__name__)
+                result = {"success": False, "error": str(e)}
+        return {"index": index, "filename": filename, **result}
+    
+    async def stream_results():
+        for error in errors:
+            yield dumps_text(error) + "\n"
+        
+        tasks = [asyncio.create_task(run_item(index, name, content)) for index, (name, content) in enumerate(items)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield dumps_text(select_fields(await next_done, selected)) + "\n"
+        finally:
+            # Stop queued work if the client goes away
+            for task in tasks:
+                task.cancel()
+    
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+@app.post("/jobs", status_code=202)
+async def create_job(
+    file: UploadFile = File(...),
+    language: str = Form(default="en"),
+    priority: int = Form(default=0),
+    long_audio: bool = Form(default=False),
+    grammar: Optional[str] = Form(default=None)
+):
+    """Queue an audio file for background transcription"""
+    
+    check_language(language)
+    phrases = check_grammar(grammar)
+    
+    REQUESTS.inc(endpoint="jobs")
+    content = await read_upload(file, "jobs")
+    job = await job_scheduler.submit(
+        content, language, priority, estimate_duration(content), {"long_audio": long_audio, "grammar": phrases}
+    )
+    return {"job_id": job["id"], "status": job["status"]}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, wait: float = 0):
+    """Get the status and result of a job, optionally waiting up to `wait` seconds for it to finish"""
+    job = await job_scheduler.get(job_id, wait=min(max(wait, 0), JOB_MAX_WAIT))
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job
 
 @app.websocket("/ws/{language}")
-async def websocket_endpoint(websocket: WebSocket, language: str):
-    """WebSocket endpoint for real-time speech recognition"""
+async def websocket_endpoint(websocket: WebSocket, language: str, codec: str = "pcm", fields: Optional[str] = None,
+                             encoding: str = "json", resumable: bool = False, resume: Optional[str] = None,
+                             offset: Optional[int] = None, grammar: Optional[str] = None):
+    """WebSocket endpoint for real-time speech recognition
+    
+    Binary frames are 16 kHz mono s16 PCM, or with `?codec=webm` (or `ogg`)
+    a compressed stream such as the Opus chunks from a browser MediaRecorder.
+    Other raw PCM is declared first with a text message like
+    `{"config": {"sample_rate": 48000, "channels": 2, "format": "f32le"}}`.
+    `?fields=text` trims the result frames; `?encoding=msgpack` sends them as
+    binary MessagePack frames. `?grammar=` restricts recognition to a phrase
+    list, as for `/transcribe`.
+    
+    With `?resumable=true` the session survives a dropped connection for
+    WS_RESUME_TTL seconds; reconnect with `?resume=<session_id>&offset=<byte>`
+    to continue it (the language and grammar of the original session are kept).
+    """
     
     if language not in models:
         await websocket.close(code=4000, reason=f"Language {language} not supported")
         return
+    if codec != "pcm" and codec not in STREAM_CONTAINERS:
+        await websocket.close(code=4000, reason=f"Codec {codec} not supported")
+        return
+    try:
+        encoder = FrameEncoder(parse_fields(fields), encoding)
+        phrases = parse_grammar(grammar)
+    except ValueError as e:
+        await websocket.close(code=4000, reason=str(e)[:120])
+        return
+    
+    if (resumable or resume) and codec != "pcm":
+        # A compressed stream can't be picked up again at an arbitrary byte
+        await websocket.close(code=4000, reason="Only raw PCM sessions can be resumed")
+        return
+    if (resumable or resume) and not WS_RESUME_TTL:
+        await websocket.close(code=4000, reason="Resumable sessions are disabled")
+        return
     
     await websocket.accept()
+    REQUESTS.inc(endpoint="websocket")
+    WEBSOCKET_SESSIONS.inc()
+    session = None
+    session_id = None
+    end_session = None
+    failed = True
+    disconnected = False
     
     try:
-        # Create recognizer for real-time processing
-        rec = vosk.KaldiRecognizer(models[language], 16000)
-        rec.SetWords(True)
-        
-        while True:
-            # Receive audio data
-            data = await websocket.receive_bytes()
+        if resume:
+            claimed = await session_store.take(resume)
+            if claimed is None:
+                raise ValueError(f"Session {resume} not found or expired")
+            try:
+                claimed[0].resume(websocket, offset, encoder)
+            except ValueError:
+                # Left for the client to retry with a usable offset
+                session_store.park(resume, *claimed)
+                raise
+            session, end_session = claimed
+            session_id = resume
+            logger.info(f"Resuming WebSocket session {session_id} at byte {session.offset}")
+        else:
+            # Loading a model can take seconds, so keep it off the event loop
+            await asyncio.get_running_loop().run_in_executor(None, models.load, language)
             
-            if rec.AcceptWaveform(data):
-                result = json.loads(rec.Result())
-                await websocket.send_text(json.dumps(result))
-            else:
-                partial = json.loads(rec.PartialResult())
-                await websocket.send_text(json.dumps(partial))
-                
-    except WebSocketDisconnect:
+            # Borrow a recognizer for real-time processing; it stays with the session across reconnects
+            generation = recognizer_pool.generation(language)
+            rec = await asyncio.get_running_loop().run_in_executor(
+                None, recognizer_pool.acquire, language, SAMPLE_RATE, phrases
+            )
+            session_id = session_store.new_id() if resumable else None
+            session = StreamingSession(
+                websocket,
+                rec,
+                stream_executor,
+                queue_size=WS_QUEUE_SIZE,
+                overflow_policy=WS_OVERFLOW_POLICY,
+                partial_interval=WS_PARTIAL_INTERVAL,
+                vad=create_vad(),
+                audio_decoder=CompressedAudioDecoder(codec) if codec != "pcm" else None,
+                idle_timeout=WS_IDLE_TIMEOUT,
+                session_timeout=WEBSOCKET_TIMEOUT,
+                encoder=encoder,
+                session_id=session_id,
+            )
+            end_session = functools.partial(end_stream_session, session, language, generation, phrases)
+        if session_id is not None:
+            session_store.attach(session_id, session)
+        active_sessions.add(session)
+        await session.run()
+        failed = False
+        disconnected = not session.finished
         logger.info("WebSocket disconnected")
+        if session.interrupted:
+            await close_quietly(websocket, 4009, "Session resumed on another connection")
+    
+    except SessionTimeout as e:
+        logger.info(f"WebSocket closed: {e}")
+        ERRORS.inc(endpoint="websocket", type="timeout")
+        failed = False
+        await close_quietly(websocket, 4008, str(e))
+                
     except Exception as e:
         logger.error(f"WebSocket error: {e}")
-        await websocket.close(code=4000, reason=str(e))
+        ERRORS.inc(endpoint="websocket", type=type(e).__name__)
+        # Close reasons are limited to 123 bytes
+        await close_quietly(websocket, 4000, str(e)[:120])
+    
+    finally:
+        WEBSOCKET_SESSIONS.dec()
+        if session is not None:
+            active_sessions.discard(session)
+            if session_id is not None and disconnected:
+                # The client dropped mid-stream; keep the session for it to resume
+                session_store.park(session_id, session, end_session)
+            else:
+                if session_id is not None:
+                    session_store.discard(session_id)
+                if end_session is not None:
+                    end_session(failed)
+
+def end_stream_session(session: StreamingSession, language: str, generation: int, grammar: Optional[str],
+                       failed: bool) -> None:
+    """Return the recognizer of a finished WebSocket session and record its metrics"""
+    if failed:
+        # Its decoder may be left in an unknown state
+        recognizer_pool.discard(session.rec)
+    else:
+        recognizer_pool.release(language, SAMPLE_RATE, session.rec, generation, grammar)
+    AUDIO_BYTES.inc(session.bytes_received, endpoint="websocket")
+    if session.audio_decoder is not None:
+        observe_stage("stream_decode", session.audio_decoder.cpu_seconds)
+    record_transcription("websocket", language, {
+        "decode": session.decode_seconds,
+        "audio_seconds": pcm_duration(session.pcm_bytes),
+        "vad_skipped": session.vad.dropped_seconds if session.vad else 0.0,
+    })
+
+async def close_quietly(websocket: WebSocket, code: int, reason: str) -> None:
+    """Close a WebSocket that may already be gone"""
+    try:
+        await websocket.close(code=code, reason=reason)
+    except Exception:
+        pass
+
+@app.get("/live")
+async def liveness_check():
+    """Liveness probe: the process is up and its event loop responds"""
+    return {"status": "alive"}
+
+@app.get("/ready")
+async def readiness_check():
+    """Readiness probe: 200 once the pinned models are loaded and warm and the workers are up, 503 before"""
+    ready, status = readiness()
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"ready": ready, "status": status, "models": models.status()}
+    )
 
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
+    ready, status = readiness()
     return {
-        "status": "healthy",
+        "status": "healthy" if ready else status,
+        "pid": os.getpid(),
         "available_languages": list(models.keys()),
-        "models_loaded": len(models)
+        "models_loaded": len(models.loaded),
+        "models": models.stats(),
+        "transcription_pool": transcription_pool.stats() if transcription_pool else None,
+        # This process's pool serves WebSocket sessions, file transcriptions use the workers'
+        "recognizer_pool": recognizer_pool.stats(),
+        "worker_recognizer_pools": worker_recognizer_stats(),
+        "result_cache": result_cache.stats(),
+        "jobs": job_scheduler.stats() if job_scheduler else None,
+        "load": load_shedder.stats(),
+        "resumable_sessions": session_store.stats()
     }
 
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus metrics"""
+    return Response(content=REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+def check_admin(x_admin_token: Optional[str] = Header(default=None)) -> None:
+    """Allow a request only with the configured X-Admin-Token"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Admin endpoints are disabled; set ADMIN_TOKEN")
+    if not token_matches(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+@app.get("/admin/profile", dependencies=[Depends(check_admin)])
+async def profile(seconds: float = 10, interval: float = 0.005):
+    """Sample the stacks of every thread of this process for `seconds`
+    
+    Returns the samples in the folded stack format of flamegraph.pl and
+    speedscope. Transcription pool workers are separate processes; use
+    request tracing to see their stages.
+    """
+    global profile_running
+    if profile_running:
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    seconds = min(max(seconds, 0.1), PROFILE_MAX_SECONDS)
+    sampler = StackSampler(interval=min(max(interval, 0.001), 1.0))
+    profile_running = True
+    try:
+        counts = await asyncio.get_running_loop().run_in_executor(None, sampler.sample, seconds)
+    finally:
+        profile_running = False
+    logger.info(f"Profiled for {seconds:g}s: {sampler.samples} samples")
+    return Response(
+        content=StackSampler.collapse(counts),
+        media_type="text/plain",
+        headers={"Content-Disposition": f'attachment; filename="profile-{os.getpid()}-{int(time.time())}.folded"'}
+    )
+
+@app.get("/admin/loop-stalls", dependencies=[Depends(check_admin)])
+async def loop_stalls():
+    """The most recent event-loop stalls and the code that caused them"""
+    return {"threshold": LOOP_LAG_THRESHOLD, "pid": os.getpid(), "stalls": list(loop_monitor.stalls)}
+
 @app.get("/languages")
 async def get_languages():
     """Get available languages"""
     return {
         "languages": list(models.keys()),
-        "details": {
-            "en": "English (US)",
-            "vi": "Vietnamese"
-        }
+        "details": {language: LANGUAGE_NAMES.get(language, language) for language in models}
     }
 
 if __name__ == "__main__":
@@ -0,0 +1,393 @@
+import io
+import logging
+import math
+import struct
+import subprocess
+import threading
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+from pydub import AudioSegment
+
+logger = logging.getLogger(__name__)
+
+# Format expected by the VOSK models: 16 kHz, mono, signed 16-bit little endian
+SAMPLE_RATE = 16000
+SAMPLE_WIDTH = 2
+CHANNELS = 1
+
+# Bytes handed to the recognizer per AcceptWaveform call (4000 frames)
+PCM_CHUNK_SIZE = 8000
+
+# Compressed containers accepted on the WebSocket, mapped to ffmpeg demuxers
+STREAM_CONTAINERS = {
+    "webm": "matroska",
+    "ogg": "ogg",
+}
+
+# Raw PCM sample formats a WebSocket client may declare, mapped to numpy dtypes
+PCM_FORMATS = {
+    "s16le": "<i2",
+    "s32le": "<i4",
+    "f32le": "<f4",
+}
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+class AudioDecodeError(Exception):
+    """Raised when uploaded audio cannot be decoded"""
+
+
+def wav_pcm_view(data: bytes) -> Optional[memoryview]:
+    """Return the sample data of a WAV file that is already 16 kHz mono s16
+
+    The returned memoryview points into ``data``, so no copy is made. Returns
+    None when ``data`` is not a WAV file or needs converting.
+    """
+    if len(data) < 12 or data[0:4] != b"RIFF" or data[8:12] != b"WAVE":
+        return None
+
+    view = memoryview(data)
+    offset = 12
+    fmt_ok = False
+    while offset + 8 <= len(data):
+        chunk_id = data[offset:offset + 4]
+        chunk_size = struct.unpack_from("<I", data, offset + 4)[0]
+        body = offset + 8
+        if chunk_id == b"fmt ":
+            if chunk_size < 16:
+                return None
+            format_tag, channels, rate, _, _, bits = struct.unpack_from("<HHIIHH", data, body)
+            if format_tag == WAVE_FORMAT_EXTENSIBLE and chunk_size >= 26:
+                format_tag = struct.unpack_from("<H", data, body + 24)[0]
+            fmt_ok = (format_tag == WAVE_FORMAT_PCM and channels == CHANNELS
+                      and rate == SAMPLE_RATE and bits == SAMPLE_WIDTH * 8)
+            if not fmt_ok:
+                return None
+        elif chunk_id == b"data":
+            if not fmt_ok:
+                return None
+            # Streaming writers often leave the size as 0 or 0xFFFFFFFF
+            end = min(body + chunk_size, len(data)) if chunk_size else len(data)
+            end -= (end - body) % SAMPLE_WIDTH
+            return view[body:end]
+        # Chunks are padded to an even length
+        offset = body + chunk_size + (chunk_size & 1)
+    return None
+
+
+def ffmpeg_stream_command(container: str) -> List[str]:
+    """ffmpeg arguments that decode a live compressed stream on stdin to PCM on stdout
+
+    Probing and buffering are kept to a minimum so decoded audio comes out
+    as soon as each packet arrives.
+    """
+    return [
+        "ffmpeg", "-hide_banner", "-loglevel", "error",
+        "-fflags", "nobuffer", "-probesize", "32", "-analyzeduration", "0",
+        "-f", STREAM_CONTAINERS[container], "-i", "pipe:0",
+        "-f", "s16le", "-acodec", "pcm_s16le",
+        "-ac", str(CHANNELS), "-ar", str(SAMPLE_RATE),
+        "-flush_packets", "1",
+        "pipe:1",
+    ]
+
+
+def _ffmpeg_pcm_chunks(data: bytes, chunk_size: int) -> Iterator[bytes]:
+    """Decode any ffmpeg-supported input to raw PCM through pipes"""
+    try:
+        proc = subprocess.Popen(
+            [
+                "ffmpeg", "-hide_banner", "-loglevel", "error",
+                "-i", "pipe:0",
+                "-f", "s16le", "-acodec", "pcm_s16le",
+                "-ac", str(CHANNELS), "-ar", str(SAMPLE_RATE),
+                "pipe:1",
+            ],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+    except FileNotFoundError as e:
+        raise AudioDecodeError("ffmpeg is not installed") from e
+
+    def feed():
+        try:
+            proc.stdin.write(data)
+        except (BrokenPipeError, ValueError):
+            # ffmpeg exited early; the error is reported from stderr below
+            pass
+        finally:
+            try:
+                proc.stdin.close()
+            except BrokenPipeError:
+                pass
+
+    stderr = []
+    writer = threading.Thread(target=feed, daemon=True)
+    reader = threading.Thread(target=lambda: stderr.append(proc.stderr.read()), daemon=True)
+    writer.start()
+    reader.start()
+
+    produced = False
+    try:
+        while True:
+            chunk = proc.stdout.read(chunk_size)
+            if not chunk:
+                break
+            produced = True
+            yield chunk
+    finally:
+        proc.stdout.close()
+        if proc.poll() is None:
+            proc.kill()
+        proc.wait()
+        writer.join()
+        reader.join()
+
+    if proc.returncode != 0 or not produced:
+        message = b"".join(stderr).decode(errors="replace").strip()
+        raise AudioDecodeError(message or f"ffmpeg exited with code {proc.returncode}")
+
+
+def _pydub_pcm_chunks(data: bytes, chunk_size: int) -> Iterator[bytes]:
+    """Decode with pydub, which lets ffmpeg seek in the input"""
+    try:
+        audio = AudioSegment.from_file(io.BytesIO(data))
+    except Exception as e:
+        raise AudioDecodeError(str(e)) from e
+    audio = audio.set_channels(CHANNELS).set_frame_rate(SAMPLE_RATE).set_sample_width(SAMPLE_WIDTH)
+    pcm = audio.raw_data
+    for start in range(0, len(pcm), chunk_size):
+        yield pcm[start:start + chunk_size]
+
+
+def iter_pcm_chunks(data: bytes, chunk_size: int = PCM_CHUNK_SIZE) -> Iterator[bytes]:
+    """Yield 16 kHz mono s16 PCM for ``data`` as it is decoded
+
+    WAV input that is already in the right format is sliced directly.
+    Everything else is streamed through ffmpeg without touching the disk.
+    """
+    view = wav_pcm_view(data)
+    if view is not None:
+        for start in range(0, len(view), chunk_size):
+            # The VOSK bindings only accept bytes, so copy one chunk at a time
+            yield bytes(view[start:start + chunk_size])
+        return
+
+    produced = False
+    try:
+        for chunk in _ffmpeg_pcm_chunks(data, chunk_size):
+            produced = True
+            yield chunk
+    except AudioDecodeError as e:
+        if produced:
+            raise
+        # Some containers (e.g. MP4 with the index at the end) can't be read
+        # from a pipe; pydub hands ffmpeg a seekable file instead.
+        logger.info(f"Streaming decode failed ({e}), retrying with pydub")
+        yield from _pydub_pcm_chunks(data, chunk_size)
+
+
+def pcm_duration(num_bytes: int) -> float:
+    """Duration in seconds of ``num_bytes`` of 16 kHz mono s16 PCM"""
+    return num_bytes / (SAMPLE_RATE * SAMPLE_WIDTH * CHANNELS)
+
+
+def synthetic_speech(seconds: float) -> bytes:
+    """Speech-like 16 kHz mono s16 PCM, for warming up recognizers
+
+    A voiced sound with a wandering pitch and its harmonics, switched on and
+    off at a syllable rate, over a little noise. It exercises the acoustic
+    model and the decoder's search like real speech would.
+    """
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    pitch = 120 + 30 * np.sin(2 * np.pi * 0.7 * t)
+    phase = 2 * np.pi * np.cumsum(pitch) / SAMPLE_RATE
+    voiced = sum(np.sin(harmonic * phase) / harmonic for harmonic in range(1, 10))
+    syllables = np.clip(np.sin(2 * np.pi * 4 * t) * 2, 0, 1)
+    noise = np.random.default_rng(0).normal(0, 0.02, len(t))
+    signal = voiced / 3 * syllables + noise
+    return (np.clip(signal, -1, 1) * 0.3 * 32767).astype("<i2").tobytes()
+
+
+def estimate_duration(data: bytes) -> float:
+    """Estimate the duration of encoded audio in seconds without decoding it"""
+    if len(data) >= 44 and data[0:4] == b"RIFF" and data[8:12] == b"WAVE" and data[12:16] == b"fmt ":
+        byte_rate = struct.unpack_from("<I", data, 28)[0]
+        if byte_rate:
+            return len(data) / byte_rate
+    # Compressed formats: assume a typical 128 kbit/s speech encoding
+    return len(data) / 16000
+
+
+def decode_pcm(data: bytes) -> bytes:
+    """Decode ``data`` completely to 16 kHz mono s16 PCM"""
+    view = wav_pcm_view(data)
+    if view is not None:
+        return view.tobytes()
+    return b"".join(iter_pcm_chunks(data, chunk_size=1 << 16))
+
+
+def frame_rms(samples: np.ndarray, frame_len: int, block_frames: int = 6000) -> np.ndarray:
+    """RMS level of each complete ``frame_len``-sample frame
+
+    Works through the signal in blocks so an hour of audio doesn't need a
+    full float copy in memory.
+    """
+    num_frames = len(samples) // frame_len
+    rms = np.empty(num_frames, dtype=np.float32)
+    for first in range(0, num_frames, block_frames):
+        last = min(first + block_frames, num_frames)
+        block = samples[first * frame_len:last * frame_len].reshape(last - first, frame_len).astype(np.float32)
+        rms[first:last] = np.sqrt(np.mean(block * block, axis=1))
+    return rms
+
+
+def split_on_silence(pcm: bytes, target_seconds: float, min_silence_ms: int = 300,
+                     frame_ms: int = 10) -> List[Tuple[int, int]]:
+    """Split PCM into segments of roughly ``target_seconds`` at silent points
+
+    Returns ``(start, end)`` byte offsets. Each cut is placed in the middle of
+    one of the longest pauses found between 0.5x and 1.5x the target length
+    from the previous cut, so words are only split when there is no pause.
+    """
+    samples = np.frombuffer(pcm, dtype=np.int16)
+    frame_len = SAMPLE_RATE * frame_ms // 1000
+    num_frames = len(samples) // frame_len
+    target_frames = max(1, int(target_seconds * 1000 / frame_ms))
+    if num_frames <= target_frames * 3 // 2:
+        return [(0, len(pcm))]
+
+    rms = frame_rms(samples, frame_len)
+    # Relative to the noise floor so it works for both quiet and loud recordings
+    threshold = max(float(np.percentile(rms, 10)) * 2.0, 50.0)
+    silent = rms < threshold
+
+    # Run-length encode the silent frames
+    padded = np.concatenate(([False], silent, [False])).astype(np.int8)
+    edges = np.flatnonzero(np.diff(padded))
+    run_starts, run_ends = edges[0::2], edges[1::2]
+    min_run = max(1, min_silence_ms // frame_ms)
+    keep = (run_ends - run_starts) >= min_run
+    run_starts, run_ends = run_starts[keep], run_ends[keep]
+    centres = (run_starts + run_ends) // 2
+    lengths = run_ends - run_starts
+
+    cuts = []
+    position = 0
+    while num_frames - position > target_frames * 3 // 2:
+        lo, hi = position + target_frames // 2, position + target_frames * 3 // 2
+        candidates = np.flatnonzero((centres > lo) & (centres < hi))
+        if len(candidates):
+            # Among the longest pauses, take the one closest to the target length
+            long_enough = candidates[lengths[candidates] >= lengths[candidates].max() * 0.8]
+            target = position + target_frames
+            cut = int(centres[long_enough[np.argmin(np.abs(centres[long_enough] - target))]])
+        else:
+            cut = position + target_frames
+        cuts.append(cut)
+        position = cut
+
+    bounds = [0] + [cut * frame_len * SAMPLE_WIDTH for cut in cuts] + [len(pcm)]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+class PolyphaseResampler:
+    """Resamples a mono float stream chunk by chunk to ``output_rate``
+
+    A windowed-sinc lowpass split into ``up`` phases, applied to all output
+    samples of a chunk at once. The last input samples are kept between
+    calls, so feeding a signal in pieces gives the same output as feeding it
+    whole, without clicks at chunk boundaries.
+    """
+
+    # Zero crossings of the sinc on each side, and the Kaiser window shape
+    HALF_WIDTH = 16
+    KAISER_BETA = 8.6
+    # Limits the filter bank for odd rate pairs (44.1 kHz to 16 kHz is 160/441)
+    MAX_FACTOR = 1000
+
+    def __init__(self, input_rate: int, output_rate: int = SAMPLE_RATE):
+        divisor = math.gcd(input_rate, output_rate)
+        self.up = output_rate // divisor
+        self.down = input_rate // divisor
+        if max(self.up, self.down) > self.MAX_FACTOR:
+            raise ValueError(f"Cannot resample from {input_rate} Hz to {output_rate} Hz")
+
+        # Cut off below the lower of the two Nyquist frequencies, at the upsampled rate
+        factor = max(self.up, self.down)
+        cutoff = 0.5 / factor * 0.95
+        length = 2 * self.HALF_WIDTH * factor + 1
+        n = np.arange(length) - (length - 1) / 2
+        taps = 2 * cutoff * np.sinc(2 * cutoff * n) * np.kaiser(length, self.KAISER_BETA) * self.up
+        # Row p holds the taps applied to x[base], x[base - 1], ... for output phase p
+        self.taps_per_phase = -(-length // self.up)
+        taps = np.pad(taps, (0, self.taps_per_phase * self.up - length))
+        self.bank = taps.reshape(self.taps_per_phase, self.up).T.astype(np.float32)
+
+        self._history = np.zeros(self.taps_per_phase - 1, dtype=np.float32)
+        self._inputs = 0
+        self._outputs = 0
+
+    def process(self, samples: np.ndarray) -> np.ndarray:
+        """Resample the next chunk of the stream"""
+        if self.up == self.down:
+            return samples.astype(np.float32, copy=False)
+        buffer = np.concatenate((self._history, samples.astype(np.float32, copy=False)))
+        first_input = self._inputs - len(self._history)
+        self._inputs += len(samples)
+
+        # Every output whose newest input sample has arrived
+        end = (self._inputs * self.up + self.down - 1) // self.down
+        positions = np.arange(self._outputs, end, dtype=np.int64) * self.down
+        self._outputs = end
+        bases = positions // self.up - first_input
+        phases = positions % self.up
+        window = bases[:, None] - np.arange(self.taps_per_phase)
+        output = np.einsum("ij,ij->i", buffer[window], self.bank[phases])
+
+        self._history = buffer[len(buffer) - len(self._history):]
+        return output
+
+
+class PcmStreamConverter:
+    """Converts a raw PCM stream to the 16 kHz mono s16 the models expect
+
+    Chunks may end mid-sample; the partial frame is held for the next call.
+    Channels are averaged, then resampled with a ``PolyphaseResampler``.
+    """
+
+    def __init__(self, sample_rate: int = SAMPLE_RATE, channels: int = CHANNELS, sample_format: str = "s16le"):
+        if sample_format not in PCM_FORMATS:
+            raise ValueError(f"Unknown sample format {sample_format!r}, expected one of {list(PCM_FORMATS)}")
+        if not 1 <= channels <= 8:
+            raise ValueError(f"Unsupported channel count {channels}, expected 1 to 8")
+        if not 8000 <= sample_rate <= 192000:
+            raise ValueError(f"Unsupported sample rate {sample_rate}, expected 8000 to 192000")
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.sample_format = sample_format
+        self.dtype = np.dtype(PCM_FORMATS[sample_format])
+        self.frame_size = self.dtype.itemsize * channels
+        self.resampler = PolyphaseResampler(sample_rate)
+        self._remainder = b""
+
+    @property
+    def passthrough(self) -> bool:
+        """Whether the stream is already in the model's format"""
+        return self.sample_rate == SAMPLE_RATE and self.channels == CHANNELS and self.sample_format == "s16le"
+
+    def process(self, data: bytes) -> bytes:
+        data = self._remainder + data
+        usable = len(data) - len(data) % self.frame_size
+        self._remainder = data[usable:]
+        samples = np.frombuffer(data, dtype=self.dtype, count=usable // self.dtype.itemsize)
+        if self.dtype.kind == "i":
+            samples = samples.astype(np.float32) / float(1 << (8 * self.dtype.itemsize - 1))
+        if self.channels > 1:
+            samples = samples.reshape(-1, self.channels).mean(axis=1, dtype=np.float32)
+        resampled = self.resampler.process(samples)
+        return (np.clip(resampled, -1.0, 1.0) * 32767).round().astype("<i2").tobytes()
@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the VOSK STT service
+
+Runs app.py in-process on a random local port and drives /transcribe and
+/ws/{language} with synthetic speech-like audio at a configurable
+concurrency. By default VOSK is replaced with a fake recognizer
+(benchmarks/fake_vosk.py) whose per-frame cost is configurable, so no
+models are needed. Pass --models-dir to benchmark real models instead.
+
+Results (throughput, p50/p95/p99 latency, real-time factor) are printed and
+saved as JSON; --compare prints the change against an earlier run.
+
+Examples:
+  python benchmarks/bench.py
+  python benchmarks/bench.py --concurrency 16 --requests 200 --fake-cost 0.1
+  python benchmarks/bench.py --models-dir /app/models --language en
+  python benchmarks/bench.py --compare benchmarks/results/before.json
+"""
+
+import argparse
+import asyncio
+import http.client
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import wave
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SAMPLE_RATE = 16000
+
+
+def synthesize_speech(seconds: float, seed: int = 0) -> bytes:
+    """Generate a 16 kHz mono WAV of voiced bursts separated by short pauses"""
+    rng = np.random.default_rng(seed)
+    total = int(seconds * SAMPLE_RATE)
+    signal = np.zeros(total, dtype=np.float32)
+    position = 0
+    while position < total:
+        length = int(rng.uniform(0.3, 1.2) * SAMPLE_RATE)
+        end = min(position + length, total)
+        t = np.arange(end - position) / SAMPLE_RATE
+        pitch = rng.uniform(100, 220)
+        # A few harmonics with a syllable-rate envelope sound roughly voice-like
+        burst = sum(np.sin(2 * np.pi * pitch * k * t) / k for k in range(1, 6))
+        envelope = 0.5 * (1 - np.cos(2 * np.pi * np.minimum(t * 4, 1))) * (0.6 + 0.4 * np.sin(2 * np.pi * 4 * t))
+        signal[position:end] = burst * envelope * 6000
+        position = end + int(rng.uniform(0.2, 0.6) * SAMPLE_RATE)
+    signal += rng.normal(0, 30, total)
+    pcm = np.clip(signal, -32768, 32767).astype(np.int16).tobytes()
+
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(SAMPLE_RATE)
+        wf.writeframes(pcm)
+    return buffer.getvalue()
+
+
+def wav_pcm(wav_bytes: bytes) -> bytes:
+    with wave.open(io.BytesIO(wav_bytes), "rb") as wf:
+        return wf.readframes(wf.getnframes())
+
+
+def encode_opus_webm(pcm: bytes, bitrate: str) -> bytes:
+    """Compress PCM to Opus in WebM, like a browser MediaRecorder, using ffmpeg"""
+    result = subprocess.run(
+        [
+            "ffmpeg", "-hide_banner", "-loglevel", "error",
+            "-f", "s16le", "-ar", str(SAMPLE_RATE), "-ac", "1", "-i", "pipe:0",
+            "-c:a", "libopus", "-b:a", bitrate, "-f", "webm", "pipe:1",
+        ],
+        input=pcm, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True,
+    )
+    return result.stdout
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    return float(np.percentile(values, q))
+
+
+def summarize(latencies: List[float], audio_seconds: float, errors: int, wall: float, **extra) -> dict:
+    completed = len(latencies)
+    return {
+        "requests": completed + errors,
+        "errors": errors,
+        "wall_seconds": round(wall, 4),
+        "throughput_rps": round(completed / wall, 3) if wall else 0.0,
+        "audio_seconds_per_second": round(completed * audio_seconds / wall, 3) if wall else 0.0,
+        "latency_mean": round(statistics.mean(latencies), 4) if latencies else 0.0,
+        "latency_p50": round(percentile(latencies, 50), 4),
+        "latency_p95": round(percentile(latencies, 95), 4),
+        "latency_p99": round(percentile(latencies, 99), 4),
+        "real_time_factor": round(statistics.mean(latencies) / audio_seconds, 4) if latencies else 0.0,
+        **extra,
+    }
+
+
+def encode_multipart(fields: dict, filename: str, content: bytes) -> Tuple[bytes, str]:
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+        )
+    parts.append(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        f"Content-Type: application/octet-stream\r\n\r\n".encode()
+    )
+    parts.append(content)
+    parts.append(f"\r\n--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+def bench_transcribe(port: int, wav_bytes: bytes, language: str, requests: int, concurrency: int,
+                     audio_seconds: float) -> dict:
+    """POST the same file ``requests`` times from ``concurrency`` keep-alive connections"""
+    body, content_type = encode_multipart({"language": language, "no_cache": "true"}, "bench.wav", wav_bytes)
+    local = threading.local()
+    lock = threading.Lock()
+    latencies: List[float] = []
+    errors = [0]
+
+    def one_request(_):
+        if not hasattr(local, "conn"):
+            local.conn = http.client.HTTPConnection("127.0.0.1", port, timeout=600)
+        started = time.perf_counter()
+        try:
+            local.conn.request("POST", "/transcribe", body=body, headers={"Content-Type": content_type})
+            response = local.conn.getresponse()
+            payload = response.read()
+            ok = response.status == 200 and json.loads(payload).get("success")
+        except (OSError, http.client.HTTPException, ValueError):
+            local.conn.close()
+            del local.conn
+            ok = False
+        elapsed = time.perf_counter() - started
+        with lock:
+            if ok:
+                latencies.append(elapsed)
+            else:
+                errors[0] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(one_request, range(requests)))
+    wall = time.perf_counter() - started
+    return summarize(latencies, audio_seconds, errors[0], wall, concurrency=concurrency)
+
+
+async def bench_websocket(port: int, payload: bytes, language: str, sessions: int, concurrency: int,
+                          chunk_seconds: float, speed: float, audio_seconds: float, codec: str = "pcm") -> dict:
+    """Stream ``payload`` over ``sessions`` WebSocket connections, ``concurrency`` at a time
+
+    ``payload`` is raw PCM, or compressed audio when ``codec`` isn't "pcm";
+    either way each message carries about ``chunk_seconds`` of audio.
+    """
+    import websockets
+
+    chunk_size = max(1, int(len(payload) * chunk_seconds / audio_seconds))
+    query = f"?codec={codec}" if codec != "pcm" else ""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    finalize_latencies: List[float] = []
+    errors = 0
+
+    async def one_session():
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                async with websockets.connect(f"ws://127.0.0.1:{port}/ws/{language}{query}", max_size=None) as ws:
+                    async def drain():
+                        async for _ in ws:
+                            pass
+
+                    reader = asyncio.create_task(drain())
+                    for offset in range(0, len(payload), chunk_size):
+                        await ws.send(payload[offset:offset + chunk_size])
+                        if speed > 0:
+                            await asyncio.sleep(chunk_seconds / speed)
+                    eof_sent = time.perf_counter()
+                    await ws.send('{"eof" : 1}')
+                    await reader
+                    finished = time.perf_counter()
+            except (OSError, websockets.WebSocketException):
+                errors += 1
+                return
+            latencies.append(finished - started)
+            finalize_latencies.append(finished - eof_sent)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[one_session() for _ in range(sessions)])
+    wall = time.perf_counter() - started
+    return summarize(
+        latencies, audio_seconds, errors, wall,
+        concurrency=concurrency,
+        speed=speed,
+        codec=codec,
+        bytes_per_session=len(payload),
+        kbit_per_audio_second=round(len(payload) * 8 / 1000 / audio_seconds, 1),
+        finalize_p50=round(percentile(finalize_latencies, 50), 4),
+        finalize_p95=round(percentile(finalize_latencies, 95), 4),
+        finalize_p99=round(percentile(finalize_latencies, 99), 4),
+    )
+
+
+def start_server(app) -> Tuple[object, threading.Thread, int]:
+    import uvicorn
+
+    config = uvicorn.Config(app, host="127.0.0.1", port=0, log_level="warning", ws_max_size=1 << 24)
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("Server failed to start")
+        time.sleep(0.05)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    # Models load and warm up in the background; wait until the service takes traffic
+    while True:
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+        conn.request("GET", "/ready")
+        status = conn.getresponse().status
+        conn.close()
+        if status == 200:
+            return server, thread, port
+        if not thread.is_alive():
+            raise RuntimeError("Server failed to start")
+        time.sleep(0.1)
+
+
+def compare(current: dict, baseline_path: str) -> None:
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    keys = ("throughput_rps", "latency_p50", "latency_p95", "latency_p99", "real_time_factor")
+    print(f"\nCompared with {baseline_path}:")
+    for scenario, result in current["results"].items():
+        before = baseline.get("results", {}).get(scenario)
+        if not before:
+            continue
+        print(f"  {scenario}:")
+        for key in keys:
+            old, new = before.get(key), result.get(key)
+            if not old or new is None:
+                continue
+            print(f"    {key:<18} {old:>10.4f} -> {new:>10.4f} ({(new - old) / old * 100:+.1f}%)")
+
+
+def print_results(results: dict) -> None:
+    for scenario, result in results.items():
+        print(f"\n{scenario}:")
+        for key, value in result.items():
+            print(f"  {key:<26} {value}")
+
+
+def main(argv: Optional[List[str]] = None) -> dict:
+    parser = argparse.ArgumentParser(description="Benchmark the VOSK STT service in-process")
+    parser.add_argument("--language", default="en")
+    parser.add_argument("--audio-seconds", type=float, default=10.0, help="Length of the synthetic clip")
+    parser.add_argument("--requests", type=int, default=50, help="/transcribe requests to send")
+    parser.add_argument("--sessions", type=int, default=20, help="WebSocket sessions to open")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--ws-chunk-seconds", type=float, default=0.25)
+    parser.add_argument("--ws-speed", type=float, default=0,
+                        help="Stream at this multiple of real time (0 = as fast as possible)")
+    parser.add_argument("--ws-codec", choices=("pcm", "webm"), default="pcm",
+                        help="Send raw PCM, or Opus in WebM as a browser would (needs ffmpeg)")
+    parser.add_argument("--ws-bitrate", default="24k", help="Opus bitrate for --ws-codec webm")
+    parser.add_argument("--workers", type=int, default=None, help="TRANSCRIBE_WORKERS for the server")
+    parser.add_argument("--fake-cost", type=float, default=0.05,
+                        help="Fake recognizer work per second of audio, in seconds")
+    parser.add_argument("--fake-mode", choices=("sleep", "spin"), default="sleep",
+                        help="'sleep' releases the GIL like native code, 'spin' burns CPU")
+    parser.add_argument("--models-dir", help="Use real VOSK models from this directory")
+    parser.add_argument("--audio-file", help="Use this file instead of synthetic audio")
+    parser.add_argument("--skip", choices=("transcribe", "websocket"), action="append", default=[])
+    parser.add_argument("--output", help="Where to save the JSON results")
+    parser.add_argument("--compare", help="Earlier results JSON to compare against")
+    args = parser.parse_args(argv)
+
+    # Server settings are read from the environment when app.py is imported
+    state_dir = tempfile.mkdtemp(prefix="stt-bench-")
+    os.environ["RESULT_CACHE_SIZE"] = "0"
+    os.environ["JOBS_DB_PATH"] = os.path.join(state_dir, "jobs.db")
+    if args.workers:
+        os.environ["TRANSCRIBE_WORKERS"] = str(args.workers)
+    os.environ.setdefault("TRANSCRIBE_QUEUE_SIZE", str(max(args.concurrency, 32)))
+    os.environ["PINNED_MODELS"] = args.language
+    if args.models_dir:
+        os.environ["MODELS_DIR"] = args.models_dir
+    else:
+        # The fake recognizer only needs the language directory to exist
+        os.environ["MODELS_DIR"] = os.path.join(state_dir, "models")
+        os.makedirs(os.path.join(os.environ["MODELS_DIR"], args.language))
+
+    if args.models_dir:
+        recognizer = "vosk"
+    else:
+        from benchmarks import fake_vosk
+        fake_vosk.install(args.fake_cost, args.fake_mode)
+        recognizer = f"fake (cost={args.fake_cost}, mode={args.fake_mode})"
+
+    os.chdir(ROOT)
+    import app as service
+
+    if args.audio_file:
+        with open(args.audio_file, "rb") as f:
+            wav_bytes = f.read()
+    else:
+        wav_bytes = synthesize_speech(args.audio_seconds)
+    pcm = wav_pcm(wav_bytes)
+    audio_seconds = len(pcm) / (SAMPLE_RATE * 2)
+
+    server, thread, port = start_server(service.app)
+    results = {}
+    try:
+        if "transcribe" not in args.skip:
+            print(f"Benchmarking /transcribe: {args.requests} requests, concurrency {args.concurrency}")
+            results["transcribe"] = bench_transcribe(
+                port, wav_bytes, args.language, args.requests, args.concurrency, audio_seconds
+            )
+        if "websocket" not in args.skip:
+            print(f"Benchmarking /ws/{args.language}: {args.sessions} sessions, concurrency {args.concurrency}")
+            payload = encode_opus_webm(pcm, args.ws_bitrate) if args.ws_codec == "webm" else pcm
+            results["websocket"] = asyncio.run(bench_websocket(
+                port, payload, args.language, args.sessions, args.concurrency,
+                args.ws_chunk_seconds, args.ws_speed, audio_seconds, args.ws_codec,
+            ))
+    finally:
+        server.should_exit = True
+        thread.join(timeout=30)
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {**vars(args), "recognizer": recognizer, "clip_seconds": round(audio_seconds, 3),
+                   "transcribe_workers": service.TRANSCRIBE_WORKERS},
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "results": results,
+    }
+    print_results(results)
+
+    output = args.output or os.path.join(ROOT, "benchmarks", "results", f"bench-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nSaved results to {output}")
+
+    if args.compare:
+        compare(report, args.compare)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Stand-in for the ``vosk`` module so the service can be benchmarked without models.
+
+``KaldiRecognizer`` mimics the real API: it accepts 16-bit PCM, finalizes an
+utterance after a pause or every few seconds of speech, and returns JSON
+strings shaped like VOSK's. Each call costs ``cost`` seconds of work per
+second of audio, so ``cost=0.1`` behaves like a model running at 0.1x real time.
+"""
+
+import json
+import time
+
+import numpy as np
+
+# Seconds of work per second of audio, set by install()
+COST = 0.05
+# "sleep" releases the GIL like the native decoder; "spin" burns CPU
+COST_MODE = "sleep"
+
+SAMPLE_WIDTH = 2
+UTTERANCE_SECONDS = 3.0
+SILENCE_LEVEL = 300
+WORDS = ["alpha", "bravo", "charlie", "delta", "echo", "foxtrot", "golf", "hotel"]
+
+
+def _spend(seconds: float) -> None:
+    if seconds <= 0:
+        return
+    if COST_MODE == "spin":
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            pass
+    else:
+        time.sleep(seconds)
+
+
+class Model:
+    def __init__(self, path: str = ""):
+        self.path = path
+
+
+class SpkModel:
+    def __init__(self, path: str = ""):
+        self.path = path
+
+
+class KaldiRecognizer:
+    def __init__(self, model, sample_rate, grammar=None):
+        self.model = model
+        self.sample_rate = sample_rate
+        self.grammar = json.loads(grammar) if isinstance(grammar, str) else None
+        self.words = False
+        self.Reset()
+
+    def SetWords(self, enabled):
+        self.words = bool(enabled)
+
+    def SetPartialWords(self, enabled):
+        pass
+
+    def SetMaxAlternatives(self, alternatives):
+        pass
+
+    def SetGrammar(self, grammar):
+        self.grammar = json.loads(grammar)
+
+    def Reset(self):
+        self._position = 0.0
+        self._utterance_start = 0.0
+        self._words = []
+
+    def _vocabulary(self):
+        if self.grammar:
+            return [phrase for phrase in self.grammar if phrase != "[unk]"] or WORDS
+        return WORDS
+
+    def AcceptWaveform(self, data):
+        samples = np.frombuffer(data, dtype=np.int16)
+        duration = len(samples) / self.sample_rate
+        _spend(duration * COST)
+
+        speech = len(samples) and float(np.abs(samples).mean()) > SILENCE_LEVEL
+        if speech:
+            vocabulary = self._vocabulary()
+            word = vocabulary[len(self._words) % len(vocabulary)]
+            self._words.append({
+                "conf": 0.9,
+                "end": round(self._position + duration, 3),
+                "start": round(self._position, 3),
+                "word": word,
+            })
+        self._position += duration
+
+        endpoint = (not speech and self._words) or self._position - self._utterance_start >= UTTERANCE_SECONDS
+        return bool(endpoint)
+
+    def _take(self):
+        words, self._words = self._words, []
+        self._utterance_start = self._position
+        result = {"text": " ".join(word["word"] for word in words)}
+        if self.words and words:
+            result = {"result": words, **result}
+        return json.dumps(result, indent=2)
+
+    def Result(self):
+        return self._take()
+
+    def FinalResult(self):
+        return self._take()
+
+    def PartialResult(self):
+        return json.dumps({"partial": " ".join(word["word"] for word in self._words)}, indent=2)
+
+
+def install(cost: float = COST, mode: str = COST_MODE) -> None:
+    """Replace the real ``vosk`` module with this one"""
+    import sys
+
+    global COST, COST_MODE
+    COST = cost
+    COST_MODE = mode
+    sys.modules["vosk"] = sys.modules[__name__]
@@ -1,114 +1,489 @@
 #!/usr/bin/env python3
 """
-Simple client example for VOSK STT API
+Client library and CLI for VOSK STT API
+
+VOSKClient and AsyncVOSKClient keep a pool of connections to the service.
+The CLI can also transcribe whole directories concurrently, and stream a
+file over the WebSocket endpoint faster than real time.
 """
 
-import requests
+import argparse
+import asyncio
 import json
+import random
+import shutil
+import subprocess
 import sys
+import time
+import wave
 from pathlib import Path
+from urllib.parse import urlencode
+
+import httpx
+
+# Responses worth retrying: the service sheds load with 503 + Retry-After
+RETRY_STATUS_CODES = {429, 502, 503, 504}
+
+# Files picked up when transcribing a directory
+AUDIO_EXTENSIONS = {".wav", ".mp3", ".flac", ".m4a", ".ogg", ".opus", ".webm", ".aac", ".wma"}
+
+# Raw PCM on the WebSocket is 16 kHz mono s16 unless a config message says otherwise
+SAMPLE_RATE = 16000
+DEFAULT_AUDIO_FORMAT = {"sample_rate": SAMPLE_RATE, "channels": 1, "format": "s16le"}
+PCM_SAMPLE_WIDTHS = {"s16le": 2, "s32le": 4, "f32le": 4}
+
+
+def retry_delay(attempt, response=None, backoff=0.5, max_backoff=30.0):
+    """Seconds to wait before retry number ``attempt``: exponential with jitter, at least Retry-After"""
+    delay = min(max_backoff, backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+    if response is not None:
+        try:
+            delay = max(delay, float(response.headers.get("Retry-After", 0)))
+        except ValueError:
+            pass
+    return delay
+
+
+def transcribe_form(language, long_audio=False, no_cache=False, fields=None, grammar=None):
+    data = {"language": language}
+    if long_audio:
+        data["long_audio"] = "true"
+    if no_cache:
+        data["no_cache"] = "true"
+    if fields:
+        data["fields"] = fields
+    if grammar:
+        data["grammar"] = grammar
+    return data
+
+
+def parse_response(response):
+    if response.status_code == 200:
+        return True, response.json()
+    return False, f"HTTP {response.status_code}: {response.text}"
+
 
 class VOSKClient:
-    def __init__(self, base_url="http://localhost:8000"):
-        self.base_url = base_url
-    
+    """Blocking client reusing connections across requests"""
+
+    def __init__(self, base_url="http://localhost:8000", timeout=300.0, max_connections=10):
+        self.base_url = base_url.rstrip("/")
+        self.session = httpx.Client(
+            base_url=self.base_url,
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.session.close()
+
     def health_check(self):
         """Check if the service is healthy"""
         try:
-            response = requests.get(f"{self.base_url}/health")
+            response = self.session.get("/health")
             return response.status_code == 200, response.json()
         except Exception as e:
             return False, str(e)
-    
+
     def get_languages(self):
         """Get available languages"""
         try:
-            response = requests.get(f"{self.base_url}/languages")
+            response = self.session.get("/languages")
             if response.status_code == 200:
                 return True, response.json()
             else:
                 return False, f"HTTP {response.status_code}"
         except Exception as e:
             return False, str(e)
-    
-    def transcribe_file(self, file_path, language="en"):
-        """Transcribe an audio file"""
+
+    def transcribe_file(self, file_path, language="en", long_audio=False, no_cache=False, retries=0, fields=None,
+                        grammar=None):
+        """Transcribe an audio file, retrying up to ``retries`` times when the service is overloaded
+
+        ``fields`` (e.g. ``"text"``) limits the result to the listed fields,
+        ``grammar`` (e.g. ``"yes,no,[unk]"``) the recognized phrases.
+        """
         if not Path(file_path).exists():
             return False, f"File not found: {file_path}"
-        
+
+        content = Path(file_path).read_bytes()
+        attempt = 0
+        while True:
+            response = None
+            try:
+                response = self.session.post(
+                    "/transcribe",
+                    files={"file": (Path(file_path).name, content)},
+                    data=transcribe_form(language, long_audio, no_cache, fields, grammar),
+                )
+                if response.status_code not in RETRY_STATUS_CODES or attempt >= retries:
+                    return parse_response(response)
+            except httpx.TransportError as e:
+                if attempt >= retries:
+                    return False, str(e)
+            time.sleep(retry_delay(attempt, response))
+            attempt += 1
+
+
+class AsyncVOSKClient:
+    """asyncio client reusing connections across concurrent requests"""
+
+    def __init__(self, base_url="http://localhost:8000", timeout=300.0, max_connections=10):
+        self.base_url = base_url.rstrip("/")
+        self.session = httpx.AsyncClient(
+            base_url=self.base_url,
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        await self.session.aclose()
+
+    async def health_check(self):
+        """Check if the service is healthy"""
+        try:
+            response = await self.session.get("/health")
+            return response.status_code == 200, response.json()
+        except Exception as e:
+            return False, str(e)
+
+    async def get_languages(self):
+        """Get available languages"""
         try:
-            with open(file_path, 'rb') as f:
-                files = {'file': f}
-                data = {'language': language}
-                response = requests.post(f"{self.base_url}/transcribe", 
-                                       files=files, data=data)
-            
+            response = await self.session.get("/languages")
             if response.status_code == 200:
                 return True, response.json()
             else:
-                return False, f"HTTP {response.status_code}: {response.text}"
+                return False, f"HTTP {response.status_code}"
         except Exception as e:
             return False, str(e)
 
+    async def transcribe_file(self, file_path, language="en", long_audio=False, no_cache=False, retries=0, fields=None,
+                              grammar=None):
+        """Transcribe an audio file, retrying up to ``retries`` times when the service is overloaded
+
+        ``fields`` (e.g. ``"text"``) limits the result to the listed fields,
+        ``grammar`` (e.g. ``"yes,no,[unk]"``) the recognized phrases.
+        """
+        if not Path(file_path).exists():
+            return False, f"File not found: {file_path}"
+
+        content = await asyncio.to_thread(Path(file_path).read_bytes)
+        attempt = 0
+        while True:
+            response = None
+            try:
+                response = await self.session.post(
+                    "/transcribe",
+                    files={"file": (Path(file_path).name, content)},
+                    data=transcribe_form(language, long_audio, no_cache, fields, grammar),
+                )
+                if response.status_code not in RETRY_STATUS_CODES or attempt >= retries:
+                    return parse_response(response)
+            except httpx.TransportError as e:
+                if attempt >= retries:
+                    return False, str(e)
+            await asyncio.sleep(retry_delay(attempt, response))
+            attempt += 1
+
+    async def stream_file(self, file_path, language="en", speed=1.0, chunk_seconds=0.25, reconnects=0, grammar=None):
+        """Send a file over the WebSocket endpoint and return the recognized utterances
+
+        Audio goes out ``speed`` times faster than real time (0 for as fast
+        as the connection allows). With ``reconnects``, the session is
+        resumable: after a dropped connection the client reconnects up to that
+        many times and continues from the last byte the server acknowledged.
+        ``grammar`` restricts recognition to a phrase list.
+        """
+        import websockets
+
+        pcm, audio_format = await asyncio.to_thread(load_pcm, file_path)
+        frame_size = audio_format["channels"] * PCM_SAMPLE_WIDTHS[audio_format["format"]]
+        chunk_size = int(audio_format["sample_rate"] * chunk_seconds) * frame_size
+        bytes_per_second = audio_format["sample_rate"] * frame_size * speed
+        url = "ws" + self.base_url[len("http"):] + f"/ws/{language}"
+        session = {"id": None, "ack": 0}
+        results = []
+        started = time.monotonic()
+        attempt = 0
+
+        while True:
+            if session["id"] is None:
+                params = {"resumable": "true"} if reconnects else {}
+                if grammar:
+                    params["grammar"] = grammar
+                session_url = url + (f"?{urlencode(params)}" if params else "")
+            else:
+                session_url = url + f"?resume={session['id']}&offset={session['ack']}"
+            try:
+                async with websockets.connect(session_url, max_size=None) as ws:
+                    async def receive():
+                        async for message in ws:
+                            result = json.loads(message)
+                            if "session_id" in result:
+                                session["id"] = result["session_id"]
+                            elif "ack" in result:
+                                session["ack"] = result["ack"]
+                            elif "text" in result:
+                                results.append(result)
+
+                    receiver = asyncio.create_task(receive())
+                    try:
+                        if audio_format != DEFAULT_AUDIO_FORMAT and session["id"] is None:
+                            # The server downmixes and resamples, so the file is sent as it is
+                            await ws.send(json.dumps({"config": audio_format}))
+                        for offset in range(session["ack"], len(pcm), chunk_size):
+                            await ws.send(pcm[offset:offset + chunk_size])
+                            if speed > 0:
+                                delay = started + (offset + chunk_size) / bytes_per_second - time.monotonic()
+                                if delay > 0:
+                                    await asyncio.sleep(delay)
+                        await ws.send(json.dumps({"eof": 1}))
+                        # The server closes the connection after the final result
+                        await receiver
+                    finally:
+                        receiver.cancel()
+                return results
+            except (websockets.ConnectionClosedError, OSError) as e:
+                closed_by_server = isinstance(e, websockets.ConnectionClosedError) and e.rcvd is not None
+                if closed_by_server or session["id"] is None or attempt >= reconnects:
+                    reason = (e.rcvd.reason or e.rcvd.code) if closed_by_server else e
+                    raise RuntimeError(f"WebSocket closed: {reason}") from e
+                await asyncio.sleep(retry_delay(attempt))
+                attempt += 1
+
+
+def load_pcm(file_path):
+    """Read a file as raw PCM and its format for the WebSocket config message
+
+    16 and 32-bit WAV files are sent at their own rate and channel count;
+    anything else is converted to 16 kHz mono s16 with ffmpeg.
+    """
+    try:
+        with wave.open(str(file_path), "rb") as wav:
+            sample_format = {2: "s16le", 4: "s32le"}.get(wav.getsampwidth())
+            if sample_format is not None:
+                audio_format = {"sample_rate": wav.getframerate(), "channels": wav.getnchannels(), "format": sample_format}
+                return wav.readframes(wav.getnframes()), audio_format
+    except (wave.Error, EOFError):
+        pass
+
+    if shutil.which("ffmpeg") is None:
+        raise RuntimeError("ffmpeg is needed to stream files that are not 16 kHz mono 16-bit WAV")
+    process = subprocess.run(
+        ["ffmpeg", "-nostdin", "-loglevel", "error", "-i", str(file_path),
+         "-ac", "1", "-ar", str(SAMPLE_RATE), "-f", "s16le", "-"],
+        capture_output=True,
+    )
+    if process.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {process.stderr.decode(errors='replace').strip()}")
+    return process.stdout, dict(DEFAULT_AUDIO_FORMAT)
+
+
+def find_audio_files(directory):
+    return sorted(
+        path for path in Path(directory).rglob("*")
+        if path.is_file() and path.suffix.lower() in AUDIO_EXTENSIONS
+    )
+
+
+def read_manifest(manifest_path):
+    """Files already transcribed successfully, from an earlier run's manifest"""
+    done = set()
+    if manifest_path.exists():
+        with open(manifest_path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A line cut short by an interrupted run
+                    continue
+                if entry.get("success"):
+                    done.add(entry["file"])
+    return done
+
+
+async def transcribe_directory(client, directory, language="en", concurrency=4, retries=3,
+                               manifest_path=None, long_audio=False, fields=None, grammar=None):
+    """Transcribe every audio file under ``directory``, appending results to a JSON Lines manifest
+
+    Files already in the manifest with a successful result are skipped, so an
+    interrupted run picks up where it stopped. Returns the counts of
+    succeeded and failed files.
+    """
+    manifest_path = Path(manifest_path or Path(directory) / "transcripts.jsonl")
+    done = read_manifest(manifest_path)
+    files = [path for path in find_audio_files(directory) if str(path) not in done]
+    if done:
+        print(f"⏭️  Skipping {len(done)} files already in {manifest_path}", file=sys.stderr)
+
+    queue = asyncio.Queue()
+    for path in files:
+        queue.put_nowait(path)
+    counts = {"succeeded": 0, "failed": 0}
+    started = time.monotonic()
+    audio_bytes = 0
+
+    with open(manifest_path, "a") as manifest:
+        async def worker():
+            nonlocal audio_bytes
+            while not queue.empty():
+                path = queue.get_nowait()
+                file_started = time.monotonic()
+                success, result = await client.transcribe_file(
+                    path, language, long_audio=long_audio, retries=retries, fields=fields, grammar=grammar
+                )
+                if success and not result.get("success"):
+                    success, result = False, result.get("error", "Unknown error")
+                entry = {"file": str(path), "success": success, "seconds": round(time.monotonic() - file_started, 3)}
+                if success:
+                    entry["text"] = result.get("text", "")
+                    entry["result"] = result
+                else:
+                    entry["error"] = result
+                manifest.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                manifest.flush()
+
+                counts["succeeded" if success else "failed"] += 1
+                audio_bytes += path.stat().st_size
+                finished = counts["succeeded"] + counts["failed"]
+                elapsed = max(time.monotonic() - started, 1e-9)
+                status = "✅" if success else f"❌ {result}"
+                print(
+                    f"[{finished}/{len(files)}] {path} {status} "
+                    f"({finished / elapsed:.2f} files/s, {audio_bytes / elapsed / 1e6:.2f} MB/s)",
+                    file=sys.stderr,
+                )
+
+        await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+    return counts
+
+
+def print_result(success, result):
+    if success:
+        if result.get('success'):
+            print("✅ Transcription completed:")
+            print(f"Text: {result.get('text', 'N/A')}")
+            print(f"Language: {result.get('language', 'N/A')}")
+            print(f"Confidence: {result.get('confidence', 'N/A')}")
+        else:
+            print(f"❌ Transcription failed: {result.get('error', 'Unknown error')}")
+    else:
+        print(f"❌ Request failed: {result}")
+
+
+async def run_batch(args):
+    async with AsyncVOSKClient(args.url, max_connections=args.concurrency) as client:
+        counts = await transcribe_directory(
+            client, args.directory, args.language, args.concurrency, args.retries, args.manifest, args.long_audio,
+            args.fields, args.grammar,
+        )
+    print(f"✅ {counts['succeeded']} transcribed, ❌ {counts['failed']} failed")
+    return 1 if counts["failed"] else 0
+
+
+async def run_stream(args):
+    async with AsyncVOSKClient(args.url) as client:
+        started = time.monotonic()
+        results = await client.stream_file(
+            args.file, args.language, speed=args.speed, reconnects=args.reconnects, grammar=args.grammar
+        )
+        elapsed = time.monotonic() - started
+    pcm, audio_format = await asyncio.to_thread(load_pcm, args.file)
+    frame_size = audio_format["channels"] * PCM_SAMPLE_WIDTHS[audio_format["format"]]
+    audio_seconds = len(pcm) / (audio_format["sample_rate"] * frame_size)
+    print("✅ Streaming completed:")
+    print(f"Text: {' '.join(result['text'] for result in results if result.get('text'))}")
+    print(f"Audio: {audio_seconds:.1f}s in {elapsed:.1f}s ({audio_seconds / max(elapsed, 1e-9):.1f}x real time)")
+    return 0
+
+
 def main():
-    if len(sys.argv) < 2:
-        print("Usage:")
-        print(f"  {sys.argv[0]} health                    # Check service health")
-        print(f"  {sys.argv[0]} languages                 # List available languages")
-        print(f"  {sys.argv[0]} transcribe <file> [lang]  # Transcribe audio file")
-        print()
-        print("Examples:")
-        print(f"  {sys.argv[0]} health")
-        print(f"  {sys.argv[0]} transcribe audio.wav en")
-        print(f"  {sys.argv[0]} transcribe vietnamese.mp3 vi")
-        sys.exit(1)
-    
-    client = VOSKClient()
-    command = sys.argv[1]
-    
-    if command == "health":
+    parser = argparse.ArgumentParser(description="Client for VOSK STT API")
+    parser.add_argument("--url", default="http://localhost:8000", help="Service URL")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("health", help="Check service health")
+    commands.add_parser("languages", help="List available languages")
+
+    transcribe = commands.add_parser("transcribe", help="Transcribe an audio file")
+    transcribe.add_argument("file")
+    transcribe.add_argument("language", nargs="?", default="en")
+    transcribe.add_argument("--long-audio", action="store_true", help="Split long recordings and decode in parallel")
+    transcribe.add_argument("--retries", type=int, default=3)
+    transcribe.add_argument("--fields", help="Comma-separated result fields, e.g. text or text,words")
+    transcribe.add_argument("--grammar", help="Comma-separated phrases to recognize, e.g. yes,no,[unk]")
+
+    batch = commands.add_parser("batch", help="Transcribe every audio file under a directory")
+    batch.add_argument("directory")
+    batch.add_argument("language", nargs="?", default="en")
+    batch.add_argument("--concurrency", type=int, default=4, help="Files transcribed at a time")
+    batch.add_argument("--retries", type=int, default=3, help="Retries per file on overload or connection errors")
+    batch.add_argument("--manifest", help="JSON Lines results file, also used to resume (default: DIRECTORY/transcripts.jsonl)")
+    batch.add_argument("--long-audio", action="store_true", help="Split long recordings and decode in parallel")
+    batch.add_argument("--fields", help="Comma-separated result fields kept in the manifest, e.g. text")
+    batch.add_argument("--grammar", help="Comma-separated phrases to recognize, e.g. yes,no,[unk]")
+
+    stream = commands.add_parser("stream", help="Stream an audio file over the WebSocket endpoint")
+    stream.add_argument("file")
+    stream.add_argument("language", nargs="?", default="en")
+    stream.add_argument("--speed", type=float, default=1.0, help="Times faster than real time (0 = unthrottled)")
+    stream.add_argument("--reconnects", type=int, default=3, help="Times to resume the session after a dropped connection")
+    stream.add_argument("--grammar", help="Comma-separated phrases to recognize, e.g. yes,no,[unk]")
+
+    args = parser.parse_args()
+
+    if args.command == "health":
         print("🔍 Checking service health...")
-        success, result = client.health_check()
+        with VOSKClient(args.url) as client:
+            success, result = client.health_check()
         if success:
             print("✅ Service is healthy")
             print(f"Details: {json.dumps(result, indent=2)}")
         else:
             print(f"❌ Service is not healthy: {result}")
-    
-    elif command == "languages":
+
+    elif args.command == "languages":
         print("🌐 Getting available languages...")
-        success, result = client.get_languages()
+        with VOSKClient(args.url) as client:
+            success, result = client.get_languages()
         if success:
             print("✅ Available languages:")
             print(f"{json.dumps(result, indent=2)}")
         else:
             print(f"❌ Failed to get languages: {result}")
-    
-    elif command == "transcribe":
-        if len(sys.argv) < 3:
-            print("❌ Please provide audio file path")
+
+    elif args.command == "transcribe":
+        print(f"🎤 Transcribing {args.file} (language: {args.language})...")
+        with VOSKClient(args.url) as client:
+            print_result(*client.transcribe_file(
+                args.file, args.language, long_audio=args.long_audio, retries=args.retries, fields=args.fields,
+                grammar=args.grammar
+            ))
+
+    elif args.command == "batch":
+        print(f"📁 Transcribing {args.directory} (language: {args.language}, concurrency: {args.concurrency})...")
+        sys.exit(asyncio.run(run_batch(args)))
+
+    elif args.command == "stream":
+        print(f"🎙️  Streaming {args.file} (language: {args.language}, speed: {args.speed or 'unthrottled'})...")
+        try:
+            sys.exit(asyncio.run(run_stream(args)))
+        except RuntimeError as e:
+            print(f"❌ Streaming failed: {e}")
             sys.exit(1)
-        
-        file_path = sys.argv[2]
-        language = sys.argv[3] if len(sys.argv) > 3 else "en"
-        
-        print(f"🎤 Transcribing {file_path} (language: {language})...")
-        success, result = client.transcribe_file(file_path, language)
-        
-        if success:
-            if result.get('success'):
-                print("✅ Transcription completed:")
-                print(f"Text: {result.get('text', 'N/A')}")
-                print(f"Language: {result.get('language', 'N/A')}")
-                print(f"Confidence: {result.get('confidence', 'N/A')}")
-            else:
-                print(f"❌ Transcription failed: {result.get('error', 'Unknown error')}")
-        else:
-            print(f"❌ Request failed: {result}")
-    
-    else:
-        print(f"❌ Unknown command: {command}")
-        sys.exit(1)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,93 @@
+import json
+from typing import Any, Callable, FrozenSet, Iterable, Optional, Union
+
+from fastapi.responses import JSONResponse
+
+# Both are optional: orjson only makes JSON faster, msgpack enables binary WebSocket frames
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Fields a client can select; "words" stands for the word lists of both
+# /transcribe (detailed_results) and the recognizer frames (result)
+RESULT_FIELDS = ("text", "words", "detailed_results", "result", "confidence", "language", "language_scores",
+                 "partial_result", "spk")
+FIELD_ALIASES = {"words": ("detailed_results", "result")}
+# Kept whatever is selected: they say what a record is, why it failed, or where a session stands
+ALWAYS_INCLUDED = frozenset({"success", "error", "type", "index", "filename", "partial", "session_id", "offset", "ack"})
+
+# Encodings of WebSocket result frames
+WS_ENCODINGS = ("json", "msgpack")
+
+
+def dumps(obj: Any) -> bytes:
+    """Serialize to compact UTF-8 JSON, with orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def dumps_text(obj: Any) -> str:
+    return dumps(obj).decode("utf-8")
+
+
+def loads(data: Union[str, bytes]) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with ``dumps``"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def parse_fields(value: Optional[str]) -> Optional[FrozenSet[str]]:
+    """Parse a comma-separated field list such as ``text,words``; None or empty selects everything"""
+    if not value or not value.strip():
+        return None
+    names = {name.strip() for name in value.split(",") if name.strip()}
+    unknown = names.difference(RESULT_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown fields {sorted(unknown)}. Available: {list(RESULT_FIELDS)}")
+    for alias, expansion in FIELD_ALIASES.items():
+        if alias in names:
+            names.update(expansion)
+    return frozenset(names | ALWAYS_INCLUDED)
+
+
+def select_fields(result: dict, fields: Optional[Iterable[str]]) -> dict:
+    """The keys of ``result`` that were selected, or all of them"""
+    if fields is None:
+        return result
+    return {key: value for key, value in result.items() if key in fields}
+
+
+class FrameEncoder:
+    """Re-encodes recognizer JSON for a WebSocket client
+
+    Without selected fields, JSON frames are forwarded untouched. Otherwise
+    each frame is parsed, trimmed to ``fields`` and encoded compactly, as
+    MessagePack binary frames when ``encoding`` is ``msgpack``.
+    """
+
+    def __init__(self, fields: Optional[FrozenSet[str]] = None, encoding: str = "json"):
+        if encoding not in WS_ENCODINGS:
+            raise ValueError(f"Unknown encoding {encoding!r}, expected one of {list(WS_ENCODINGS)}")
+        if encoding == "msgpack" and msgpack is None:
+            raise ValueError("The msgpack encoding needs the msgpack package")
+        self.fields = fields
+        self.encoding = encoding
+        self._encode: Callable[[Any], Union[str, bytes]] = msgpack.packb if encoding == "msgpack" else dumps_text
+
+    def encode(self, payload: str) -> Union[str, bytes]:
+        if self.fields is None and self.encoding == "json":
+            return payload
+        return self._encode(select_fields(loads(payload), self.fields))
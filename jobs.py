@@ -0,0 +1,272 @@
+import asyncio
+import heapq
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_COMPLETED = "completed"
+STATUS_FAILED = "failed"
+
+# Runs one job: (audio, language, options) -> transcription result
+JobRunner = Callable[[bytes, str, dict], Awaitable[dict]]
+
+# Seconds between checks for a job finishing in another server process
+JOB_POLL_INTERVAL = 1.0
+
+
+class JobStore:
+    """SQLite persistence for transcription jobs
+
+    Queued audio is kept in the database until the job finishes, so work
+    accepted before a restart is picked up again afterwards.
+    """
+
+    def __init__(self, path: str):
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    priority INTEGER NOT NULL,
+                    language TEXT NOT NULL,
+                    options TEXT NOT NULL,
+                    estimated_duration REAL NOT NULL,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    result TEXT,
+                    error TEXT,
+                    audio BLOB
+                )
+                """
+            )
+
+    def create(self, audio: bytes, language: str, priority: int, estimated_duration: float, options: dict) -> dict:
+        job = {
+            "id": uuid.uuid4().hex,
+            "status": STATUS_QUEUED,
+            "priority": priority,
+            "language": language,
+            "options": options,
+            "estimated_duration": estimated_duration,
+            "created_at": time.time(),
+        }
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, status, priority, language, options, estimated_duration, created_at, audio) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job["id"], job["status"], priority, language, json.dumps(options),
+                 estimated_duration, job["created_at"], audio),
+            )
+        return job
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, status, priority, language, options, estimated_duration, created_at, "
+                "started_at, finished_at, result, error FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["options"] = json.loads(job["options"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def load_audio(self, job_id: str) -> Optional[bytes]:
+        with self._lock:
+            row = self._conn.execute("SELECT audio FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row["audio"] if row else None
+
+    def claim(self, job_id: str) -> bool:
+        """Mark a queued job as running; False if another process got to it first"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = ?, started_at = ? WHERE id = ? AND status = ?",
+                (STATUS_RUNNING, time.time(), job_id, STATUS_QUEUED),
+            )
+        return cursor.rowcount == 1
+
+    def requeue(self, job_id: str) -> None:
+        """Put a job that was interrupted back in the queue"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, started_at = NULL WHERE id = ? AND status = ?",
+                (STATUS_QUEUED, job_id, STATUS_RUNNING),
+            )
+
+    def requeue_interrupted(self) -> int:
+        """Requeue every running job; only safe while no other process is running jobs"""
+        with self._lock:
+            cursor = self._conn.execute("UPDATE jobs SET status = ? WHERE status = ?", (STATUS_QUEUED, STATUS_RUNNING))
+        return cursor.rowcount
+
+    def finish(self, job_id: str, result: Optional[dict], error: Optional[str]) -> None:
+        """Store the outcome and drop the audio, which is no longer needed"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, result = ?, error = ?, audio = NULL WHERE id = ?",
+                (STATUS_FAILED if error else STATUS_COMPLETED, time.time(),
+                 json.dumps(result) if result is not None else None, error, job_id),
+            )
+
+    def pending(self, requeue_interrupted: bool = True) -> List[Tuple[str, int, float, float]]:
+        """Jobs that still need to run, including ones interrupted by a restart unless ``requeue_interrupted`` is off"""
+        if requeue_interrupted:
+            self.requeue_interrupted()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, priority, estimated_duration, created_at FROM jobs WHERE status = ?",
+                (STATUS_QUEUED,),
+            ).fetchall()
+        return [(row["id"], row["priority"], row["estimated_duration"], row["created_at"]) for row in rows]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class JobScheduler:
+    """Runs queued jobs in priority order
+
+    Higher ``priority`` runs first. Within a priority, shorter audio goes
+    first, so a short interactive clip isn't stuck behind hour-long uploads.
+    Ties are broken by submission time.
+
+    Several processes can share one store: each job runs in the process that
+    claims it first. Only a scheduler with ``recover_interrupted`` set
+    requeues jobs left running by a previous run, so that must be off when
+    other processes may be running jobs.
+    """
+
+    def __init__(self, store: JobStore, runner: JobRunner, concurrency: int, recover_interrupted: bool = True):
+        self.store = store
+        self.recover_interrupted = recover_interrupted
+        self.runner = runner
+        self.concurrency = max(1, concurrency)
+        self._heap: List[Tuple[int, float, float, str]] = []
+        # Counts queued jobs; jobs submitted before start() wait for it
+        self._available = asyncio.Semaphore(0)
+        self._tasks: List[asyncio.Task] = []
+        self._done_events: Dict[str, asyncio.Event] = {}
+        # Long polls waiting on each entry of _done_events; the last one
+        # removes it, since a job run by another process never sets it
+        self._waiters: Dict[str, int] = {}
+        self.running = 0
+
+    async def start(self) -> None:
+        loop = asyncio.get_running_loop()
+        pending = await loop.run_in_executor(None, self.store.pending, self.recover_interrupted)
+        submitted = {entry[3] for entry in self._heap}
+        for job_id, priority, estimated_duration, created_at in pending:
+            if job_id not in submitted:
+                self._push(job_id, priority, estimated_duration, created_at)
+        if self._heap:
+            logger.info(f"Resuming {len(self._heap)} queued jobs")
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.concurrency)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._heap)
+
+    def _push(self, job_id: str, priority: int, estimated_duration: float, created_at: float) -> None:
+        heapq.heappush(self._heap, (-priority, estimated_duration, created_at, job_id))
+        self._available.release()
+
+    async def submit(self, audio: bytes, language: str, priority: int, estimated_duration: float,
+                     options: Dict[str, Any]) -> dict:
+        job = await asyncio.get_running_loop().run_in_executor(
+            None, self.store.create, audio, language, priority, estimated_duration, options
+        )
+        self._push(job["id"], priority, estimated_duration, job["created_at"])
+        return job
+
+    async def get(self, job_id: str, wait: float = 0) -> Optional[dict]:
+        """Return a job, waiting up to ``wait`` seconds for it to finish"""
+        loop = asyncio.get_running_loop()
+        if wait <= 0:
+            return await loop.run_in_executor(None, self.store.get, job_id)
+
+        # Register before looking so a job finishing in between still wakes us
+        event = self._done_events.setdefault(job_id, asyncio.Event())
+        self._waiters[job_id] = self._waiters.get(job_id, 0) + 1
+        try:
+            job = await loop.run_in_executor(None, self.store.get, job_id)
+            if job is None or job["status"] in (STATUS_COMPLETED, STATUS_FAILED):
+                return job
+
+            # The job may finish in another server process, so look again every so often
+            deadline = loop.time() + wait
+            while True:
+                try:
+                    await asyncio.wait_for(event.wait(), timeout=min(JOB_POLL_INTERVAL, deadline - loop.time()))
+                except asyncio.TimeoutError:
+                    pass
+                job = await loop.run_in_executor(None, self.store.get, job_id)
+                if event.is_set() or job["status"] in (STATUS_COMPLETED, STATUS_FAILED) or loop.time() >= deadline:
+                    return job
+        finally:
+            self._waiters[job_id] -= 1
+            if not self._waiters[job_id]:
+                del self._waiters[job_id]
+                self._done_events.pop(job_id, None)
+
+    async def _work(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._available.acquire()
+            _, _, _, job_id = heapq.heappop(self._heap)
+            job = await loop.run_in_executor(None, self.store.get, job_id)
+            audio = await loop.run_in_executor(None, self.store.load_audio, job_id)
+            if job is None or audio is None:
+                continue
+
+            if not await loop.run_in_executor(None, self.store.claim, job_id):
+                continue
+            self.running += 1
+            result, error = None, None
+            try:
+                result = await self.runner(audio, job["language"], job["options"])
+                if not result.get("success"):
+                    error = result.get("error", "Transcription failed")
+            except asyncio.CancelledError:
+                # Shutting down; another process, or the next start, picks the job up again
+                self.store.requeue(job_id)
+                raise
+            except Exception as e:
+                logger.error(f"Job {job_id} failed: {e}")
+                error = str(e)
+            finally:
+                self.running -= 1
+
+            await loop.run_in_executor(None, self.store.finish, job_id, result, error)
+            event = self._done_events.pop(job_id, None)
+            if event is not None:
+                event.set()
+
+    def stats(self) -> dict:
+        return {
+            "concurrency": self.concurrency,
+            "queued": self.queue_depth,
+            "running": self.running,
+        }
@@ -0,0 +1,306 @@
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, Mapping, Optional, Union
+
+import vosk
+
+logger = logging.getLogger(__name__)
+
+# Language codes double as directory names, so keep them to safe characters
+LANGUAGE_PATTERN = re.compile(r"^[A-Za-z0-9_-]+$")
+
+# Load states reported per language
+STATE_AVAILABLE = "available"
+STATE_LOADING = "loading"
+STATE_WARMING = "warming"
+STATE_READY = "ready"
+STATE_FAILED = "failed"
+
+# ``pinned`` value that pins every available language
+PIN_ALL = "all"
+
+
+def parse_pinned(value: str) -> Union[List[str], str]:
+    """``PIN_ALL``, or the languages of a comma-separated list; ``none`` or empty pins nothing"""
+    value = value.strip()
+    if value.lower() == PIN_ALL:
+        return PIN_ALL
+    return [language.strip() for language in value.split(",") if language.strip() and language.strip() != "none"]
+
+
+def directory_size(path: str) -> int:
+    """Total size of the files under ``path``, used as a model's memory estimate"""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class ModelRegistry(Mapping[str, "vosk.Model"]):
+    """Lazily loaded VOSK models, one per language
+
+    Every directory under ``models_dir`` is a language named after the
+    directory; ``paths`` adds or overrides individual languages. Membership
+    tests and ``keys()`` cover every available language, loaded or not, and
+    ``registry[language]`` loads the model on first use. Concurrent first
+    requests for a language wait for a single load.
+
+    When the loaded models' on-disk size exceeds ``memory_budget`` bytes, the
+    least recently used ones are unloaded, except for ``pinned`` languages;
+    with ``pinned=PIN_ALL``, every language found by ``refresh`` is pinned.
+    ``on_evict`` is called with the language of every unloaded model, and
+    ``on_load`` with the language of every newly loaded one, to warm it up
+    before ``load`` returns. Each language's state and timings are reported
+    by ``status()``.
+    """
+
+    def __init__(
+        self,
+        models_dir: str,
+        paths: Optional[Mapping[str, str]] = None,
+        memory_budget: int = 0,
+        pinned: Union[Iterable[str], str] = (),
+        on_evict: Optional[Callable[[str], None]] = None,
+        on_load: Optional[Callable[[str], None]] = None,
+    ):
+        self.models_dir = models_dir
+        self.extra_paths = dict(paths or {})
+        self.memory_budget = max(0, memory_budget)
+        self.pin_all = pinned == PIN_ALL
+        self.pinned = set() if self.pin_all else set(pinned)
+        self.on_evict = on_evict
+        self.on_load = on_load
+        self._paths: Dict[str, str] = {}
+        # Loaded models, least recently used first
+        self._loaded: "OrderedDict[str, vosk.Model]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._load_seconds: Dict[str, float] = {}
+        self._warmup_seconds: Dict[str, float] = {}
+        self._states: Dict[str, str] = {}
+        self._errors: Dict[str, str] = {}
+        self._load_locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.evictions = 0
+        self.refresh()
+
+    def refresh(self) -> List[str]:
+        """Rescan ``models_dir`` for model directories and return the available languages"""
+        paths = {}
+        if os.path.isdir(self.models_dir):
+            for name in sorted(os.listdir(self.models_dir)):
+                path = os.path.join(self.models_dir, name)
+                if LANGUAGE_PATTERN.match(name) and os.path.isdir(path):
+                    paths[name] = path
+        for language, path in self.extra_paths.items():
+            if os.path.isdir(path):
+                paths[language] = path
+            else:
+                logger.warning(f"Model for {language} not found at {path}")
+        with self._lock:
+            self._paths = paths
+            if self.pin_all:
+                self.pinned = set(paths)
+        return list(paths)
+
+    def _path(self, language: str) -> Optional[str]:
+        with self._lock:
+            path = self._paths.get(language)
+        if path is not None or not isinstance(language, str) or not LANGUAGE_PATTERN.match(language):
+            return path
+        # Pick up a model directory added since the last scan
+        path = os.path.join(self.models_dir, language)
+        if not os.path.isdir(path):
+            return None
+        with self._lock:
+            self._paths[language] = path
+        return path
+
+    def __contains__(self, language: object) -> bool:
+        return self._path(language) is not None
+
+    def __iter__(self) -> Iterator[str]:
+        with self._lock:
+            return iter(list(self._paths))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._paths)
+
+    def __getitem__(self, language: str) -> "vosk.Model":
+        model = self.get_loaded(language)
+        if model is not None:
+            return model
+        return self.load(language)
+
+    def get_loaded(self, language: str) -> Optional["vosk.Model"]:
+        """Return the model if it is loaded, marking it as recently used"""
+        with self._lock:
+            model = self._loaded.get(language)
+            if model is not None:
+                self._loaded.move_to_end(language)
+            return model
+
+    def is_loaded(self, language: str) -> bool:
+        with self._lock:
+            return language in self._loaded
+
+    @property
+    def loaded(self) -> List[str]:
+        with self._lock:
+            return list(self._loaded)
+
+    def load(self, language: str) -> "vosk.Model":
+        """Load a model, or wait for a load already in progress"""
+        path = self._path(language)
+        if path is None:
+            raise KeyError(language)
+
+        with self._lock:
+            load_lock = self._load_locks.setdefault(language, threading.Lock())
+        with load_lock:
+            model = self.get_loaded(language)
+            if model is not None:
+                return model
+
+            logger.info(f"Loading {language} model from {path}...")
+            self._set_state(language, STATE_LOADING)
+            started = time.perf_counter()
+            try:
+                model = vosk.Model(path)
+            except Exception as e:
+                self._set_state(language, STATE_FAILED, str(e))
+                raise
+            elapsed = time.perf_counter() - started
+            size = directory_size(path)
+            logger.info(f"{language} model loaded in {elapsed:.1f}s")
+
+            with self._lock:
+                self._loaded[language] = model
+                self._sizes[language] = size
+                self._load_seconds[language] = elapsed
+                self.loads += 1
+                evicted = self._evict_over_budget(keep=language)
+
+        for evicted_language in evicted:
+            logger.info(f"Unloaded {evicted_language} model to stay within the memory budget")
+            if self.on_evict is not None:
+                self.on_evict(evicted_language)
+
+        if self.on_load is not None:
+            self._set_state(language, STATE_WARMING)
+            started = time.perf_counter()
+            try:
+                self.on_load(language)
+            except Exception as e:
+                # A cold model still works, so this doesn't fail the load
+                logger.warning(f"Warm-up of {language} model failed: {e}")
+            with self._lock:
+                self._warmup_seconds[language] = time.perf_counter() - started
+        self._set_state(language, STATE_READY)
+        return model
+
+    def load_many(self, languages: Iterable[str], max_workers: int = 0) -> Dict[str, Exception]:
+        """Load several models in parallel and return the errors of those that failed"""
+        languages = list(languages)
+        errors: Dict[str, Exception] = {}
+        if not languages:
+            return errors
+
+        def load(language: str) -> None:
+            try:
+                self.load(language)
+            except Exception as e:
+                logger.error(f"Error loading {language} model: {e}")
+                errors[language] = e
+
+        with ThreadPoolExecutor(max_workers=max_workers or len(languages), thread_name_prefix="model-load") as executor:
+            list(executor.map(load, languages))
+        return errors
+
+    def _set_state(self, language: str, state: str, error: Optional[str] = None) -> None:
+        with self._lock:
+            self._states[language] = state
+            if error is None:
+                self._errors.pop(language, None)
+            else:
+                self._errors[language] = error
+
+    def state(self, language: str) -> str:
+        with self._lock:
+            return self._states.get(language, STATE_AVAILABLE)
+
+    def _evict_over_budget(self, keep: str) -> List[str]:
+        # Called with self._lock held
+        evicted = []
+        if not self.memory_budget:
+            return evicted
+        for language in list(self._loaded):
+            if sum(self._sizes.values()) <= self.memory_budget:
+                break
+            if language == keep or language in self.pinned:
+                continue
+            # Recognizers still using the model keep the native object alive until they are freed
+            del self._loaded[language]
+            del self._sizes[language]
+            self._states[language] = STATE_AVAILABLE
+            self.evictions += 1
+            evicted.append(language)
+        return evicted
+
+    def unload(self, language: str) -> bool:
+        """Unload a model; returns False if it was not loaded"""
+        with self._lock:
+            if self._loaded.pop(language, None) is None:
+                return False
+            self._sizes.pop(language, None)
+            self._states[language] = STATE_AVAILABLE
+        if self.on_evict is not None:
+            self.on_evict(language)
+        return True
+
+    def load_pinned(self, max_workers: int = 0) -> Dict[str, Exception]:
+        """Load every pinned model that is available, in parallel"""
+        available = []
+        for language in sorted(self.pinned):
+            if language in self:
+                available.append(language)
+            else:
+                logger.warning(f"Pinned model {language} not found")
+        return self.load_many(available, max_workers)
+
+    def status(self) -> Dict[str, dict]:
+        """State, load time and warm-up time of every available language"""
+        with self._lock:
+            return {
+                language: {
+                    "state": self._states.get(language, STATE_AVAILABLE),
+                    "pinned": language in self.pinned,
+                    "load_seconds": round(self._load_seconds[language], 3) if language in self._load_seconds else None,
+                    "warmup_seconds": round(self._warmup_seconds[language], 3) if language in self._warmup_seconds else None,
+                    "error": self._errors.get(language),
+                }
+                for language in self._paths
+            }
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "available": list(self._paths),
+                "loaded": list(self._loaded),
+                "pinned": sorted(self.pinned),
+                "memory_budget": self.memory_budget,
+                "loaded_bytes": sum(self._sizes.values()),
+                "loads": self.loads,
+                "evictions": self.evictions,
+                "load_seconds": {language: round(seconds, 3) for language, seconds in self._load_seconds.items()},
+            }
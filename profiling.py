@@ -0,0 +1,196 @@
+import asyncio
+import hmac
+import inspect
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Stage timings of the request being traced, if it asked for them
+_trace: ContextVar[Optional[Dict[str, float]]] = ContextVar("trace", default=None)
+
+
+def trace_stage(stage: str, seconds: float) -> None:
+    """Add ``seconds`` to ``stage`` of the current request's trace, if it is traced"""
+    trace = _trace.get()
+    if trace is not None:
+        trace[stage] = trace.get(stage, 0.0) + seconds
+
+
+def token_matches(token: Optional[str], expected: str) -> bool:
+    return bool(expected) and token is not None and hmac.compare_digest(token.encode(), expected.encode())
+
+
+class TracingMiddleware:
+    """ASGI middleware that reports the stage timings of a request in a Server-Timing header
+
+    Requests opt in with ``X-Trace: 1`` and a valid ``X-Admin-Token``. Stages
+    recorded with ``trace_stage`` while the request runs, e.g. ``convert``
+    and ``decode`` from the transcription worker, are listed with the total;
+    a streamed response only carries the stages done before its first byte.
+    """
+
+    def __init__(self, app, admin_token: str):
+        self.app = app
+        self.admin_token = admin_token
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.admin_token:
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope["headers"])
+        if headers.get(b"x-trace", b"").lower() not in (b"1", b"true"):
+            await self.app(scope, receive, send)
+            return
+        if not token_matches(headers.get(b"x-admin-token", b"").decode("latin-1"), self.admin_token):
+            await self.app(scope, receive, send)
+            return
+
+        trace: Dict[str, float] = {}
+        started = time.perf_counter()
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                timings = [*trace.items(), ("total", time.perf_counter() - started)]
+                value = ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings)
+                message = {**message, "headers": [*message.get("headers", []), (b"server-timing", value.encode())]}
+            await send(message)
+
+        token = _trace.set(trace)
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _trace.reset(token)
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _stack(frame) -> List[str]:
+    """Labels of ``frame`` and its callers, outermost first"""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.reverse()
+    return labels
+
+
+class StackSampler:
+    """Wall-clock sampling profiler for every thread of the process
+
+    Takes the Python stack of each thread every ``interval`` seconds and
+    counts identical stacks, rooted at the thread name. ``collapse`` renders
+    them in the folded format read by flamegraph.pl, speedscope and inferno.
+    Threads waiting (e.g. the event loop in ``select``) show up as well, which
+    is what a latency investigation needs.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.samples = 0
+
+    def sample(self, seconds: float) -> Counter:
+        counts: Counter = Counter()
+        own = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                name = names.get(ident, f"thread-{ident}").replace(";", ":").replace(" ", "_")
+                counts[";".join([name, *_stack(frame)])] += 1
+            self.samples += 1
+            time.sleep(self.interval)
+        return counts
+
+    @staticmethod
+    def collapse(counts: Counter) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in counts.most_common())
+
+
+class LoopLagMonitor:
+    """Reports event-loop stalls and the coroutine that caused them
+
+    A heartbeat task wakes every ``interval`` seconds and passes how late it
+    woke up to ``on_lag``. A watchdog thread notices when the heartbeat is
+    more than ``threshold`` seconds overdue, and logs the stack of the loop
+    thread at that moment: the code blocking the loop. The last stalls are
+    kept in ``stalls``.
+    """
+
+    def __init__(self, threshold: float, interval: float = 0.1,
+                 on_lag: Optional[Callable[[float], None]] = None, history: int = 20):
+        self.threshold = threshold
+        self.interval = interval
+        self.on_lag = on_lag
+        self.stalls: deque = deque(maxlen=history)
+        self._beat = time.monotonic()
+        self._loop_thread: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopped = threading.Event()
+
+    def start(self) -> None:
+        """Start monitoring the running event loop"""
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat())
+        threading.Thread(target=self._watch, name="loop-lag-monitor", daemon=True).start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _heartbeat(self) -> None:
+        while True:
+            expected = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - expected)
+            self._beat = time.monotonic()
+            if self.on_lag is not None:
+                self.on_lag(lag)
+
+    def _watch(self) -> None:
+        reported = None
+        while not self._stopped.wait(min(self.interval, self.threshold / 2)):
+            beat = self._beat
+            overdue = time.monotonic() - beat - self.interval
+            if overdue <= self.threshold or reported == beat:
+                continue
+            # Report each stall once, while the loop is still stuck in it
+            reported = beat
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            stack = _stack(frame)
+            coroutine = self._blocking_coroutine(frame)
+            self.stalls.append({
+                "time": time.time(),
+                "blocked_for": round(overdue, 3),
+                "coroutine": coroutine,
+                "stack": stack,
+            })
+            logger.warning(
+                f"Event loop blocked for over {overdue:.2f}s in {coroutine or 'a callback'}:\n  "
+                + "\n  ".join(stack[-15:])
+            )
+
+    @staticmethod
+    def _blocking_coroutine(frame) -> Optional[str]:
+        """The innermost coroutine on the stack"""
+        while frame is not None:
+            if frame.f_code.co_flags & (inspect.CO_COROUTINE | inspect.CO_ASYNC_GENERATOR):
+                return _frame_label(frame)
+            frame = frame.f_back
+        return None
@@ -0,0 +1,181 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Mapping, Optional, Tuple, Union
+
+import vosk
+
+# (language, sample rate, grammar hash or "" for the full vocabulary)
+PoolKey = Tuple[str, int, str]
+
+# Phrases accepted in one grammar
+MAX_GRAMMAR_PHRASES = 1000
+
+
+def parse_grammar(value: Union[None, str, Iterable[str]]) -> Optional[str]:
+    """Normalize a phrase list into the JSON grammar KaldiRecognizer takes
+
+    ``value`` is a JSON array such as ``["yes", "no", "[unk]"]``, a
+    comma-separated string, or a list. Phrases are lowercased and sorted, so
+    the same command set always gives the same grammar. None or an empty
+    list means the full vocabulary.
+    """
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = value.strip()
+        if value.startswith("["):
+            try:
+                value = json.loads(value)
+            except ValueError:
+                # "[unk],yes,no" is a phrase list, not broken JSON
+                value = value.split(",")
+        else:
+            value = value.split(",")
+    if not isinstance(value, list) or not all(isinstance(phrase, str) for phrase in value):
+        raise ValueError("The grammar must be a list of phrases")
+    phrases = sorted({" ".join(phrase.lower().split()) for phrase in value} - {""})
+    if len(phrases) > MAX_GRAMMAR_PHRASES:
+        raise ValueError(f"The grammar has {len(phrases)} phrases, the limit is {MAX_GRAMMAR_PHRASES}")
+    return json.dumps(phrases, ensure_ascii=False) if phrases else None
+
+
+def grammar_key(grammar: Optional[str]) -> str:
+    """Short hash identifying a grammar from ``parse_grammar``; empty for none"""
+    return hashlib.sha1(grammar.encode()).hexdigest()[:16] if grammar else ""
+
+
+class RecognizerPool:
+    """Per-language pool of reusable KaldiRecognizer instances
+
+    Creating a recognizer allocates decoder state in native code, which adds
+    up under high request rates. Recognizers are reset and kept after use, up
+    to ``max_size`` idle instances per language and sample rate; anything
+    beyond that is released.
+
+    Recognizers restricted to a grammar are pooled separately per grammar,
+    since compiling the grammar is most of their setup cost. Only the
+    ``max_grammars`` most recently used grammars keep idle recognizers.
+    """
+
+    def __init__(self, models: Mapping[str, "vosk.Model"], max_size: int, max_grammars: int = 32):
+        self.models = models
+        self.max_size = max(0, max_size)
+        self.max_grammars = max(0, max_grammars)
+        # In least recently used order, for evicting grammars
+        self._idle: "OrderedDict[PoolKey, List[vosk.KaldiRecognizer]]" = OrderedDict()
+        # Bumped by clear() so recognizers of an unloaded model aren't pooled again
+        self._generations: Dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.discarded = 0
+
+    def acquire(self, language: str, sample_rate: int, grammar: Optional[str] = None) -> "vosk.KaldiRecognizer":
+        """Take an idle recognizer or create a new one, restricted to ``grammar`` if given"""
+        key = (language, sample_rate, grammar_key(grammar))
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                self._idle.move_to_end(key)
+                self.hits += 1
+                return idle.pop()
+            self.misses += 1
+
+        if grammar:
+            rec = vosk.KaldiRecognizer(self.models[language], sample_rate, grammar)
+        else:
+            rec = vosk.KaldiRecognizer(self.models[language], sample_rate)
+        rec.SetWords(True)
+        return rec
+
+    def release(self, language: str, sample_rate: int, rec: "vosk.KaldiRecognizer",
+                generation: Optional[int] = None, grammar: Optional[str] = None) -> None:
+        """Reset ``rec`` and keep it for the next caller if there is room
+
+        ``generation`` is the value of ``generation(language)`` when ``rec``
+        was acquired; a recognizer from before the last ``clear`` is dropped.
+        """
+        rec.Reset()
+        key = (language, sample_rate, grammar_key(grammar))
+        with self._lock:
+            if generation is not None and generation != self._generations[language]:
+                self.discarded += 1
+                return
+            idle = self._idle.setdefault(key, [])
+            self._idle.move_to_end(key)
+            if len(idle) < self.max_size:
+                idle.append(rec)
+                if key[2]:
+                    self._evict_grammars()
+                return
+            self.discarded += 1
+
+    def _evict_grammars(self) -> None:
+        """Drop the idle recognizers of the least recently used grammars beyond ``max_grammars``"""
+        grammar_keys = [key for key in self._idle if key[2]]
+        for key in grammar_keys[:max(0, len(grammar_keys) - self.max_grammars)]:
+            self.discarded += len(self._idle.pop(key))
+
+    @contextmanager
+    def checkout(self, language: str, sample_rate: int,
+                 grammar: Optional[str] = None) -> Iterator["vosk.KaldiRecognizer"]:
+        """Borrow a recognizer for the duration of a ``with`` block
+
+        A recognizer whose user raised is dropped instead of returned, since
+        its decoder may be left in an unknown state.
+        """
+        generation = self.generation(language)
+        rec = self.acquire(language, sample_rate, grammar)
+        try:
+            yield rec
+        except BaseException:
+            self.discard(rec)
+            raise
+        self.release(language, sample_rate, rec, generation, grammar)
+
+    def discard(self, rec: "vosk.KaldiRecognizer") -> None:
+        """Drop a checked-out recognizer instead of returning it"""
+        with self._lock:
+            self.discarded += 1
+
+    def generation(self, language: str) -> int:
+        with self._lock:
+            return self._generations[language]
+
+    def clear(self, language: Optional[str] = None) -> None:
+        """Drop idle recognizers, for one language or all of them
+
+        Recognizers checked out at the time are dropped when they are returned.
+        """
+        with self._lock:
+            for name in set(self._generations) | {key[0] for key in self._idle}:
+                if language is None or name == language:
+                    self._generations[name] += 1
+            for key in list(self._idle):
+                if language is None or key[0] == language:
+                    del self._idle[key]
+
+    def counters(self) -> Dict[str, int]:
+        """Lookups and discarded recognizers so far"""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "discarded": self.discarded}
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "max_size": self.max_size,
+                "max_grammars": self.max_grammars,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "discarded": self.discarded,
+                "grammars": sum(1 for key in self._idle if key[2]),
+                "idle": {
+                    f"{language}@{rate}" + (f"#{grammar}" if grammar else ""): len(idle)
+                    for (language, rate, grammar), idle in self._idle.items()
+                },
+            }
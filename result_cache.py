@@ -0,0 +1,198 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class ResultCache:
+    """Content-addressed LRU cache of serialized transcription results
+
+    Keys are a SHA-256 of the audio bytes plus everything else that affects
+    the result. Entries live in memory up to ``max_entries`` / ``max_bytes``;
+    when ``disk_dir`` is set they are also written there, so they survive
+    restarts and memory evictions.
+
+    The files on disk are kept under ``disk_max_bytes`` (0 = no limit): once
+    they exceed it, the least recently used files, by modification time,
+    which a hit refreshes, are deleted down to 90% of the limit. Processes
+    sharing ``disk_dir`` each prune it the same way.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, disk_dir: Optional[str] = None,
+                 disk_max_bytes: int = 0):
+        self.max_entries = max(0, max_entries)
+        self.max_bytes = max(0, max_bytes)
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = max(0, disk_max_bytes)
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        # Held by the one thread pruning the disk store
+        self._prune_lock = threading.Lock()
+        self._disk_size = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.disk_evictions = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            if self.disk_max_bytes:
+                self._disk_size = sum(size for _, _, size in self._disk_files())
+
+    @staticmethod
+    def make_key(audio: bytes, language: str, **options) -> str:
+        digest = hashlib.sha256(audio)
+        digest.update(b"\0")
+        digest.update(json.dumps({"language": language, **options}, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Return the cached JSON for ``key``, or None"""
+        with self._lock:
+            payload = self._entries.get(key)
+            if payload is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return payload
+
+        if self.disk_dir:
+            path = self._disk_path(key)
+            try:
+                with open(path, "rb") as f:
+                    payload = f.read()
+                # Marks the file as recently used for pruning
+                os.utime(path)
+            except FileNotFoundError:
+                payload = None
+            except OSError as e:
+                logger.warning(f"Could not read cached result {key}: {e}")
+                payload = None
+            if payload is not None:
+                self._remember(key, payload)
+                with self._lock:
+                    self.hits += 1
+                    self.disk_hits += 1
+                return payload
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, payload: bytes) -> None:
+        """Store the JSON-serialized result for ``key``"""
+        self._remember(key, payload)
+        if self.disk_dir:
+            path = self._disk_path(key)
+            temp_path = None
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                # Write then rename so readers never see a partial file
+                with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), delete=False) as f:
+                    temp_path = f.name
+                    f.write(payload)
+                # A result stored again (e.g. with no_cache) replaces the old file
+                try:
+                    replaced = os.path.getsize(path)
+                except FileNotFoundError:
+                    replaced = 0
+                os.replace(temp_path, path)
+            except OSError as e:
+                logger.warning(f"Could not write cached result {key}: {e}")
+                # Temporary files aren't counted or pruned, so don't leave one behind
+                if temp_path is not None:
+                    try:
+                        os.unlink(temp_path)
+                    except OSError:
+                        pass
+                return
+            if self.disk_max_bytes:
+                with self._lock:
+                    self._disk_size += len(payload) - replaced
+                    over = self._disk_size > self.disk_max_bytes
+                if over:
+                    self._prune_disk()
+
+    def _disk_files(self) -> List[Tuple[float, str, int]]:
+        """``(mtime, path, size)`` of every cached result on disk"""
+        files = []
+        for root, _, names in os.walk(self.disk_dir):
+            for name in names:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    # Pruned by another process meanwhile
+                    continue
+                files.append((stat.st_mtime, path, stat.st_size))
+        return files
+
+    def _prune_disk(self) -> None:
+        """Delete the least recently used files until the disk store is under 90% of its limit"""
+        if not self._prune_lock.acquire(blocking=False):
+            return
+        try:
+            files = sorted(self._disk_files())
+            total = sum(size for _, _, size in files)
+            target = self.disk_max_bytes * 0.9
+            evicted = 0
+            for _, path, size in files:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logger.warning(f"Could not remove cached result {path}: {e}")
+                    continue
+                total -= size
+                evicted += 1
+            with self._lock:
+                self._disk_size = total
+                self.disk_evictions += evicted
+            if evicted:
+                logger.info(f"Pruned {evicted} cached results from {self.disk_dir}")
+        finally:
+            self._prune_lock.release()
+
+    def _remember(self, key: str, payload: bytes) -> None:
+        if len(payload) > self.max_bytes or self.max_entries == 0:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous)
+            self._entries[key] = payload
+            self._size += len(payload)
+            while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "disk": bool(self.disk_dir),
+                "disk_bytes": self._disk_size if self.disk_max_bytes else None,
+                "disk_max_bytes": self.disk_max_bytes,
+                "disk_evictions": self.disk_evictions,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
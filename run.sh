@@ -16,6 +16,7 @@ SERVICE_NAME="vosk-stt"
 IMAGE_NAME="truongginjs/stt"
 PORT=8000
 HEALTH_URL="http://localhost:${PORT}/health"
+READY_URL="http://localhost:${PORT}/ready"
 
 print_header() {
     echo -e "${BLUE}🎤 VOSK Speech-to-Text Service${NC}"
@@ -53,7 +54,7 @@ wait_for_service() {
     print_status "Waiting for service to be ready..."
     
     while [ $attempt -le $max_attempts ]; do
-        if curl -s -f "$HEALTH_URL" > /dev/null 2>&1; then
+        if curl -s -f "$READY_URL" > /dev/null 2>&1; then
             print_status "Service is ready! 🎉"
             return 0
         fi
@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""
+Pre-fork server for VOSK STT API
+
+The master process loads the models once and then forks uvicorn workers
+that accept connections on one shared socket. Forked workers share the
+model memory copy-on-write, so N workers cost little more than one. The
+master replaces workers that exit, and recycles them gracefully after a
+number of requests, after a maximum age, or on SIGHUP.
+"""
+
+import gc
+import logging
+import os
+import random
+import signal
+import socket
+import sys
+import threading
+import time
+
+APP_HOST = os.getenv("APP_HOST", "0.0.0.0")
+APP_PORT = int(os.getenv("APP_PORT", 8000))
+LOG_LEVEL = os.getenv("LOG_LEVEL", "info")
+
+# uvicorn worker processes sharing the listening socket
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", os.cpu_count() or 1))
+# Recycle a worker after about this many requests, or this many seconds (0 = never)
+SERVER_MAX_REQUESTS = int(os.getenv("SERVER_MAX_REQUESTS", 0))
+SERVER_MAX_WORKER_AGE = float(os.getenv("SERVER_MAX_WORKER_AGE", 0))
+# Seconds a stopping worker gets to finish its requests before it is killed
+SERVER_GRACEFUL_TIMEOUT = float(os.getenv("SERVER_GRACEFUL_TIMEOUT", 30))
+
+# Every server worker runs its own transcription pool; split the cores between them
+os.environ.setdefault("TRANSCRIBE_WORKERS", str(max(1, (os.cpu_count() or 1) // max(1, SERVER_WORKERS))))
+
+import uvicorn
+
+import app as service
+from jobs import JobStore
+
+logger = logging.getLogger("server")
+
+# Workers that exit this soon after starting are restarted with a delay
+MIN_WORKER_UPTIME = 5.0
+# Longest a recycled worker keeps serving while its replacement starts up
+WORKER_STARTUP_TIMEOUT = 120.0
+
+
+class PreforkServer:
+    """Forks and supervises uvicorn workers serving ``service.app`` on one socket"""
+
+    def __init__(self, host: str, port: int, workers: int, max_requests: int = 0,
+                 max_age: float = 0.0, graceful_timeout: float = 30.0):
+        self.host = host
+        self.port = port
+        self.worker_count = max(1, workers)
+        self.max_requests = max(0, max_requests)
+        self.max_age = max(0.0, max_age)
+        self.graceful_timeout = graceful_timeout
+        self.sock = None
+        # Running workers: pid -> time they should be recycled (inf for never)
+        self.workers = {}
+        self.started = {}
+        # Workers told to stop: pid -> time they get killed
+        self.retiring = {}
+        # Read ends of the pipes on which workers report that they accept connections
+        self.ready_pipes = {}
+        self.ready = set()
+        # Workers being recycled: pid -> (replacement pid, time they are stopped regardless)
+        self.replacing = {}
+        self.reload_pending = []
+        self.stopping = False
+
+    def preload(self) -> None:
+        """Load the models in the master so every worker inherits them"""
+        service.load_models()
+        if not service.models.pinned:
+            service.models.load_many(service.models, service.MODEL_LOAD_THREADS)
+        logger.info(f"Master loaded models: {service.models.loaded}")
+
+        # Jobs left running by a previous run are requeued here, once, not by each worker
+        store = JobStore(service.JOBS_DB_PATH)
+        requeued = store.requeue_interrupted()
+        store.close()
+        if requeued:
+            logger.info(f"Requeued {requeued} interrupted jobs")
+        service.recover_interrupted_jobs = False
+        # A worker only accepts connections once it can serve them
+        service.wait_for_startup = True
+
+        # Keep the garbage collector from touching, and so copying, the inherited objects
+        gc.collect()
+        gc.freeze()
+
+    def bind(self) -> None:
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((self.host, self.port))
+        self.sock.listen(2048)
+        self.sock.set_inheritable(True)
+        self.port = self.sock.getsockname()[1]
+
+    def spawn(self) -> int:
+        # Jitter keeps workers started together from all recycling at once
+        max_requests = self.max_requests + random.randint(0, max(1, self.max_requests // 10)) if self.max_requests else None
+        retire_at = time.monotonic() + self.max_age * random.uniform(1.0, 1.1) if self.max_age else float("inf")
+        ready_read, ready_write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                os.close(ready_read)
+                self._run_worker(max_requests, ready_write)
+                code = 0
+            except BaseException:
+                logger.exception("Worker failed")
+            finally:
+                os._exit(code)
+        os.close(ready_write)
+        os.set_blocking(ready_read, False)
+        self.ready_pipes[pid] = ready_read
+        self.workers[pid] = retire_at
+        self.started[pid] = time.monotonic()
+        logger.info(f"Started worker {pid}")
+        return pid
+
+    def _run_worker(self, max_requests, ready_fd: int) -> None:
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGCHLD):
+            signal.signal(signum, signal.SIG_DFL)
+        config = uvicorn.Config(
+            service.app,
+            log_level=LOG_LEVEL,
+            limit_max_requests=max_requests,
+            timeout_graceful_shutdown=self.graceful_timeout,
+        )
+        server = uvicorn.Server(config)
+
+        def report_ready():
+            # uvicorn sets started once startup is done and it accepts connections
+            while not server.started and not server.should_exit:
+                time.sleep(0.05)
+            if server.started:
+                os.write(ready_fd, b"1")
+            os.close(ready_fd)
+
+        threading.Thread(target=report_ready, name="ready-reporter", daemon=True).start()
+        server.run(sockets=[self.sock])
+
+    def is_ready(self, pid: int) -> bool:
+        """Whether a worker reported that it accepts connections"""
+        fd = self.ready_pipes.get(pid)
+        if fd is not None:
+            try:
+                if os.read(fd, 1):
+                    self.ready.add(pid)
+            except BlockingIOError:
+                return False
+            # Reported, or exited without reporting
+            os.close(fd)
+            del self.ready_pipes[pid]
+        return pid in self.ready
+
+    def retire(self, pid: int) -> None:
+        """Replace a worker: start its successor, and once that is ready let it finish its requests and exit"""
+        if pid not in self.workers:
+            return
+        del self.workers[pid]
+        self.replacing[pid] = (self.spawn(), time.monotonic() + WORKER_STARTUP_TIMEOUT)
+        logger.info(f"Recycling worker {pid}")
+
+    def stop_worker(self, pid: int) -> None:
+        self.retiring[pid] = time.monotonic() + self.graceful_timeout + 5
+        os.kill(pid, signal.SIGTERM)
+
+    def reap(self) -> None:
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            code = os.waitstatus_to_exitcode(status)
+            uptime = time.monotonic() - self.started.pop(pid, time.monotonic())
+            self.ready.discard(pid)
+            fd = self.ready_pipes.pop(pid, None)
+            if fd is not None:
+                os.close(fd)
+            if pid in self.replacing:
+                # A worker being recycled died before its replacement was ready
+                self.replacing.pop(pid)
+                continue
+            if self.retiring.pop(pid, None) is not None:
+                continue
+            if self.workers.pop(pid, None) is None:
+                continue
+            if code != 0:
+                logger.error(f"Worker {pid} exited with code {code}")
+            if not self.stopping:
+                if code != 0 and uptime < MIN_WORKER_UPTIME:
+                    # Don't spin on a worker that crashes right away
+                    time.sleep(1)
+                replacement = self.spawn()
+                for old, (waiting_for, deadline) in list(self.replacing.items()):
+                    if waiting_for == pid:
+                        self.replacing[old] = (replacement, deadline)
+
+    def tick(self) -> None:
+        now = time.monotonic()
+        for pid, kill_at in list(self.retiring.items()):
+            if now >= kill_at:
+                logger.warning(f"Worker {pid} did not stop in time, killing it")
+                os.kill(pid, signal.SIGKILL)
+                self.retiring[pid] = float("inf")
+        # The old worker keeps accepting until its replacement does
+        for pid, (replacement, deadline) in list(self.replacing.items()):
+            ready = self.is_ready(replacement)
+            if ready or now >= deadline:
+                if not ready:
+                    logger.warning(f"Replacement of worker {pid} did not start in time, stopping it anyway")
+                del self.replacing[pid]
+                self.stop_worker(pid)
+        # One worker at a time, so capacity never drops by more than one
+        if self.retiring or self.replacing:
+            return
+        while self.reload_pending:
+            pid = self.reload_pending.pop(0)
+            if pid in self.workers:
+                self.retire(pid)
+                return
+        for pid, retire_at in list(self.workers.items()):
+            if now >= retire_at:
+                self.retire(pid)
+                return
+
+    def _handle_stop(self, signum, frame) -> None:
+        self.stopping = True
+
+    def _handle_reload(self, signum, frame) -> None:
+        self.reload_pending = list(self.workers)
+
+    def run(self) -> None:
+        self.preload()
+        self.bind()
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+        signal.signal(signal.SIGHUP, self._handle_reload)
+        logger.info(f"Listening on http://{self.host}:{self.port} with {self.worker_count} workers")
+
+        for _ in range(self.worker_count):
+            self.spawn()
+        while not self.stopping:
+            self.reap()
+            self.tick()
+            time.sleep(0.2)
+        self.shutdown()
+
+    def shutdown(self) -> None:
+        logger.info("Stopping workers")
+        pids = set(self.workers) | set(self.retiring) | set(self.replacing)
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + self.graceful_timeout + 5
+        while pids and time.monotonic() < deadline:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid:
+                pids.discard(pid)
+            else:
+                time.sleep(0.1)
+        for pid in pids:
+            logger.warning(f"Worker {pid} did not stop in time, killing it")
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        self.sock.close()
+
+
+def main():
+    server = PreforkServer(
+        APP_HOST,
+        APP_PORT,
+        SERVER_WORKERS,
+        max_requests=SERVER_MAX_REQUESTS,
+        max_age=SERVER_MAX_WORKER_AGE,
+        graceful_timeout=SERVER_GRACEFUL_TIMEOUT,
+    )
+    server.run()
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,561 @@
+import asyncio
+import json
+import logging
+import os
+import secrets
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Executor
+from typing import Callable, Dict, List, Optional, Tuple
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+from audio import AudioDecodeError, STREAM_CONTAINERS, PcmStreamConverter, ffmpeg_stream_command
+from encoding import FrameEncoder, dumps_text, loads
+from vad import VoiceActivityDetector
+
+logger = logging.getLogger(__name__)
+
+# What to do when a client sends audio faster than it can be decoded
+OVERFLOW_BLOCK = "block"  # stop reading from the socket until the queue drains
+OVERFLOW_DROP = "drop"    # discard the oldest queued audio
+OVERFLOW_POLICIES = (OVERFLOW_BLOCK, OVERFLOW_DROP)
+
+# Queued after the last audio frame when the client sends {"eof": 1}
+END_OF_STREAM = None
+
+
+# PCM read from a compressed-audio decoder at a time (0.25 s)
+DECODED_CHUNK_SIZE = 8000
+
+# ffmpeg error output kept for the error message
+STDERR_LIMIT = 4096
+
+
+class SessionTimeout(Exception):
+    """Raised when a WebSocket session goes idle or runs past its time limit"""
+
+
+class CompressedAudioDecoder:
+    """Decodes a live compressed stream (e.g. Opus in WebM) to PCM with an ffmpeg process
+
+    One ffmpeg process per connection. Its pipes are the only buffers, so
+    memory per connection stays bounded: ``write`` waits while ffmpeg is
+    behind, and ffmpeg waits while its PCM isn't read. ``cpu_seconds`` is
+    the decoding CPU time, where the platform reports it.
+    """
+
+    def __init__(self, container: str):
+        if container not in STREAM_CONTAINERS:
+            raise ValueError(f"Unknown codec {container!r}, expected one of {list(STREAM_CONTAINERS)}")
+        self.container = container
+        self.cpu_seconds = 0.0
+        self._proc: Optional[asyncio.subprocess.Process] = None
+        self._stderr = b""
+        self._stderr_task: Optional[asyncio.Task] = None
+        self._last_sample = 0.0
+
+    async def start(self) -> None:
+        try:
+            self._proc = await asyncio.create_subprocess_exec(
+                *ffmpeg_stream_command(self.container),
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+        except FileNotFoundError as e:
+            raise AudioDecodeError("ffmpeg is not installed") from e
+        self._stderr_task = asyncio.create_task(self._read_stderr())
+
+    async def _read_stderr(self) -> None:
+        while True:
+            data = await self._proc.stderr.read(STDERR_LIMIT)
+            if not data:
+                return
+            self._stderr = (self._stderr + data)[-STDERR_LIMIT:]
+
+    async def write(self, data: bytes) -> None:
+        try:
+            self._proc.stdin.write(data)
+            await self._proc.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            # ffmpeg exited; read() reports why
+            pass
+
+    async def close_input(self) -> None:
+        """Signal the end of the stream; ``read`` returns the remaining audio"""
+        if not self._proc.stdin.is_closing():
+            self._proc.stdin.close()
+
+    async def read(self) -> bytes:
+        """Return decoded PCM, or b"" once the stream has ended"""
+        data = await self._proc.stdout.read(DECODED_CHUNK_SIZE)
+        self._sample_cpu(force=not data)
+        if data:
+            return data
+        returncode = await self._proc.wait()
+        await self._stderr_task
+        if returncode != 0:
+            message = self._stderr.decode(errors="replace").strip()
+            raise AudioDecodeError(message or f"ffmpeg exited with code {returncode}")
+        return b""
+
+    def _sample_cpu(self, force: bool = False) -> None:
+        # Read while the process exists; once reaped its usage is gone
+        now = time.monotonic()
+        if not force and now - self._last_sample < 1.0:
+            return
+        self._last_sample = now
+        try:
+            with open(f"/proc/{self._proc.pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            self.cpu_seconds = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+        except (OSError, IndexError, ValueError):
+            pass
+
+    async def close(self) -> None:
+        if self._proc is None:
+            return
+        self._sample_cpu(force=True)
+        if self._proc.returncode is None:
+            self._proc.kill()
+            await self._proc.wait()
+        if self._stderr_task is not None:
+            await asyncio.gather(self._stderr_task, return_exceptions=True)
+
+
+class StreamingSession:
+    """Decodes one WebSocket audio stream off the event loop
+
+    Audio frames go into a bounded per-connection queue. A decoder task feeds
+    them to the recognizer in a thread pool, coalescing whatever has queued up
+    into a single AcceptWaveform call. Recognizer JSON is forwarded as-is.
+    Partial results are only sent when their text changed and at most once
+    per ``partial_interval`` seconds. A ``{"eof": 1}`` text message makes the
+    session decode what is queued, send the final result and close.
+
+    With a ``vad``, long silences are skipped before decoding and word
+    timestamps are mapped back to the audio as the client sent it. With an
+    ``audio_decoder``, frames are compressed audio that is decoded to PCM
+    before it is queued.
+
+    Raw PCM is 16 kHz mono s16le unless the client first sends a config
+    message such as ``{"config": {"sample_rate": 48000, "channels": 2,
+    "format": "f32le"}}``; the audio is then downmixed and resampled in the
+    decoder thread. Compressed streams carry their own format, so a config
+    message only gets validated for them.
+
+    Results go out as the recognizer's JSON unless an ``encoder`` selects
+    fields or a binary encoding.
+
+    A session that receives nothing for ``idle_timeout`` seconds, or lasts
+    longer than ``session_timeout`` seconds, ends with ``SessionTimeout``
+    (0 disables either limit).
+
+    A session with a ``session_id`` can outlive its connection: it starts by
+    sending ``{"session_id": ..., "offset": ...}`` and acknowledges queued
+    audio with ``{"ack": offset}`` frames, offsets counting the bytes the
+    client sent. After a disconnect, ``run`` returns with the queued audio
+    and any undelivered results kept, and ``resume`` attaches it to a new
+    connection.
+    """
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        rec,
+        executor: Executor,
+        queue_size: int,
+        overflow_policy: str = OVERFLOW_BLOCK,
+        partial_interval: float = 0.0,
+        vad: Optional[VoiceActivityDetector] = None,
+        audio_decoder: Optional[CompressedAudioDecoder] = None,
+        idle_timeout: float = 0.0,
+        session_timeout: float = 0.0,
+        encoder: Optional[FrameEncoder] = None,
+        session_id: Optional[str] = None,
+    ):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy {overflow_policy!r}, expected one of {OVERFLOW_POLICIES}")
+        self.websocket = websocket
+        self.rec = rec
+        self.executor = executor
+        self.overflow_policy = overflow_policy
+        self.partial_interval = partial_interval
+        self.vad = vad
+        self.audio_decoder = audio_decoder
+        self.idle_timeout = idle_timeout
+        self.session_timeout = session_timeout
+        self.encoder = encoder
+        self.session_id = session_id
+        self.created = time.monotonic()
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, queue_size))
+        self.converter: Optional[PcmStreamConverter] = None
+        # Bytes as sent by the client, and as 16 kHz PCM after any decompression
+        self.bytes_received = 0
+        self.pcm_bytes = 0
+        self.frames_dropped = 0
+        self.decode_seconds = 0.0
+        # Client bytes queued for decoding; a resumed client continues from here
+        self.offset = 0
+        self.finished = False
+        self.interrupted = False
+        self._skip = 0
+        self._acked = 0
+        self._final_decoded = False
+        # Results not yet delivered, kept across a reconnect
+        self._outbox: deque = deque()
+        self._receive_task: Optional[asyncio.Task] = None
+        self._last_partial: Optional[str] = None
+        self._last_partial_time = 0.0
+
+    def resume(self, websocket: WebSocket, offset: Optional[int] = None,
+               encoder: Optional[FrameEncoder] = None) -> None:
+        """Attach a reconnected client that will send audio from byte ``offset`` on
+
+        Bytes before the session's own offset are skipped as they arrive
+        again; a later offset would leave a gap, so it is refused.
+        """
+        if offset is not None and not 0 <= offset <= self.offset:
+            raise ValueError(f"Cannot resume from byte {offset}, the session has received {self.offset}")
+        self._skip = self.offset - offset if offset is not None else 0
+        self.websocket = websocket
+        self.encoder = encoder
+        self.interrupted = False
+        self._last_partial = None
+
+    def interrupt(self) -> None:
+        """Detach the session from its connection, e.g. because the client resumed it elsewhere"""
+        self.interrupted = True
+        if self._receive_task is not None:
+            self._receive_task.cancel()
+
+    async def run(self) -> None:
+        """Process the stream until the client disconnects"""
+        if self.audio_decoder is not None:
+            await self.audio_decoder.start()
+        self._receive_task = asyncio.create_task(self._receive())
+        tasks = {self._receive_task, asyncio.create_task(self._decode())}
+        pump = asyncio.create_task(self._pump_decoded()) if self.audio_decoder is not None else None
+        # The limit counts from the start of the session, across reconnects
+        deadline = self.created + self.session_timeout if self.session_timeout else None
+        try:
+            waiting = tasks | ({pump} if pump else set())
+            while True:
+                timeout = max(0.0, deadline - time.monotonic()) if deadline is not None else None
+                done, waiting = await asyncio.wait(waiting, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    raise SessionTimeout(f"Session exceeded the limit of {self.session_timeout:g}s")
+                # The decoder finishing first just means the client sent {"eof": 1}
+                if done == {pump} and pump.exception() is None:
+                    continue
+                break
+        finally:
+            every = tasks | ({pump} if pump else set())
+            for task in every:
+                task.cancel()
+            await asyncio.gather(*every, return_exceptions=True)
+            if self.audio_decoder is not None:
+                await self.audio_decoder.close()
+
+        if self.frames_dropped:
+            logger.warning(f"WebSocket session dropped {self.frames_dropped} audio frames")
+        for task in done:
+            if task.cancelled():
+                continue
+            exc = task.exception()
+            if exc is not None and not isinstance(exc, WebSocketDisconnect):
+                raise exc
+
+    async def _receive(self) -> None:
+        end_of_stream = False
+        while True:
+            # Once the client has sent {"eof": 1}, it is waiting for the final result
+            if self.idle_timeout and not end_of_stream:
+                try:
+                    message = await asyncio.wait_for(self.websocket.receive(), self.idle_timeout)
+                except asyncio.TimeoutError:
+                    raise SessionTimeout(f"No audio received for {self.idle_timeout:g}s") from None
+            else:
+                message = await self.websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            data = message.get("bytes")
+            if data is None:
+                if self._is_eof(message.get("text")):
+                    end_of_stream = True
+                    if self.audio_decoder is not None:
+                        # The decoder queues the end of stream after its last audio
+                        await self.audio_decoder.close_input()
+                    else:
+                        await self.queue.put(END_OF_STREAM)
+                    # Keep reading so a client disconnect is still noticed
+                    continue
+                config = self._parse_config(message.get("text"))
+                if config is None:
+                    raise ValueError("Expected binary audio frames")
+                if self.bytes_received:
+                    raise ValueError("The config message must come before any audio")
+                self.configure(**config)
+                continue
+            self.bytes_received += len(data)
+            if end_of_stream:
+                continue
+            if self._skip:
+                # Audio the session already has, sent again by a resumed client
+                skipped = min(self._skip, len(data))
+                self._skip -= skipped
+                data = data[skipped:]
+                if not data:
+                    continue
+            if self.audio_decoder is not None:
+                await self.audio_decoder.write(data)
+            else:
+                await self._enqueue(data)
+            self.offset += len(data)
+
+    async def _pump_decoded(self) -> None:
+        while True:
+            data = await self.audio_decoder.read()
+            if not data:
+                await self.queue.put(END_OF_STREAM)
+                return
+            await self._enqueue(data)
+
+    async def _enqueue(self, data: bytes) -> None:
+        if self.overflow_policy == OVERFLOW_BLOCK:
+            # Not reading from the socket lets TCP flow control slow the client down
+            await self.queue.put(data)
+        else:
+            if self.queue.full():
+                self.queue.get_nowait()
+                self.frames_dropped += 1
+            self.queue.put_nowait(data)
+
+    async def _decode(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self.session_id is not None:
+            await self._send(dumps_text({"session_id": self.session_id, "offset": self.offset}))
+        await self._flush()
+        if self._final_decoded:
+            await self._finish()
+            return
+        while True:
+            frames = [await self.queue.get()]
+            while not self.queue.empty() and frames[-1] is not END_OF_STREAM:
+                frames.append(self.queue.get_nowait())
+            end_of_stream = frames[-1] is END_OF_STREAM
+            if end_of_stream:
+                frames.pop()
+            data = b"".join(frames)
+
+            future = loop.run_in_executor(self.executor, self._accept, data, end_of_stream)
+            try:
+                results, partial = await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # The recognizer must not be handed back while a thread still uses it
+                await asyncio.wait({future})
+                if not future.cancelled() and future.exception() is None:
+                    # Its results are for whoever resumes the session
+                    self._outbox.extend(future.result()[0])
+                    self._final_decoded = end_of_stream
+                raise
+
+            self._outbox.extend(results)
+            self._final_decoded = end_of_stream
+            if results:
+                self._last_partial = None
+            await self._flush()
+            if partial is not None and self._should_send_partial(partial):
+                await self._send(partial)
+            if self.session_id is not None and self.offset != self._acked:
+                self._acked = self.offset
+                await self._send(dumps_text({"ack": self.offset}))
+
+            if end_of_stream:
+                await self._finish()
+                return
+
+    async def _flush(self) -> None:
+        # A result leaves the outbox only once it was sent
+        while self._outbox:
+            await self._send(self._outbox[0])
+            self._outbox.popleft()
+
+    async def _finish(self) -> None:
+        self.finished = True
+        await self.websocket.close()
+
+    def _accept(self, data: bytes, end_of_stream: bool = False) -> Tuple[List[str], Optional[str]]:
+        """Feed audio to the recognizer; runs in the executor
+
+        Returns the finalized results to send and the current partial result.
+        """
+        started = time.perf_counter()
+        try:
+            if self.converter is not None:
+                data = self.converter.process(data)
+            self.pcm_bytes += len(data)
+            if self.vad is not None:
+                data = self.vad.process(data)
+                if end_of_stream:
+                    data += self.vad.flush()
+            results = []
+            if data and self.rec.AcceptWaveform(data):
+                results.append(self.rec.Result())
+            if end_of_stream:
+                results.append(self.rec.FinalResult())
+            if self.vad is not None:
+                results = [dumps_text(self.vad.time_map.remap_result(loads(result))) for result in results]
+            if end_of_stream:
+                return results, None
+            return results, None if results else self.rec.PartialResult()
+        finally:
+            self.decode_seconds += time.perf_counter() - started
+
+    async def _send(self, payload: str) -> None:
+        frame = self.encoder.encode(payload) if self.encoder is not None else payload
+        try:
+            if isinstance(frame, bytes):
+                await self.websocket.send_bytes(frame)
+            else:
+                await self.websocket.send_text(frame)
+        except WebSocketDisconnect:
+            raise
+        except Exception as e:
+            # The server names a lost connection differently; make it a disconnect either way
+            raise WebSocketDisconnect(1006) from e
+
+    def configure(self, sample_rate: int = 16000, channels: int = 1, format: str = "s16le") -> None:
+        """Declare the format of the raw PCM the client is about to send"""
+        converter = PcmStreamConverter(sample_rate, channels, format)
+        if self.audio_decoder is None and not converter.passthrough:
+            self.converter = converter
+        logger.debug(f"WebSocket audio format: {sample_rate} Hz, {channels} channels, {format}")
+
+    @staticmethod
+    def _parse_config(text: Optional[str]) -> Optional[dict]:
+        try:
+            config = json.loads(text)["config"]
+        except (TypeError, ValueError, KeyError):
+            return None
+        if not isinstance(config, dict):
+            raise ValueError("The config message must be a JSON object")
+        # Other recognizer options some VOSK clients send are ignored
+        options = {key: config[key] for key in ("sample_rate", "channels", "format") if key in config}
+        for key in ("sample_rate", "channels"):
+            if key in options and (isinstance(options[key], bool) or not isinstance(options[key], (int, float))):
+                raise ValueError(f"Config {key} must be a number")
+            if key in options:
+                options[key] = int(options[key])
+        return options
+
+    @staticmethod
+    def _is_eof(text: Optional[str]) -> bool:
+        try:
+            return bool(json.loads(text).get("eof"))
+        except (TypeError, ValueError, AttributeError):
+            return False
+
+    def _should_send_partial(self, payload: str) -> bool:
+        # Comparing the raw JSON is enough to tell whether the text changed
+        if payload == self._last_partial:
+            return False
+        now = time.monotonic()
+        if now - self._last_partial_time < self.partial_interval:
+            return False
+        self._last_partial = payload
+        self._last_partial_time = now
+        return True
+
+
+class SessionStore:
+    """Keeps disconnected resumable sessions for ``ttl`` seconds
+
+    A parked session holds its recognizer, so at most ``max_sessions`` are
+    kept and the oldest is ended to make room. Each session comes with an
+    ``end`` callback that releases what it holds; it is called with
+    ``failed=False`` when the session expires unclaimed.
+    """
+
+    def __init__(self, ttl: float, max_sessions: int):
+        self.ttl = ttl
+        self.max_sessions = max(1, max_sessions)
+        self.expired = 0
+        self._parked: "OrderedDict[str, Tuple[StreamingSession, Callable[[bool], None], asyncio.TimerHandle]]" = OrderedDict()
+        self._attached: Dict[str, StreamingSession] = {}
+        self._waiters: Dict[str, asyncio.Future] = {}
+
+    @staticmethod
+    def new_id() -> str:
+        return secrets.token_urlsafe(16)
+
+    def attach(self, session_id: str, session: StreamingSession) -> None:
+        self._attached[session_id] = session
+
+    def park(self, session_id: str, session: StreamingSession, end: Callable[[bool], None]) -> None:
+        """Keep a session whose client disconnected until it is resumed or expires"""
+        self._attached.pop(session_id, None)
+        waiter = self._waiters.get(session_id)
+        if waiter is not None and not waiter.done():
+            # Detached for a client that is already resuming it
+            waiter.set_result((session, end))
+            return
+        while len(self._parked) >= self.max_sessions:
+            self._expire(next(iter(self._parked)))
+        timer = asyncio.get_running_loop().call_later(self.ttl, self._expire, session_id)
+        self._parked[session_id] = (session, end, timer)
+
+    def discard(self, session_id: str) -> None:
+        """Forget a session that ended"""
+        self._attached.pop(session_id, None)
+        waiter = self._waiters.get(session_id)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    async def take(self, session_id: str, timeout: float = 5.0) -> Optional[Tuple[StreamingSession, Callable[[bool], None]]]:
+        """Claim a session to resume it, or None if it ended or expired
+
+        A session still attached to a connection, e.g. one whose client
+        reconnected before the server noticed the drop, is detached from it first.
+        """
+        entry = self._parked.pop(session_id, None)
+        if entry is not None:
+            session, end, timer = entry
+            timer.cancel()
+            return session, end
+        session = self._attached.get(session_id)
+        if session is None or session_id in self._waiters:
+            return None
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters[session_id] = waiter
+        session.interrupt()
+        try:
+            return await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            del self._waiters[session_id]
+
+    def _expire(self, session_id: str) -> None:
+        entry = self._parked.pop(session_id, None)
+        if entry is None:
+            return
+        session, end, timer = entry
+        timer.cancel()
+        self.expired += 1
+        logger.info(f"Resumable session {session_id} expired")
+        end(False)
+
+    def close(self) -> None:
+        for session_id in list(self._parked):
+            self._expire(session_id)
+
+    def stats(self) -> dict:
+        return {
+            "parked": len(self._parked),
+            "attached": len(self._attached),
+            "max_sessions": self.max_sessions,
+            "ttl": self.ttl,
+            "expired": self.expired,
+        }
@@ -0,0 +1,22 @@
+import pytest
+
+from admission import parse_size
+
+
+@pytest.mark.parametrize("value,expected", [
+    ("1048576", 1048576),
+    ("512k", 512 * 1024),
+    ("512KB", 512 * 1024),
+    ("100MB", 100 * 1024 * 1024),
+    ("1.5G", int(1.5 * 1024 ** 3)),
+    (" 2 mb ", 2 * 1024 * 1024),
+    ("0", 0),
+])
+def test_parse_size(value, expected):
+    assert parse_size(value) == expected
+
+
+@pytest.mark.parametrize("value", ["", "MB", "-1MB", "10TB", "ten"])
+def test_parse_size_rejects_malformed_values(value):
+    with pytest.raises(ValueError):
+        parse_size(value)
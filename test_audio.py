@@ -0,0 +1,136 @@
+import numpy as np
+import pytest
+
+from audio import SAMPLE_RATE, SAMPLE_WIDTH, PcmStreamConverter, PolyphaseResampler, split_on_silence
+
+
+def sine(frequency: float, rate: int, seconds: float, amplitude: float = 0.5) -> np.ndarray:
+    t = np.arange(int(rate * seconds)) / rate
+    return (amplitude * np.sin(2 * np.pi * frequency * t)).astype(np.float32)
+
+
+def feed(process, data, sizes):
+    """Feed ``data`` in pieces of the given sizes, cycling through them"""
+    pieces = []
+    position = 0
+    index = 0
+    while position < len(data):
+        size = sizes[index % len(sizes)]
+        pieces.append(process(data[position:position + size]))
+        position += size
+        index += 1
+    return pieces
+
+
+def peak_frequency(samples: np.ndarray, rate: int) -> float:
+    spectrum = np.abs(np.fft.rfft(samples * np.hanning(len(samples))))
+    return np.argmax(spectrum) * rate / len(samples)
+
+
+@pytest.mark.parametrize("input_rate", [8000, 22050, 44100, 48000])
+def test_resampler_chunked_output_matches_one_shot(input_rate):
+    signal = np.random.default_rng(0).uniform(-0.5, 0.5, input_rate).astype(np.float32)
+    whole = PolyphaseResampler(input_rate).process(signal)
+    chunked = np.concatenate(feed(PolyphaseResampler(input_rate).process, signal, [1, 997, 160, 4096, 3]))
+    assert len(chunked) == len(whole)
+    np.testing.assert_allclose(chunked, whole, atol=1e-5)
+
+
+@pytest.mark.parametrize("input_rate", [8000, 44100, 48000])
+def test_resampler_output_length_follows_the_rate_ratio(input_rate):
+    output = PolyphaseResampler(input_rate).process(np.zeros(input_rate * 2, dtype=np.float32))
+    assert abs(len(output) - SAMPLE_RATE * 2) <= 1
+
+
+@pytest.mark.parametrize("input_rate", [8000, 44100, 48000])
+def test_resampler_keeps_a_sine_in_band(input_rate):
+    output = PolyphaseResampler(input_rate).process(sine(1000, input_rate, 1.0))
+    # Skip the filter's start-up transient
+    steady = output[SAMPLE_RATE // 10:]
+    assert peak_frequency(steady, SAMPLE_RATE) == pytest.approx(1000, abs=2)
+    rms = np.sqrt(np.mean(steady ** 2))
+    assert rms == pytest.approx(0.5 / np.sqrt(2), rel=0.02)
+
+
+def test_resampler_removes_content_above_the_output_nyquist():
+    output = PolyphaseResampler(48000).process(sine(11000, 48000, 1.0))
+    rms = np.sqrt(np.mean(output[SAMPLE_RATE // 10:] ** 2))
+    # 11 kHz would alias to 5 kHz; it must be at least 60 dB down instead
+    assert 20 * np.log10(rms / (0.5 / np.sqrt(2))) < -60
+
+
+def test_resampler_rejects_unreasonable_rate_pairs():
+    with pytest.raises(ValueError):
+        PolyphaseResampler(16001)
+
+
+def test_converter_reports_passthrough_only_for_the_model_format():
+    assert PcmStreamConverter().passthrough
+    assert not PcmStreamConverter(48000).passthrough
+    assert not PcmStreamConverter(channels=2).passthrough
+    assert not PcmStreamConverter(sample_format="f32le").passthrough
+
+
+def test_converter_keeps_16k_mono_s16_within_one_step():
+    pcm = (sine(440, SAMPLE_RATE, 0.5) * 32767).astype("<i2")
+    converted = np.frombuffer(PcmStreamConverter().process(pcm.tobytes()), dtype="<i2")
+    assert np.abs(converted.astype(np.int32) - pcm).max() <= 1
+
+
+@pytest.mark.parametrize("sample_format,dtype,scale", [("s16le", "<i2", 32767), ("s32le", "<i4", 2 ** 31 - 1),
+                                                       ("f32le", "<f4", 1.0)])
+def test_converter_chunks_split_mid_sample_match_one_shot(sample_format, dtype, scale):
+    left = sine(440, 48000, 1.0)
+    right = sine(880, 48000, 1.0)
+    data = (np.stack([left, right], axis=1) * scale).astype(dtype).tobytes()
+    whole = PcmStreamConverter(48000, 2, sample_format).process(data)
+    chunked = b"".join(feed(PcmStreamConverter(48000, 2, sample_format).process, data, [3, 1001, 7, 4096]))
+    assert chunked == whole
+
+
+def test_converter_averages_channels():
+    tone = sine(440, SAMPLE_RATE, 0.5)
+    # Opposite channels cancel out, identical ones give the tone itself
+    silent = PcmStreamConverter(SAMPLE_RATE, 2, "f32le").process(np.stack([tone, -tone], axis=1).tobytes())
+    assert not np.frombuffer(silent, dtype="<i2").any()
+    mono = PcmStreamConverter(SAMPLE_RATE, 2, "f32le").process(np.stack([tone, tone], axis=1).tobytes())
+    expected = (np.clip(tone, -1, 1) * 32767).round().astype("<i2")
+    np.testing.assert_array_equal(np.frombuffer(mono, dtype="<i2"), expected)
+
+
+@pytest.mark.parametrize("options", [
+    {"sample_format": "u8"},
+    {"channels": 0},
+    {"channels": 9},
+    {"sample_rate": 4000},
+    {"sample_rate": 384000},
+])
+def test_converter_rejects_unsupported_formats(options):
+    with pytest.raises(ValueError):
+        PcmStreamConverter(**options)
+
+
+def pcm(samples: np.ndarray) -> bytes:
+    return (samples * 32767).astype("<i2").tobytes()
+
+
+def test_split_on_silence_keeps_short_audio_whole():
+    audio = pcm(sine(200, SAMPLE_RATE, 10.0))
+    assert split_on_silence(audio, 60) == [(0, len(audio))]
+
+
+def test_split_on_silence_cuts_inside_pauses():
+    # Five-second phrases separated by one-second pauses
+    phrase = np.concatenate([sine(200, SAMPLE_RATE, 5.0), np.zeros(SAMPLE_RATE, dtype=np.float32)])
+    audio = pcm(np.tile(phrase, 10))
+    segments = split_on_silence(audio, 12)
+    assert len(segments) > 1
+    assert segments[0][0] == 0 and segments[-1][1] == len(audio)
+    for (_, end), (start, _) in zip(segments, segments[1:]):
+        assert end == start
+        assert start % SAMPLE_WIDTH == 0
+        # Every cut falls in the last second of a six-second period
+        assert start / SAMPLE_WIDTH / SAMPLE_RATE % 6 > 5
+    for start, end in segments:
+        assert 6 <= (end - start) / SAMPLE_WIDTH / SAMPLE_RATE <= 18
+
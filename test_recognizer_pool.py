@@ -0,0 +1,99 @@
+import json
+
+import pytest
+
+import recognizer_pool
+from recognizer_pool import MAX_GRAMMAR_PHRASES, RecognizerPool, grammar_key, parse_grammar
+
+
+class FakeRecognizer:
+    def __init__(self, model, sample_rate, grammar=None):
+        self.grammar = grammar
+
+    def SetWords(self, enabled):
+        pass
+
+    def Reset(self):
+        pass
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(recognizer_pool.vosk, "KaldiRecognizer", FakeRecognizer)
+    return RecognizerPool({"en": object()}, max_size=2, max_grammars=2)
+
+
+@pytest.mark.parametrize("value", [
+    '["yes", "no", "[unk]"]',
+    "yes,no,[unk]",
+    "[unk], No ,YES",
+    ["no", "yes", "[unk]", "yes"],
+])
+def test_parse_grammar_normalizes_phrase_lists(value):
+    assert json.loads(parse_grammar(value)) == ["[unk]", "no", "yes"]
+
+
+def test_parse_grammar_collapses_whitespace_inside_phrases():
+    assert json.loads(parse_grammar('["Talk  to\\tan agent"]')) == ["talk to an agent"]
+
+
+@pytest.mark.parametrize("value", [None, "", "  ", "[]", ",,", []])
+def test_parse_grammar_without_phrases_is_the_full_vocabulary(value):
+    assert parse_grammar(value) is None
+
+
+@pytest.mark.parametrize("value", ["[1, 2]", '["yes", null]', [1]])
+def test_parse_grammar_rejects_non_phrases(value):
+    with pytest.raises(ValueError):
+        parse_grammar(value)
+
+
+def test_parse_grammar_limits_the_number_of_phrases():
+    with pytest.raises(ValueError):
+        parse_grammar([f"phrase {i}" for i in range(MAX_GRAMMAR_PHRASES + 1)])
+
+
+def test_grammar_key_identifies_equivalent_grammars():
+    assert grammar_key(None) == ""
+    assert grammar_key(parse_grammar("yes,no")) == grammar_key(parse_grammar('["NO", "yes"]'))
+    assert grammar_key(parse_grammar("yes,no")) != grammar_key(parse_grammar("yes"))
+
+
+def test_pool_reuses_recognizers_per_grammar(pool):
+    grammar = parse_grammar("yes,no")
+    with pool.checkout("en", 16000, grammar) as first:
+        assert first.grammar == grammar
+    with pool.checkout("en", 16000) as plain:
+        assert plain.grammar is None
+    with pool.checkout("en", 16000, grammar) as again:
+        assert again is first
+    assert pool.stats()["hits"] == 1
+
+
+def test_pool_keeps_only_the_most_recently_used_grammars(pool):
+    grammars = [parse_grammar(f"yes,option {i}") for i in range(3)]
+    recognizers = {}
+    for grammar in grammars:
+        with pool.checkout("en", 16000, grammar) as rec:
+            recognizers[grammar] = rec
+    with pool.checkout("en", 16000) as plain:
+        pass
+    stats = pool.stats()
+    assert stats["grammars"] == 2
+    assert stats["discarded"] == 1
+    # The oldest grammar is compiled again; the full-vocabulary recognizer is never evicted
+    with pool.checkout("en", 16000, grammars[0]) as rec:
+        assert rec is not recognizers[grammars[0]]
+    with pool.checkout("en", 16000) as rec:
+        assert rec is plain
+
+
+def test_pool_counts_hits_misses_and_discarded_recognizers(pool):
+    with pool.checkout("en", 16000):
+        pass
+    with pool.checkout("en", 16000):
+        pass
+    with pytest.raises(RuntimeError):
+        with pool.checkout("en", 16000):
+            raise RuntimeError("decoder failed")
+    assert pool.counters() == {"hits": 2, "misses": 1, "discarded": 1}
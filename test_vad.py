@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+
+from audio import SAMPLE_RATE, SAMPLE_WIDTH
+from vad import TimeMap, VoiceActivityDetector
+
+
+def tone(seconds: float) -> bytes:
+    t = np.arange(int(SAMPLE_RATE * seconds)) / SAMPLE_RATE
+    return (0.3 * 32767 * np.sin(2 * np.pi * 200 * t)).astype("<i2").tobytes()
+
+
+def silence(seconds: float) -> bytes:
+    return bytes(int(SAMPLE_RATE * seconds) * SAMPLE_WIDTH)
+
+
+def seconds(pcm: bytes) -> float:
+    return len(pcm) / (SAMPLE_RATE * SAMPLE_WIDTH)
+
+
+def run(vad: VoiceActivityDetector, pcm: bytes, chunk_size: int) -> bytes:
+    return b"".join(vad.filter(pcm[start:start + chunk_size] for start in range(0, len(pcm), chunk_size)))
+
+
+# One second of speech, a three-second pause, one second of speech
+RECORDING = tone(1.0) + silence(3.0) + tone(1.0)
+
+
+def test_time_map_shifts_times_after_each_cut():
+    time_map = TimeMap()
+    time_map.add(1.5, 2.0)
+    time_map.add(3.0, 2.5)
+    assert time_map.to_input(1.0) == 1.0
+    assert time_map.to_input(2.0) == 4.0
+    assert time_map.to_input(3.2) == pytest.approx(5.7)
+
+
+def test_time_map_keeps_an_end_at_a_cut_before_the_removed_silence():
+    time_map = TimeMap()
+    time_map.add(1.5, 2.0)
+    assert time_map.to_input(1.5) == 3.5
+    assert time_map.to_input(1.5, end=True) == 1.5
+
+
+def test_time_map_rewrites_recognizer_results():
+    time_map = TimeMap()
+    time_map.add(1.5, 2.0)
+    result = {"result": [{"word": "a", "start": 0.2, "end": 0.6}, {"word": "b", "start": 1.6, "end": 1.9}]}
+    time_map.remap_result(result)
+    assert [(word["start"], word["end"]) for word in result["result"]] == [(0.2, 0.6), (3.6, 3.9)]
+
+
+def test_vad_shortens_long_silence_to_max_silence():
+    vad = VoiceActivityDetector(max_silence_ms=1000)
+    output = run(vad, RECORDING, 8000)
+    assert seconds(output) == pytest.approx(3.0, abs=0.02)
+    assert vad.dropped_seconds == pytest.approx(2.0, abs=0.02)
+    assert vad.input_bytes == len(RECORDING)
+    assert vad.output_bytes == len(output)
+
+
+def test_vad_keeps_short_pauses():
+    pcm = tone(1.0) + silence(0.4) + tone(1.0)
+    vad = VoiceActivityDetector(max_silence_ms=1000)
+    assert run(vad, pcm, 8000) == pcm
+    assert vad.dropped_bytes == 0
+
+
+@pytest.mark.parametrize("chunk_size", [7, 333, 640, 8000, 1 << 20])
+def test_vad_output_does_not_depend_on_chunk_size(chunk_size):
+    whole = run(VoiceActivityDetector(), RECORDING, len(RECORDING))
+    assert run(VoiceActivityDetector(), RECORDING, chunk_size) == whole
+
+
+def test_vad_maps_times_back_through_dropped_silence():
+    vad = VoiceActivityDetector(max_silence_ms=1000)
+    run(vad, RECORDING, 8000)
+    frame = 0.02
+    # The second tone starts at 2.0 s in the output and at 4.0 s in the original
+    assert vad.time_map.to_input(2.0) == pytest.approx(4.0, abs=frame)
+    # Speech before the cut is unchanged, and so is a word ending right at it
+    assert vad.time_map.to_input(0.7) == pytest.approx(0.7)
+    assert vad.time_map.to_input(1.5, end=True) == pytest.approx(1.5, abs=frame)
+    # The pre-roll kept before the second tone is the end of the original pause
+    assert vad.time_map.to_input(1.6) == pytest.approx(3.6, abs=frame)
+
+
+def test_vad_drops_trailing_silence_at_the_end_of_the_stream():
+    vad = VoiceActivityDetector(max_silence_ms=1000)
+    output = run(vad, tone(1.0) + silence(5.0), 8000)
+    assert seconds(output) == pytest.approx(1.5, abs=0.02)
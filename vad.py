@@ -0,0 +1,184 @@
+from bisect import bisect_left, bisect_right
+from typing import Iterable, Iterator, List
+
+import numpy as np
+
+from audio import SAMPLE_RATE, SAMPLE_WIDTH
+
+# Frames are classified every 20 ms
+FRAME_MS = 20
+
+# Full-scale RMS of 16-bit audio, for converting energy to dBFS
+FULL_SCALE = 32768.0
+
+
+class TimeMap:
+    """Maps times in silence-compressed audio back to the original audio
+
+    Each entry says that from ``output_time`` on, ``offset`` seconds of
+    audio had been removed before that point.
+    """
+
+    def __init__(self):
+        self.output_times: List[float] = []
+        self.offsets: List[float] = []
+
+    def add(self, output_time: float, offset: float) -> None:
+        if self.output_times and self.output_times[-1] == output_time:
+            self.offsets[-1] = offset
+        else:
+            self.output_times.append(output_time)
+            self.offsets.append(offset)
+
+    def to_input(self, time: float, end: bool = False) -> float:
+        """Original time of ``time``; an ``end`` time at a cut stays before the removed silence"""
+        index = (bisect_left if end else bisect_right)(self.output_times, time) - 1
+        return time + self.offsets[index] if index >= 0 else time
+
+    def remap_result(self, result: dict) -> dict:
+        """Rewrite the word timestamps of a recognizer result in place"""
+        for word in result.get("result", []):
+            word["start"] = round(self.to_input(word["start"]), 6)
+            word["end"] = round(self.to_input(word["end"], end=True), 6)
+        return result
+
+
+class VoiceActivityDetector:
+    """Energy and zero-crossing-rate VAD that shortens long silences in 16-bit mono PCM
+
+    A frame is speech when its energy is above ``energy_threshold`` dBFS, or
+    within 10 dB below it with a zero-crossing rate above ``zcr_threshold``
+    (quiet fricatives such as "s" and "f"). Frames up to ``hangover_ms``
+    after speech count as speech too. Silences longer than
+    ``max_silence_ms`` are cut down to that length, keeping half of it after
+    the preceding speech (so the recognizer still detects the end of the
+    utterance) and half before the next speech (so soft onsets survive).
+
+    The detector is stateful: feed audio in any chunk sizes with
+    ``process()``, then call ``flush()``. ``time_map`` maps recognizer
+    timestamps back to the original audio.
+    """
+
+    def __init__(
+        self,
+        sample_rate: int = SAMPLE_RATE,
+        energy_threshold: float = -45.0,
+        zcr_threshold: float = 0.25,
+        hangover_ms: int = 300,
+        max_silence_ms: int = 1000,
+    ):
+        self.sample_rate = sample_rate
+        self.frame_samples = sample_rate * FRAME_MS // 1000
+        self.frame_bytes = self.frame_samples * SAMPLE_WIDTH
+        self.energy_threshold = energy_threshold
+        self.zcr_threshold = zcr_threshold
+        self.hangover_frames = max(0, hangover_ms // FRAME_MS)
+        half_silence = max(0, max_silence_ms // FRAME_MS // 2)
+        # Silent frames kept after speech (including the hangover) and before it
+        self.head_frames = max(self.hangover_frames, half_silence)
+        self.tail_frames = half_silence
+        self.time_map = TimeMap()
+        self.input_bytes = 0
+        self.dropped_bytes = 0
+        self.output_bytes = 0
+        # Undecided audio: a partial frame, or silence that may become pre-roll
+        self._pending = b""
+        # Frames since the last speech frame, before the pending audio
+        self._since_speech = 1 << 30
+        # Dropped frames accounted for in the last time map entry
+        self._mapped_drops = 0
+
+    @property
+    def dropped_seconds(self) -> float:
+        return self.dropped_bytes / (self.sample_rate * SAMPLE_WIDTH)
+
+    def _classify(self, frames: np.ndarray) -> np.ndarray:
+        samples = frames.astype(np.float32)
+        rms = np.sqrt(np.mean(samples * samples, axis=1))
+        energy = 20 * np.log10(np.maximum(rms, 1.0) / FULL_SCALE)
+        signs = np.signbit(frames)
+        zcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / (frames.shape[1] - 1)
+        loud = energy > self.energy_threshold
+        fricative = (energy > self.energy_threshold - 10) & (zcr > self.zcr_threshold)
+        return loud | fricative
+
+    def process(self, data: bytes) -> bytes:
+        """Feed PCM and return the audio to pass on to the recognizer"""
+        self.input_bytes += len(data)
+        data = self._pending + data
+        count = len(data) // self.frame_bytes
+        if count == 0:
+            self._pending = data
+            return b""
+
+        frames = np.frombuffer(data, dtype=np.int16, count=count * self.frame_samples).reshape(count, -1)
+        speech = self._classify(frames)
+        index = np.arange(count)
+
+        # Frames since the most recent speech frame, continuing from the previous chunk
+        last_speech = np.maximum.accumulate(np.where(speech, index, -1))
+        since = np.where(last_speech >= 0, index - last_speech, self._since_speech + index + 1)
+        keep = since <= self.head_frames
+
+        # Silence shortly before speech in this chunk is kept as pre-roll
+        next_speech = np.minimum.accumulate(np.where(speech, index, count)[::-1])[::-1]
+        keep |= (next_speech < count) & (next_speech - index <= self.tail_frames)
+
+        # Trailing silence can't be decided until we know whether speech follows
+        undecided = 0
+        if not keep[-1]:
+            after_speech = next_speech == count
+            decided_mask = keep | ~after_speech
+            decided = int(np.flatnonzero(decided_mask)[-1]) + 1 if decided_mask.any() else 0
+            undecided = min(count - decided, self.tail_frames)
+        decided = count - undecided
+
+        output = self._emit(frames[:decided], keep[:decided])
+        if decided:
+            self._since_speech = int(since[decided - 1])
+        self._pending = data[decided * self.frame_bytes:]
+        return output
+
+    def _emit(self, frames: np.ndarray, keep: np.ndarray) -> bytes:
+        if not len(frames):
+            return b""
+        kept = np.flatnonzero(keep)
+        if len(kept):
+            # A new map entry wherever the dropped count changed since the previous kept frame
+            drops = (self.dropped_bytes // self.frame_bytes + np.cumsum(~keep))[kept]
+            previous = np.concatenate(([self._mapped_drops], drops[:-1]))
+            output_frames = self.output_bytes // self.frame_bytes + np.arange(len(kept))
+            frame_seconds = FRAME_MS / 1000
+            for position in np.flatnonzero(drops != previous):
+                self.time_map.add(output_frames[position] * frame_seconds, drops[position] * frame_seconds)
+            self._mapped_drops = int(drops[-1])
+
+        dropped = len(frames) - len(kept)
+        self.dropped_bytes += dropped * self.frame_bytes
+        output = frames[kept].tobytes() if dropped else frames.tobytes()
+        self.output_bytes += len(output)
+        return output
+
+    def flush(self) -> bytes:
+        """Return the rest of the audio at the end of the stream
+
+        Held-back silence is dropped, since no speech follows it; a partial
+        frame right after speech is passed through.
+        """
+        pending, self._pending = self._pending, b""
+        if pending and len(pending) < self.frame_bytes and self._since_speech < self.head_frames:
+            self.output_bytes += len(pending)
+            return pending
+        self.dropped_bytes += len(pending)
+        return b""
+
+    def filter(self, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """Pass PCM chunks through the detector, skipping ones that end up empty"""
+        for chunk in chunks:
+            output = self.process(chunk)
+            if output:
+                yield output
+        output = self.flush()
+        if output:
+            yield output
+
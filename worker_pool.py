@@ -0,0 +1,138 @@
+import asyncio
+import logging
+import signal
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class PoolBusyError(Exception):
+    """Raised when the transcription queue is full"""
+
+
+def _noop() -> None:
+    """Used to force worker processes to start before the first request"""
+
+
+def _worker_initializer(initializer: Optional[Callable[[], None]]) -> None:
+    """Prepare a freshly started worker process"""
+    # Ctrl+C is delivered to the whole process group; let the parent decide
+    # when workers stop instead of every worker dying mid-decode.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if initializer is not None:
+        initializer()
+
+
+class TranscriptionPool:
+    """Pre-warmed process pool that runs blocking transcription work off the event loop
+
+    Every worker runs ``initializer`` once when it starts (typically loading the
+    VOSK models), so requests only pay for the decode itself. At most
+    ``workers + queue_size`` jobs are accepted at a time; callers beyond that
+    either get a ``PoolBusyError`` or wait for a free slot. Background jobs,
+    which their callers limit themselves, don't take a slot.
+    """
+
+    def __init__(self, workers: int, queue_size: int, initializer: Optional[Callable[[], None]] = None):
+        self.workers = max(1, workers)
+        self.queue_size = max(0, queue_size)
+        self.initializer = initializer
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._in_flight = 0
+        self._background = 0
+
+    @property
+    def capacity(self) -> int:
+        return self.workers + self.queue_size
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    @property
+    def background(self) -> int:
+        """Number of accepted background jobs"""
+        return self._background
+
+    @property
+    def busy(self) -> bool:
+        """Whether ``run`` without ``wait`` would raise ``PoolBusyError`` right now"""
+        return self._executor is None or self._slots is None or self._slots.locked()
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of accepted jobs still waiting for a worker"""
+        return max(0, self._in_flight - self.workers)
+
+    def _create_executor(self) -> ProcessPoolExecutor:
+        executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=_worker_initializer,
+            initargs=(self.initializer,),
+        )
+        # Start every worker now so model loading happens at startup,
+        # not on the first request.
+        for future in [executor.submit(_noop) for _ in range(self.workers)]:
+            future.result()
+        return executor
+
+    def start(self) -> None:
+        """Start the worker processes and wait until they are ready"""
+        logger.info(f"Starting transcription pool with {self.workers} workers (queue size {self.queue_size})")
+        self._executor = self._create_executor()
+        self._slots = asyncio.Semaphore(self.capacity)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def run(self, fn: Callable[..., Any], *args: Any, wait: bool = False, background: bool = False) -> Any:
+        """Run ``fn(*args)`` in a worker process
+
+        When the pool is saturated, raise ``PoolBusyError`` unless ``wait`` is
+        set. A ``background`` job is queued without taking a slot.
+        """
+        if self._executor is None or self._slots is None:
+            raise PoolBusyError("Transcription pool is not running")
+        if background:
+            self._background += 1
+            try:
+                return await self._submit(fn, *args)
+            finally:
+                self._background -= 1
+        if not wait and self._slots.locked():
+            raise PoolBusyError(f"Transcription queue is full ({self.capacity} jobs in flight)")
+
+        async with self._slots:
+            return await self._submit(fn, *args)
+
+    async def _submit(self, fn: Callable[..., Any], *args: Any) -> Any:
+        executor = self._executor
+        if executor is None:
+            raise PoolBusyError("Transcription pool is restarting")
+        self._in_flight += 1
+        try:
+            return await asyncio.wrap_future(executor.submit(fn, *args))
+        except BrokenProcessPool:
+            # A worker died (e.g. a native crash in Kaldi). Replace the pool
+            # once so later requests still have somewhere to run.
+            if self._executor is executor:
+                logger.error("Transcription worker died, restarting pool")
+                self.shutdown()
+                self._executor = await asyncio.get_running_loop().run_in_executor(None, self._create_executor)
+            raise
+        finally:
+            self._in_flight -= 1
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "background": self.background,
+        }